@@ -0,0 +1,125 @@
+"""
+Compare the connect and send cost of the room and user fan-out modes.
+
+    python -m benchmarks.fanout_modes --sizes 10 100 1000 --rooms-per-user 50
+
+Pass ``--redis redis://localhost:6379/0`` to measure against channels_redis
+instead of the in-memory channel layer.
+"""
+import argparse
+import asyncio
+
+from benchmarks.base import emit, measure, setup_django
+
+
+def build_fixtures(sizes: list[int], rooms_per_user: int) -> dict:
+    from django.contrib.auth import get_user_model
+
+    from df_chat.models import ChatMember, ChatRoom
+
+    User = get_user_model()
+    users = User.objects.bulk_create(
+        User(username=f"bench-{i}") for i in range(max(sizes))
+    )
+    connecting_user = users[0]
+
+    member_rooms = ChatRoom.objects.bulk_create(
+        ChatRoom(title=f"member-{i}", chat_type="group") for i in range(rooms_per_user)
+    )
+    sized_rooms = ChatRoom.objects.bulk_create(
+        ChatRoom(title=f"size-{size}", chat_type="group") for size in sizes
+    )
+    ChatMember.objects.bulk_create(
+        [ChatMember(user=connecting_user, chat_room=room) for room in member_rooms]
+        + [
+            ChatMember(user=user, chat_room=room)
+            for room, size in zip(sized_rooms, sizes)
+            for user in users[:size]
+        ]
+    )
+    return {
+        "connecting_user": connecting_user,
+        "rooms": dict(zip(sizes, sized_rooms)),
+        "users": users,
+    }
+
+
+async def run_mode(mode: str, fixtures: dict, iterations: int) -> dict:
+    from asgiref.sync import sync_to_async
+    from channels.layers import get_channel_layer
+
+    from df_chat.asgi.consumers import ChatConsumer
+    from df_chat.constants import ROOM_CHAT_ALIAS, USER_CHAT_ALIAS
+    from df_chat.dispatchers import send_group_events
+    from df_chat.fanout import room_groups
+    from df_chat.settings import api_settings
+    from df_chat.utils import group_add_many
+
+    api_settings.FANOUT_MODE = mode
+    channel_layer = get_channel_layer()
+    await channel_layer.flush()
+
+    async def connect() -> None:
+        consumer = ChatConsumer()
+        consumer.user = fixtures["connecting_user"]
+        consumer.channel_layer = channel_layer
+        consumer.channel_name = await channel_layer.new_channel()
+        await consumer.subscribe()
+
+    send_results: dict[int, dict[str, float]] = {}
+    results = {"connect": await measure(connect, iterations), "send": send_results}
+
+    for size, room in fixtures["rooms"].items():
+        memberships = []
+        for user in fixtures["users"][:size]:
+            channel_name = await channel_layer.new_channel()
+            group = (
+                USER_CHAT_ALIAS.format(user_id=user.id)
+                if mode == "user"
+                else ROOM_CHAT_ALIAS.format(room_id=room.id)
+            )
+            memberships.append((group, channel_name))
+        await group_add_many(channel_layer, memberships)
+
+        event = {"type": "chat.message.new", "chat_room": room.id, "message": "hi"}
+
+        async def send(room_id: int = room.id, event: dict = event) -> None:
+            # Resolving the groups is part of the cost, the member index is warm.
+            groups = await sync_to_async(room_groups)(room_id)
+            await send_group_events(channel_layer, [(g, event) for g in groups])
+
+        send_results[size] = await measure(send, iterations)
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--rooms-per-user", type=int, default=100)
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--redis", default=None)
+    parser.add_argument("--output", default=None)
+    args = parser.parse_args()
+
+    setup_django(args.redis)
+    from asgiref.sync import sync_to_async
+
+    async def run() -> dict:
+        fixtures = await sync_to_async(build_fixtures)(args.sizes, args.rooms_per_user)
+        return {
+            mode: await run_mode(mode, fixtures, args.iterations)
+            for mode in ("room", "user")
+        }
+
+    emit(
+        {
+            "benchmark": "fanout_modes",
+            "rooms_per_user": args.rooms_per_user,
+            "results": asyncio.run(run()),
+        },
+        args.output,
+    )
+
+
+if __name__ == "__main__":
+    main()
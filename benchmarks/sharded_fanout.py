@@ -0,0 +1,113 @@
+"""
+Measure the fan-out time of a large room against its number of fan-out shards.
+
+    python -m benchmarks.sharded_fanout --connections 5000 --shards 1 4 16 64
+
+``publish`` is the time to hand one event to every group of the room,
+``deliver`` also waits until every connection received it. The in-memory
+channel layer walks every channel of every group in one process, so shards
+only pay off with channels_redis. Pass
+``--redis redis://localhost:6379/0`` to measure against channels_redis, where
+each group is sent with its own round trip and shards spread over its hosts.
+"""
+import argparse
+import asyncio
+import time
+
+from benchmarks.base import emit, measure, setup_django, summarize
+
+
+def build_rooms(shard_counts: list[int]) -> dict[int, int]:
+    from django.contrib.auth import get_user_model
+
+    from df_chat.models import ChatMember, ChatRoom
+
+    User = get_user_model()
+    owner = User.objects.create(username="bench-owner")
+    rooms = ChatRoom.objects.bulk_create(
+        ChatRoom(title=f"shards-{shards}", chat_type="group", fanout_shards=shards)
+        for shards in shard_counts
+    )
+    # The room policy, shards included, is loaded with the members.
+    ChatMember.objects.bulk_create(
+        ChatMember(user=owner, chat_room=room) for room in rooms
+    )
+    return {shards: room.id for shards, room in zip(shard_counts, rooms)}
+
+
+async def run_room(
+    room_id: int, shards: int, connections: int, iterations: int
+) -> dict:
+    from asgiref.sync import sync_to_async
+    from channels.layers import get_channel_layer
+
+    from df_chat.dispatchers import send_group_events
+    from df_chat.fanout import room_group, room_groups
+    from df_chat.utils import group_add_many, group_discard_many
+
+    channel_layer = get_channel_layer()
+    channel_names = [await channel_layer.new_channel() for _ in range(connections)]
+    memberships = [
+        (room_group(room_id, shards, channel_name), channel_name)
+        for channel_name in channel_names
+    ]
+    await group_add_many(channel_layer, memberships)
+    event = {"type": "chat.message.new", "chat_room": room_id, "message": "hi"}
+
+    async def publish() -> None:
+        # Resolving the groups is part of the cost, the member index is warm.
+        groups = await sync_to_async(room_groups)(room_id)
+        await send_group_events(channel_layer, [(g, event) for g in groups])
+
+    async def drain() -> None:
+        await asyncio.gather(*map(channel_layer.receive, channel_names))
+
+    async def deliver() -> None:
+        await asyncio.gather(publish(), drain())
+
+    # Every publish has to be drained, or channels fill up and drop events.
+    publish_samples = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        await publish()
+        publish_samples.append(time.perf_counter() - started)
+        await drain()
+    results = {
+        "publish": summarize(publish_samples),
+        "deliver": await measure(deliver, iterations),
+    }
+    await group_discard_many(channel_layer, memberships)
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--connections", type=int, default=2000)
+    parser.add_argument("--shards", type=int, nargs="+", default=[1, 4, 16, 64])
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--redis", default=None)
+    parser.add_argument("--output", default=None)
+    args = parser.parse_args()
+
+    setup_django(args.redis)
+    from asgiref.sync import sync_to_async
+
+    async def run() -> dict:
+        rooms = await sync_to_async(build_rooms)(args.shards)
+        return {
+            shards: await run_room(room_id, shards, args.connections, args.iterations)
+            for shards, room_id in rooms.items()
+        }
+
+    emit(
+        {
+            "benchmark": "sharded_fanout",
+            "connections": args.connections,
+            "results": asyncio.run(run()),
+        },
+        args.output,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,24 @@
+from typing import Any, Optional
+
 from django.contrib import admin
+from django.db import transaction
+from django.db.models import QuerySet
+from django.http import HttpRequest
 
-from df_chat.models import ChatMember, ChatMessage, ChatRoom, MemberChannel
+from df_chat import members, search
+from df_chat.models import (
+    ArchivedChatMessage,
+    ChatMember,
+    ChatMessage,
+    ChatRoom,
+    MemberChannel,
+)
 
 
 @admin.register(MemberChannel)
 class MemberChannelAdmin(admin.ModelAdmin):
     list_display = ("id", "created", "user")
+    list_select_related = ("user",)
 
 
 class ChatUserInline(admin.TabularInline):
@@ -14,9 +27,17 @@ class ChatUserInline(admin.TabularInline):
 
 @admin.register(ChatRoom)
 class ChatRoomAdmin(admin.ModelAdmin):
-    list_display = ("id", "created", "title")
+    list_display = ("id", "created", "title", "last_activity_at", "message_count")
+    list_filter = ("admins_only_posting",)
     inlines = (ChatUserInline,)
 
+    def save_model(
+        self, request: HttpRequest, obj: ChatRoom, form: Any, change: bool
+    ) -> None:
+        super().save_model(request, obj, form, change)
+        if change and "fanout_shards" in form.changed_data:
+            members.move_shards(obj, form.initial["fanout_shards"])
+
 
 @admin.register(ChatMember)
 class ChatMembersAdmin(admin.ModelAdmin):
@@ -25,6 +46,7 @@ class ChatMembersAdmin(admin.ModelAdmin):
         "user",
         "chat_room",
     )
+    list_select_related = ("user", "chat_room")
 
 
 @admin.register(ChatMessage)
@@ -34,3 +56,42 @@ class ChatMessageAdmin(admin.ModelAdmin):
         "created_by",
         "message",
     )
+    list_select_related = ("created_by",)
+
+    def delete_model(self, request: HttpRequest, obj: ChatMessage) -> None:
+        with transaction.atomic():
+            message_id = obj.id
+            super().delete_model(request, obj)
+            ChatRoom.objects.record_message_removal(obj.chat_room_id, message_id)
+            obj.id = message_id
+            ChatMember.objects.record_message_removal(obj)
+            search.remove_messages([message_id])
+
+    def delete_queryset(self, request: HttpRequest, queryset: QuerySet) -> None:
+        rows = list(queryset.values_list("id", "chat_room_id"))
+        room_ids = {room_id for _, room_id in rows}
+        with transaction.atomic():
+            ChatMember.objects.record_message_removals(queryset)
+            super().delete_queryset(request, queryset)
+            search.remove_messages(message_id for message_id, _ in rows)
+            ChatRoom.objects.filter(pk__in=room_ids).refresh_summary()
+
+
+@admin.register(ArchivedChatMessage)
+class ArchivedChatMessageAdmin(admin.ModelAdmin):
+    list_display = (
+        "id",
+        "created",
+        "created_by",
+        "message",
+        "archived_at",
+    )
+    list_select_related = ("created_by",)
+
+    def has_add_permission(self, request: HttpRequest) -> bool:
+        return False
+
+    def has_change_permission(
+        self, request: HttpRequest, obj: Optional[ArchivedChatMessage] = None
+    ) -> bool:
+        return False
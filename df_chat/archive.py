@@ -0,0 +1,74 @@
+"""
+Archival of old messages.
+
+Messages older than ``ARCHIVE_AFTER_DAYS`` are moved from ``ChatMessage`` to
+``ArchivedChatMessage`` in batches of ``ARCHIVE_BATCH_SIZE``, one transaction
+per batch, so the hot table and its indexes stay small. Messages are archived
+in ``(created, id)`` order, oldest first, so every archived message sorts
+before every hot one in that order; readers rely on that to page through both
+tiers in order.
+"""
+from datetime import datetime, timedelta
+from typing import Optional
+
+from django.db import transaction
+from django.utils import timezone
+
+from df_chat.models import ArchivedChatMessage, ChatMessage
+from df_chat.settings import api_settings
+
+ARCHIVED_FIELDS = (
+    "id",
+    "created",
+    "modified",
+    "chat_room_id",
+    "created_by_id",
+    "message",
+)
+
+
+def archive_batch(cutoff: datetime, batch_size: int) -> int:
+    """
+    Move up to ``batch_size`` of the oldest messages created before
+    ``cutoff`` and return how many were moved.
+    """
+    with transaction.atomic():
+        # Locked rows are waited for, not skipped: a skipped message would
+        # stay hot behind archived ones.
+        rows = list(
+            ChatMessage.objects.filter(created__lt=cutoff)
+            .order_by("created", "id")
+            .select_for_update()
+            .values(*ARCHIVED_FIELDS)[:batch_size]
+        )
+        if not rows:
+            return 0
+        ArchivedChatMessage.objects.bulk_create(
+            [ArchivedChatMessage(**row) for row in rows], ignore_conflicts=True
+        )
+        ChatMessage.objects.filter(id__in=[row["id"] for row in rows]).delete()
+    return len(rows)
+
+
+def archive_messages(
+    older_than: Optional[timedelta] = None,
+    batch_size: Optional[int] = None,
+    max_batches: Optional[int] = None,
+) -> int:
+    """
+    Archive every message older than ``older_than`` and return the count.
+    """
+    if older_than is None:
+        older_than = timedelta(days=api_settings.ARCHIVE_AFTER_DAYS)
+    batch_size = batch_size or api_settings.ARCHIVE_BATCH_SIZE
+    cutoff = timezone.now() - older_than
+
+    archived = 0
+    batches = 0
+    while max_batches is None or batches < max_batches:
+        moved = archive_batch(cutoff, batch_size)
+        if not moved:
+            break
+        archived += moved
+        batches += 1
+    return archived
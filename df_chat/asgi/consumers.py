@@ -1,17 +1,34 @@
+import asyncio
 import json
+import time
 import typing
 
 from channels.db import database_sync_to_async
 from channels.generic.websocket import AsyncWebsocketConsumer
 from rest_framework.utils.serializer_helpers import ReturnDict
 
-from df_chat.constants import (
-    ROOM_CHAT_ALIAS,
-    SYSTEM_CHAT_ALIAS,
-    USER_CHAT_ALIAS,
-)
+from df_chat import membership, replay
+from df_chat.constants import SYSTEM_CHAT_ALIAS, USER_CHAT_ALIAS
 from df_chat.drf.serializers import ChatMessageSerializer
-from df_chat.models import MemberChannel
+from df_chat.encoders import dumps
+from df_chat.ephemeral import ACTIVITY_FRAMES, get_activity_buffer
+from df_chat.fanout import is_user_fanout, room_group
+from df_chat.ingest import get_write_buffer
+from df_chat.metrics import metrics
+from df_chat.outbound import SLOW_CONSUMER_CLOSE_CODE, OutboundQueue
+from df_chat.presence import get_presence_tracker
+from df_chat.reaper import ensure_reaper
+from df_chat.receipts import get_read_buffer
+from df_chat.settings import api_settings
+from df_chat.utils import group_add_many, group_discard_many
+
+# Client frame types and the handler serving them.
+FRAME_HANDLERS = {
+    "chat.message.new": "receive_message",
+    "chat.sync": "sync_messages",
+    "chat.read": "mark_read",
+    **{frame_type: "report_activity" for frame_type in ACTIVITY_FRAMES},
+}
 
 
 class ChatConsumer(AsyncWebsocketConsumer):
@@ -20,90 +37,252 @@ class ChatConsumer(AsyncWebsocketConsumer):
     ) -> None:
         super().__init__(*args, **kwargs)
         self.user: typing.Any = None
-
-    async def _unsubscribe_user_individual_room(self) -> None:
-        await self.channel_layer.group_discard(
-            USER_CHAT_ALIAS.format(user_id=self.user.id), self.channel_name
-        )
-
-    async def _subscribe_user_individual_room(self) -> None:
-        await self.channel_layer.group_add(
-            USER_CHAT_ALIAS.format(user_id=self.user.id), self.channel_name
-        )
+        # Rooms subscribed on connect and their fan-out shards, also left on
+        # disconnect.
+        self.room_shards: dict[int, int] = {}
+        self.outbound: typing.Optional[OutboundQueue] = None
 
     @database_sync_to_async
     def get_user_group_ids(self) -> list[int]:
         return list(self.user.chatmember_set.values_list("chat_room", flat=True))
 
-    async def _unsubscribe_chat_rooms(self) -> None:
-        chat_membership_ids = await self.get_user_group_ids()
-        for room_pk in chat_membership_ids:
-            await self.channel_layer.group_discard(
-                ROOM_CHAT_ALIAS.format(room_id=room_pk), self.channel_name
-            )
-
-    async def _subscribe_chat_rooms(self) -> None:
-        chat_membership_ids = await self.get_user_group_ids()
-        for room_pk in chat_membership_ids:
-            await self.channel_layer.group_add(
-                ROOM_CHAT_ALIAS.format(room_id=room_pk), self.channel_name
+    @database_sync_to_async
+    def get_user_room_shards(self) -> dict[int, int]:
+        return dict(
+            self.user.chatmember_set.values_list(
+                "chat_room", "chat_room__fanout_shards"
             )
+        )
 
-    async def _unsubscribe_system_room(self) -> None:
-        await self.channel_layer.group_discard(SYSTEM_CHAT_ALIAS, self.channel_name)
-
-    async def _subscribe_system_room(self) -> None:
-        await self.channel_layer.group_add(SYSTEM_CHAT_ALIAS, self.channel_name)
+    def _memberships(self, room_shards: dict[int, int]) -> list[tuple[str, str]]:
+        groups = [
+            SYSTEM_CHAT_ALIAS,
+            USER_CHAT_ALIAS.format(user_id=self.user.id),
+            *(
+                room_group(room_id, shards, self.channel_name)
+                for room_id, shards in room_shards.items()
+            ),
+        ]
+        return [(group, self.channel_name) for group in groups]
 
     async def subscribe(self) -> None:
-        await self._subscribe_system_room()
-        await self._subscribe_user_individual_room()
-        await self._subscribe_chat_rooms()
+        with metrics.timer("chat.subscribe.seconds"):
+            if not is_user_fanout():
+                with metrics.timer("chat.consumer.subscribe.db.seconds"):
+                    self.room_shards = await self.get_user_room_shards()
+            await group_add_many(
+                self.channel_layer, self._memberships(self.room_shards)
+            )
 
     async def unsubscribe(self) -> None:
-        await self._unsubscribe_system_room()
-        await self._unsubscribe_user_individual_room()
-        await self._unsubscribe_chat_rooms()
+        memberships = set(self._memberships(self.room_shards))
+        if not is_user_fanout():
+            # Rooms joined since connect were subscribed by the m2m signal.
+            with metrics.timer("chat.consumer.unsubscribe.db.seconds"):
+                current = await self.get_user_room_shards()
+            memberships.update(self._memberships(current))
+        await group_discard_many(self.channel_layer, memberships)
 
     async def connect(self) -> None:
         self.user = self.scope["user"]
         if not self.user.is_authenticated:
             await self.close()
             return
-        await self.accept()
-        await self.set_member_channel(is_online=True)
-        await self.subscribe()
+        with metrics.timer("chat.connect.seconds"):
+            await get_presence_tracker().connect(self.user.id, self.channel_name)
+            ensure_reaper()
+            await self.subscribe()
+            await self.accept()
+            self.outbound = OutboundQueue(self.send_frame)
+            self.outbound.start()
+        metrics.adjust_gauge("chat.connections.active", 1)
+        metrics.observe("chat.connect.rooms", len(self.room_shards))
 
-    async def disconnect(self) -> None:
-        await self.unsubscribe()
-        await self.set_member_channel(is_online=False)
+    async def disconnect(self, code: int) -> None:
+        if self.outbound is not None:
+            self.outbound.stop()
+            self.outbound = None
+            metrics.adjust_gauge("chat.connections.active", -1)
+        if not self.user or not self.user.is_authenticated:
+            return
+        with metrics.timer("chat.disconnect.seconds"):
+            await self.unsubscribe()
+            await get_presence_tracker().disconnect(self.channel_name)
+            await get_read_buffer().flush(self.user.id)
 
     async def receive(self, text_data: str) -> None:
         text_data_json = json.loads(text_data)
-        if text_data_json.get("type") == "chat.message.new":
-            await self.store_message_to_db(text_data_json)
+        handler = FRAME_HANDLERS.get(text_data_json.get("type"))
+        if handler is not None:
+            with metrics.timer(f"chat.consumer.{handler}.seconds"):
+                await getattr(self, handler)(text_data_json)
+
+    async def receive_message(self, event: dict) -> None:
+        client_id = event.get("client_id")
+        if api_settings.MESSAGE_WRITE_BUFFER:
+            data = await self.buffer_message(event)
+        else:
+            with metrics.timer("chat.consumer.receive_message.db.seconds"):
+                data = await self.store_message_to_db(event)
+        if data is None:
+            await self.reply({"type": "chat.message.error", "client_id": client_id})
+        else:
+            await self.reply(
+                {"type": "chat.message.ack", "client_id": client_id, **data}
+            )
+
+    async def sync_messages(self, event: dict) -> None:
+        """
+        Stream the messages missed since ``{"rooms": {room_id: last_seen_id}}``
+        in one ``chat.sync.messages`` frame per chunk of rooms, followed by
+        ``chat.sync.done``.
+        """
+        try:
+            last_seen = {
+                int(room_id): int(message_id)
+                for room_id, message_id in (event.get("rooms") or {}).items()
+            }
+        except (AttributeError, TypeError, ValueError):
+            await self.reply(
+                {"type": "chat.sync.error", "client_id": event.get("client_id")}
+            )
+            return
+
+        with metrics.timer("chat.consumer.sync_messages.db.seconds"):
+            room_ids = await self.get_user_group_ids()
+        total = 0
+        for chunk in replay.room_chunks(room_ids, last_seen):
+            with metrics.timer("chat.consumer.sync_messages.db.seconds"):
+                missed = await database_sync_to_async(replay.chunk_messages)(chunk)
+            total += len(missed.messages)
+            outbound = self.outbound
+            if outbound is not None:
+                # Read the next chunk only once the client keeps up.
+                await outbound.wait_writable()
+            await self.reply(
+                {
+                    "type": "chat.sync.messages",
+                    "messages": missed.messages,
+                    "truncated": missed.truncated,
+                }
+            )
+        await self.reply(
+            {
+                "type": "chat.sync.done",
+                "client_id": event.get("client_id"),
+                "rooms": len(room_ids),
+                "messages": total,
+            }
+        )
+        metrics.observe("chat.sync.messages", total)
+
+    async def mark_read(self, event: dict) -> None:
+        """
+        Record ``{"chat_room": id, "message_id": id}`` as read. Receipts are
+        coalesced and written in the background.
+        """
+        chat_room_id = event.get("chat_room")
+        message_id = event.get("message_id")
+        if not isinstance(message_id, int) or not isinstance(chat_room_id, int):
+            return
+        if await membership.ais_member(self.user.id, chat_room_id):
+            get_read_buffer().submit(self.user.id, chat_room_id, message_id)
+
+    async def report_activity(self, event: dict) -> None:
+        """
+        Relay typing and viewing activity to the room. Nothing is stored and
+        nothing is sent back.
+        """
+        chat_room_id = event.get("chat_room")
+        if isinstance(chat_room_id, int) and await membership.ais_member(
+            self.user.id, chat_room_id
+        ):
+            get_activity_buffer().submit(
+                self.user.id, chat_room_id, ACTIVITY_FRAMES[event["type"]]
+            )
+
+    async def send_event(self, event: dict) -> None:
+        """
+        Queue a channel layer event for the client, evicting the connection
+        when it can't keep up.
+        """
+        ingested_at = event.get("ingested_at")
+        if ingested_at is not None:
+            metrics.observe("chat.message.broadcast.seconds", time.time() - ingested_at)
+        outbound = self.outbound
+        if outbound is not None and not outbound.put(event):
+            await self.evict(outbound)
+
+    async def reply(self, frame: dict) -> None:
+        """
+        Queue a reply to a client frame behind the events already queued.
+        """
+        await self.send_event({"type": frame["type"], "text": dumps(frame).decode()})
+
+    async def evict(self, outbound: OutboundQueue) -> None:
+        outbound.stop()
+        self.outbound = None
+        metrics.adjust_gauge("chat.connections.active", -1)
+        metrics.increment("chat.outbound.evicted")
+        try:
+            # The link is already congested, don't wait long for the hint.
+            await asyncio.wait_for(
+                self.send(
+                    text_data=json.dumps(
+                        {"type": "chat.resync", "reason": "slow_consumer"}
+                    )
+                ),
+                timeout=1,
+            )
+        except asyncio.TimeoutError:
+            pass
+        await self.close(code=SLOW_CONSUMER_CLOSE_CODE)
+
+    async def send_frame(self, event: dict) -> None:
+        # Events published by df_chat carry the frame encoded once upstream.
+        if "text" in event:
+            await self.send(text_data=event["text"])
+        elif "bytes" in event:
+            await self.send(bytes_data=event["bytes"])
+        else:
+            await self.send(text_data=json.dumps(event))
 
     async def chat_message_new(self, event: dict) -> None:
-        await self.send(text_data=json.dumps(event))
+        await self.send_event(event)
 
     async def chat_message_update(self, event: dict) -> None:
-        await self.send(text_data=json.dumps(event))
+        await self.send_event(event)
+
+    async def chat_activity(self, event: dict) -> None:
+        await self.send_event(event)
+
+    async def chat_members_changed(self, event: dict) -> None:
+        await self.send_event(event)
+
+    async def buffer_message(self, event: dict) -> typing.Optional[dict]:
+        chat_room_id = event.get("chat_room")
+        message = event.get("message")
+        if not isinstance(message, str) or not message.strip():
+            return None
+        if not isinstance(chat_room_id, int) or not await membership.acan_post(
+            self.user.id, chat_room_id
+        ):
+            return None
+        return await get_write_buffer().submit(self.user, chat_room_id, message.strip())
 
     @database_sync_to_async
     def store_message_to_db(self, event: dict) -> typing.Optional[ReturnDict]:
+        chat_room_id = event.get("chat_room")
+        if not isinstance(chat_room_id, int) or not membership.can_post(
+            self.user.id, chat_room_id
+        ):
+            return None
         serializer = ChatMessageSerializer(
             data={
                 "message": event.get("message", ""),
             }
         )
         if serializer.is_valid():
-            serializer.save(
-                created_by_id=self.user.id, chat_room_id=event.get("chat_room")
-            )
-
-    @database_sync_to_async
-    def set_member_channel(self, is_online: bool) -> None:
-        if is_online:
-            MemberChannel.objects.create(user=self.user, channel_name=self.channel_name)
-        else:
-            MemberChannel.objects.filter(channel_name=self.channel_name).delete()
+            serializer.save(created_by=self.user, chat_room_id=chat_room_id)
+            return serializer.data
+        return None
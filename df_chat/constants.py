@@ -1,3 +1,4 @@
 USER_CHAT_ALIAS = "user_{user_id}"
 ROOM_CHAT_ALIAS = "room_{room_id}"
+ROOM_SHARD_CHAT_ALIAS = "room_{room_id}_shard_{shard}"
 SYSTEM_CHAT_ALIAS = "system"
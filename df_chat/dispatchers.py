@@ -0,0 +1,213 @@
+import asyncio
+import atexit
+import logging
+import queue
+import threading
+import time
+from functools import lru_cache
+from typing import Any, Iterable, Optional
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.core.signals import setting_changed
+from django.db import transaction
+from django.dispatch import receiver
+
+from df_chat.metrics import metrics
+from df_chat.settings import api_settings
+
+logger = logging.getLogger(__name__)
+
+GroupEvent = tuple[str, dict]
+
+
+async def send_group_events(channel_layer: Any, events: Iterable[GroupEvent]) -> int:
+    """
+    Send events to their channel layer groups and return the number of failures.
+
+    Different groups are sent to concurrently while events for the same group
+    keep their order.
+    """
+    by_group: dict[str, list[dict]] = {}
+    for group, event in events:
+        by_group.setdefault(group, []).append(event)
+
+    async def send_in_order(group: str, group_events: list[dict]) -> int:
+        failed = 0
+        for event in group_events:
+            try:
+                with metrics.timer("chat.group_send.seconds"):
+                    await channel_layer.group_send(group, event)
+            except Exception:
+                logger.exception("Failed to publish %s to %s", event["type"], group)
+                failed += 1
+        return failed
+
+    results = await asyncio.gather(
+        *(send_in_order(group, events) for group, events in by_group.items())
+    )
+    return sum(results)
+
+
+class BaseEventDispatcher:
+    """
+    Publishes chat events to channel layer groups.
+
+    Events dispatched inside a transaction are held back until it commits,
+    so clients never see a message that was rolled back.
+    """
+
+    def __init__(self) -> None:
+        self._stats_lock = threading.Lock()
+        self._stats = {"dispatched": 0, "published": 0, "failed": 0}
+
+    @property
+    def channel_layer(self) -> Any:
+        return get_channel_layer()
+
+    def dispatch(self, group: str, event: dict) -> None:
+        self.dispatch_many([(group, event)])
+
+    def dispatch_many(self, events: list[GroupEvent]) -> None:
+        if events:
+            transaction.on_commit(lambda: self.publish(events))
+
+    def publish(self, events: list[GroupEvent]) -> None:
+        raise NotImplementedError
+
+    def _count(self, **values: int) -> None:
+        with self._stats_lock:
+            for name, value in values.items():
+                self._stats[name] = self._stats.get(name, 0) + value
+
+    def stats(self) -> dict[str, int]:
+        with self._stats_lock:
+            return dict(self._stats)
+
+
+class SyncEventDispatcher(BaseEventDispatcher):
+    """
+    Publishes events inline right after commit. Meant for tests and debugging.
+    """
+
+    def publish(self, events: list[GroupEvent]) -> None:
+        failed = async_to_sync(send_group_events)(self.channel_layer, events)
+        self._count(
+            dispatched=len(events), published=len(events) - failed, failed=failed
+        )
+
+
+class ThreadedEventDispatcher(BaseEventDispatcher):
+    """
+    Publishes events from a background thread running its own event loop.
+
+    Events are put on a bounded queue and sent in batches, so request threads
+    never wait on the channel layer. When the queue is full the event is
+    published inline instead and counted as ``overflowed``.
+    """
+
+    def __init__(
+        self,
+        max_queue_size: Optional[int] = None,
+        batch_size: Optional[int] = None,
+    ) -> None:
+        super().__init__()
+        self.batch_size = batch_size or api_settings.EVENT_DISPATCHER_BATCH_SIZE
+        self._queue: queue.Queue = queue.Queue(
+            maxsize=max_queue_size or api_settings.EVENT_DISPATCHER_QUEUE_SIZE
+        )
+        self._thread: Optional[threading.Thread] = None
+        self._thread_lock = threading.Lock()
+        self._stats.update(overflowed=0, batches=0, max_queue_depth=0)
+
+    def _ensure_worker(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._thread_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._run, name="df-chat-dispatcher", daemon=True
+                )
+                self._thread.start()
+
+    def publish(self, events: list[GroupEvent]) -> None:
+        self._ensure_worker()
+        overflow = []
+        for group_event in events:
+            try:
+                self._queue.put_nowait(group_event)
+            except queue.Full:
+                overflow.append(group_event)
+
+        depth = self._queue.qsize()
+        with self._stats_lock:
+            self._stats["dispatched"] += len(events)
+            self._stats["max_queue_depth"] = max(self._stats["max_queue_depth"], depth)
+
+        if overflow:
+            logger.warning("Event queue is full, publishing %s inline", len(overflow))
+            failed = async_to_sync(send_group_events)(self.channel_layer, overflow)
+            self._count(
+                overflowed=len(overflow),
+                published=len(overflow) - failed,
+                failed=failed,
+            )
+
+    def _next_batch(self) -> list[GroupEvent]:
+        batch = [self._queue.get()]
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self) -> None:
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        while True:
+            batch = self._next_batch()
+            try:
+                failed = loop.run_until_complete(
+                    send_group_events(self.channel_layer, batch)
+                )
+            except Exception:
+                logger.exception("Failed to publish a batch of %s events", len(batch))
+                failed = len(batch)
+            self._count(batches=1, published=len(batch) - failed, failed=failed)
+            for _ in batch:
+                self._queue.task_done()
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """
+        Wait until every queued event has been published.
+
+        Returns ``False`` if the queue was not drained within ``timeout``.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._queue.all_tasks_done:
+            while self._queue.unfinished_tasks:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._queue.all_tasks_done.wait(remaining)
+        return True
+
+    def stats(self) -> dict[str, int]:
+        stats = super().stats()
+        stats["queue_depth"] = self._queue.qsize()
+        return stats
+
+
+@lru_cache(maxsize=None)
+def get_event_dispatcher() -> BaseEventDispatcher:
+    dispatcher = api_settings.EVENT_DISPATCHER()
+    if isinstance(dispatcher, ThreadedEventDispatcher):
+        atexit.register(dispatcher.flush, timeout=5)
+    return dispatcher
+
+
+@receiver(setting_changed)
+def reset_event_dispatcher(*, setting: str, **kwargs: Any) -> None:
+    if setting == "DF_CHAT":
+        get_event_dispatcher.cache_clear()
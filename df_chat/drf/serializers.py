@@ -1,9 +1,19 @@
-from asgiref.sync import async_to_sync
-from channels.layers import get_channel_layer
+import time
+
 from django.contrib.auth import get_user_model
+from django.db import transaction
 from rest_framework import serializers
 
-from df_chat.constants import ROOM_CHAT_ALIAS
+from df_chat import members, membership, search
+from df_chat.encoders import (
+    encode_event,
+    message_payload,
+    message_row,
+    user_payload,
+)
+from df_chat.export import EXPORT_FORMATS, NDJSON
+from df_chat.fanout import dispatch_room_event
+from df_chat.metrics import metrics
 from df_chat.models import ChatMember, ChatMessage, ChatRoom
 from df_chat.settings import api_settings
 
@@ -38,37 +48,99 @@ class ChatMessageSerializer(serializers.ModelSerializer):
         )
 
     def _post_to_ws(self, instance, message_type, **kwargs):
-        channel_layer = get_channel_layer()
-        ws_room_name = ROOM_CHAT_ALIAS.format(room_id=instance.chat_room.id)
-        message_data = ChatMessageSerializer(instance=instance).data
-        async_to_sync(channel_layer.group_send)(
-            ws_room_name, {"type": message_type, **message_data}
-        )
+        with metrics.timer("chat.serializer.publish.seconds"):
+            payload = message_payload(
+                message_row(instance), user_payload(instance.created_by)
+            )
+            dispatch_room_event(
+                instance.chat_room_id, encode_event(message_type, payload, **kwargs)
+            )
 
     def create(self, validated_data):
-        instance = super().create(validated_data)
-        self._post_to_ws(instance, "chat.message.new")
+        ingested_at = time.time() if metrics.enabled else None
+        created_by = validated_data.get("created_by")
+        chat_room = validated_data.get("chat_room")
+        chat_room_id = chat_room.id if chat_room else validated_data["chat_room_id"]
+        user_id = getattr(created_by, "id", None)
+        if not membership.is_member(user_id, chat_room_id):
+            raise serializers.ValidationError(
+                "Only members of the room can post messages"
+            )
+        if not membership.can_post(user_id, chat_room_id):
+            raise serializers.ValidationError("Only admins can post in this room")
+        with transaction.atomic():
+            instance = super().create(validated_data)
+            ChatRoom.objects.record_messages([instance])
+            ChatMember.objects.record_messages([instance])
+            search.index_messages([instance], created=True)
+        self._post_to_ws(instance, "chat.message.new", ingested_at=ingested_at)
         return instance
 
     def update(self, instance, validated_data):
-        instance = super().update(instance, validated_data)
+        with transaction.atomic():
+            instance = super().update(instance, validated_data)
+            ChatRoom.objects.record_message_edit(instance)
+            search.index_messages([instance])
         self._post_to_ws(instance, "chat.message.update")
         return instance
 
 
+class ChatMessageExportSerializer(serializers.Serializer):
+    export_format = serializers.ChoiceField(EXPORT_FORMATS, default=NDJSON)
+    since = serializers.DateTimeField(required=False)
+    until = serializers.DateTimeField(required=False)
+    after = serializers.IntegerField(required=False, min_value=0)
+
+
+class ChatMessageSearchSerializer(serializers.Serializer):
+    q = serializers.CharField(max_length=200)
+    room = serializers.IntegerField(required=False)
+    limit = serializers.IntegerField(required=False, min_value=1, max_value=100)
+    cursor = serializers.RegexField(r"^-?[0-9.e+-]+:[0-9]+$", required=False)
+
+    def validate_cursor(self, value: str) -> tuple[float, int]:
+        score, message_id = value.split(":")
+        try:
+            return float(score), int(message_id)
+        except ValueError:
+            raise serializers.ValidationError("Invalid cursor")
+
+
 class ChatRoomSerializer(serializers.ModelSerializer):
-    newest_message = serializers.CharField(read_only=True)
+    newest_message = serializers.CharField(
+        source="last_message_preview", read_only=True
+    )
     users = serializers.PrimaryKeyRelatedField(
         queryset=User.objects.all(), write_only=True, many=True
     )
+    # Annotated per requesting user by RoomViewSet.
+    unread_count = serializers.IntegerField(read_only=True)
+    last_read_message_id = serializers.IntegerField(read_only=True)
 
     class Meta:
         model = ChatRoom
-        fields = ("id", "title", "created", "chat_type", "newest_message", "users")
+        fields = (
+            "id",
+            "title",
+            "created",
+            "chat_type",
+            "newest_message",
+            "last_message_id",
+            "last_activity_at",
+            "message_count",
+            "unread_count",
+            "last_read_message_id",
+            "admins_only_posting",
+            "users",
+        )
         read_only_fields = (
             "id",
             "created",
+            "admins_only_posting",
             "newest_message",
+            "last_message_id",
+            "last_activity_at",
+            "message_count",
         )
 
     def validate(self, data: dict) -> dict:
@@ -90,6 +162,10 @@ class ChatRoomSerializer(serializers.ModelSerializer):
         return instance
 
 
+class ChatRoomReadSerializer(serializers.Serializer):
+    message_id = serializers.IntegerField(required=False, min_value=1)
+
+
 class ChatRoomMemberListSerializer(serializers.ModelSerializer):
     members = UserSerializer(source="users", many=True, read_only=True)
 
@@ -102,9 +178,10 @@ class ChatRoomMembersSerializer(serializers.Serializer):
     class Action:
         add = "add"
         remove = "remove"
+        choices = [add, remove]
 
     users = serializers.PrimaryKeyRelatedField(queryset=User.objects.all(), many=True)
-    action = serializers.ChoiceField([Action.add, Action.remove])
+    action = serializers.ChoiceField(Action.choices)
 
     class Meta:
         fields = ("users", "action")
@@ -117,8 +194,39 @@ class ChatRoomMembersSerializer(serializers.Serializer):
 
     def update(self) -> None:
         instance = self.context["instance"]
-        users = self.validated_data["users"]
+        user_ids = [user.pk for user in self.validated_data["users"]]
         if self.validated_data.get("action") == ChatRoomMembersSerializer.Action.add:
-            instance.users.add(*users)
+            members.add_members(instance, user_ids)
         if self.validated_data.get("action") == ChatRoomMembersSerializer.Action.remove:
-            instance.users.remove(*users)
+            members.remove_members(instance, user_ids)
+
+
+class ChatRoomBulkMembersSerializer(serializers.Serializer):
+    """
+    Member changes given as plain user ids, validated with a single query by
+    ``df_chat.members``. Unknown ids are reported instead of rejected.
+    """
+
+    users = serializers.ListField(
+        child=serializers.IntegerField(min_value=1), allow_empty=False
+    )
+    action = serializers.ChoiceField(ChatRoomMembersSerializer.Action.choices)
+
+    def validate_users(self, value: list[int]) -> list[int]:
+        if len(value) > api_settings.MEMBERS_BULK_MAX_SIZE:
+            raise serializers.ValidationError(
+                f"At most {api_settings.MEMBERS_BULK_MAX_SIZE} users per request"
+            )
+        return value
+
+    def validate(self, data: dict) -> dict:
+        instance = self.context["instance"]
+        if ChatRoom.ChatType.private.value == instance.chat_type:
+            raise serializers.ValidationError("Impossible to add or remove user")
+        return data
+
+    def save(self) -> members.MembersChange:
+        instance = self.context["instance"]
+        if self.validated_data["action"] == ChatRoomMembersSerializer.Action.add:
+            return members.add_members(instance, self.validated_data["users"])
+        return members.remove_members(instance, self.validated_data["users"])
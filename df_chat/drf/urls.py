@@ -1,13 +1,14 @@
 from django.urls import include, path
 from rest_framework.routers import SimpleRouter
 
-from df_chat.drf.viewsets import MessageViewSet, RoomViewSet
+from df_chat.drf.viewsets import MessageViewSet, RoomViewSet, SearchViewSet
 
 room_router = SimpleRouter()
 messages_router = SimpleRouter()
 
 
 room_router.register("rooms", RoomViewSet, basename="room")
+room_router.register("search", SearchViewSet, basename="search")
 
 messages_router.register("messages", MessageViewSet, basename="messages")
 urlpatterns = [
@@ -1,21 +1,45 @@
-from typing import Any
+from dataclasses import asdict
+from typing import Any, AsyncIterator, Iterator, Union
 
 from django.contrib.auth import get_user_model
-from django.db.models import Max, OuterRef, QuerySet, Subquery
+from django.core.handlers.asgi import ASGIRequest
+from django.db import transaction
+from django.db.models import F, QuerySet
+from django.http import Http404, StreamingHttpResponse
+from django.shortcuts import get_object_or_404
 from rest_framework import mixins, permissions, status
 from rest_framework.decorators import action
 from rest_framework.request import Request
 from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
 from rest_framework.viewsets import GenericViewSet
 
+from df_chat import search
 from df_chat.drf.serializers import (
+    ChatMessageExportSerializer,
+    ChatMessageSearchSerializer,
     ChatMessageSerializer,
+    ChatRoomBulkMembersSerializer,
     ChatRoomMemberListSerializer,
     ChatRoomMembersSerializer,
+    ChatRoomReadSerializer,
     ChatRoomSerializer,
 )
-from df_chat.models import ChatMessage, ChatRoom
-from df_chat.paginators import ChatMessagePagination, ChatRoomPagination
+from df_chat.export import (
+    CONTENT_TYPES,
+    aiter_export,
+    export_rows,
+    iter_export,
+)
+from df_chat.models import (
+    ArchivedChatMessage,
+    ChatMember,
+    ChatMessage,
+    ChatRoom,
+)
+from df_chat.paginators import ChatMessageCursorPagination, ChatRoomPagination
+from df_chat.permissions import IsChatRoomMember
+from df_chat.settings import api_settings
 
 User = get_user_model()
 
@@ -28,12 +52,30 @@ class MessageViewSet(
     mixins.DestroyModelMixin,
     GenericViewSet,
 ):
-    pagination_class = ChatMessagePagination
+    pagination_class = ChatMessageCursorPagination
     serializer_class = ChatMessageSerializer
-    permission_classes = [permissions.IsAuthenticated]
+    permission_classes = [permissions.IsAuthenticated, IsChatRoomMember]
 
     def get_queryset(self) -> QuerySet[ChatMessage]:
-        return ChatMessage.objects.filter(chat_room=self.kwargs.get("room_id"))
+        return ChatMessage.objects.filter(
+            chat_room=self.kwargs.get("room_id")
+        ).select_related("created_by")
+
+    def get_archive_queryset(self) -> QuerySet[ArchivedChatMessage]:
+        return ArchivedChatMessage.objects.filter(
+            chat_room=self.kwargs.get("room_id")
+        ).select_related("created_by")
+
+    def get_object(self) -> Any:
+        try:
+            return super().get_object()
+        except Http404:
+            # Archived messages are read only.
+            if self.request.method not in permissions.SAFE_METHODS:
+                raise
+            return get_object_or_404(
+                self.get_archive_queryset(), pk=self.kwargs[self.lookup_field]
+            )
 
     def perform_create(self, serializer):
         serializer.save(created_by=self.request.user)
@@ -43,6 +85,51 @@ class MessageViewSet(
             chat_room_id=self.kwargs.get("room_id"), created_by=self.request.user
         )
 
+    def perform_destroy(self, instance: ChatMessage) -> None:
+        with transaction.atomic():
+            message_id = instance.id
+            instance.delete()
+            ChatRoom.objects.record_message_removal(instance.chat_room_id, message_id)
+            instance.id = message_id
+            ChatMember.objects.record_message_removal(instance)
+            search.remove_messages([message_id])
+
+    @action(
+        detail=False,
+        methods=["GET"],
+        serializer_class=ChatMessageExportSerializer,
+        pagination_class=None,
+    )
+    def export(self, request: Request, **kwargs: Any) -> StreamingHttpResponse:
+        """
+        Stream the room history as NDJSON or CSV, oldest first. Pass the id of
+        the last received message as ``after`` to resume an export.
+        """
+        serializer = ChatMessageExportSerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        params = serializer.validated_data
+        room_id = int(self.kwargs["room_id"])
+        export_format = params["export_format"]
+        rows = export_rows(
+            room_ids=[room_id],
+            since=params.get("since"),
+            until=params.get("until"),
+            after_id=params.get("after"),
+        )
+        content: Union[AsyncIterator[Any], Iterator[Any]]
+        # ASGI handlers buffer sync iterators whole, hand them an async one.
+        if isinstance(request._request, ASGIRequest):
+            content = aiter_export(export_format, rows)
+        else:
+            content = iter_export(export_format, rows)
+        response = StreamingHttpResponse(
+            content, content_type=CONTENT_TYPES[export_format]
+        )
+        response[
+            "Content-Disposition"
+        ] = f'attachment; filename="room-{room_id}.{export_format}"'
+        return response
+
 
 class RoomViewSet(
     mixins.ListModelMixin,
@@ -57,12 +144,13 @@ class RoomViewSet(
     pagination_class = ChatRoomPagination
 
     def get_queryset(self) -> "QuerySet[ChatRoom]":
-        newest = ChatMessage.objects.filter(chat_room=OuterRef("pk")).order_by(
-            "-created"
-        )
-        return ChatRoom.objects.filter(users=self.request.user).annotate(
-            newest_message=Subquery(newest.values("message")[:1]),
-            last_message_id=Max("chatmessage__id"),
+        return (
+            ChatRoom.objects.filter(chatmember__user=self.request.user)
+            .annotate(
+                unread_count=F("chatmember__unread_count"),
+                last_read_message_id=F("chatmember__last_read_message_id"),
+            )
+            .order_by("-last_activity_at", "-id")
         )
 
     @action(
@@ -81,6 +169,50 @@ class RoomViewSet(
         serializer.update()
         return Response(data=serializer.data, status=status.HTTP_200_OK)
 
+    @action(
+        detail=True,
+        methods=["POST"],
+        serializer_class=ChatRoomBulkMembersSerializer,
+        pagination_class=None,
+        url_path="members/bulk",
+    )
+    def bulk_members(self, request: Request, **kwargs: Any) -> Response:
+        """
+        Add or remove many users at once. Returns the ids actually ``added``
+        or ``removed`` and the ``unknown`` ones.
+        """
+        instance = self.get_object()
+        serializer = ChatRoomBulkMembersSerializer(
+            data=request.data, context={"request": request, "instance": instance}
+        )
+        serializer.is_valid(raise_exception=True)
+        change = serializer.save()
+        return Response(data=asdict(change), status=status.HTTP_200_OK)
+
+    @action(
+        detail=True,
+        methods=["POST"],
+        serializer_class=ChatRoomReadSerializer,
+        pagination_class=None,
+    )
+    def read(self, request: Request, **kwargs: Any) -> Response:
+        """
+        Mark the room as read up to ``message_id``, or up to its last message
+        when omitted. The read marker never moves backwards.
+        """
+        instance = self.get_object()
+        serializer = ChatRoomReadSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        message_id = serializer.validated_data.get(
+            "message_id", instance.last_message_id
+        )
+        if message_id is not None:
+            ChatMember.objects.mark_read(request.user.id, instance.id, message_id)
+        member = ChatMember.objects.values("last_read_message_id", "unread_count").get(
+            user=request.user, chat_room=instance
+        )
+        return Response(data=member, status=status.HTTP_200_OK)
+
     @action(
         detail=True,
         methods=["GET"],
@@ -93,3 +225,60 @@ class RoomViewSet(
             instance,
         )
         return Response(data=serializer.data, status=status.HTTP_200_OK)
+
+
+class SearchViewSet(GenericViewSet):
+    """
+    Full-text search over the messages of the rooms the user belongs to.
+    Results are ranked, best first, and paged with the ``cursor`` returned as
+    ``next``.
+    """
+
+    permission_classes = [permissions.IsAuthenticated]
+    serializer_class = ChatMessageSerializer
+    pagination_class = None
+
+    def list(self, request: Request, **kwargs: Any) -> Response:
+        params = ChatMessageSearchSerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        room_ids = list(
+            ChatMember.objects.filter(user=request.user).values_list(
+                "chat_room_id", flat=True
+            )
+        )
+        room = params.validated_data.get("room")
+        if room is not None:
+            room_ids = [room] if room in room_ids else []
+        limit = params.validated_data.get("limit", api_settings.SEARCH_PAGE_SIZE)
+
+        hits = search.get_search_backend().search(
+            params.validated_data["q"],
+            room_ids,
+            limit + 1,
+            after=params.validated_data.get("cursor"),
+        )
+        page = hits[:limit]
+
+        messages: dict[int, Any] = {}
+        for model in (ChatMessage, ArchivedChatMessage):
+            messages.update(
+                model.objects.filter(
+                    id__in=[message_id for _, message_id in page],
+                    chat_room_id__in=room_ids,
+                )
+                .select_related("created_by")
+                .in_bulk()
+            )
+        results = [
+            {**ChatMessageSerializer(messages[message_id]).data, "score": score}
+            for score, message_id in page
+            if message_id in messages
+        ]
+
+        next_url = None
+        if len(hits) > limit:
+            score, message_id = page[-1]
+            next_url = replace_query_param(
+                request.build_absolute_uri(), "cursor", f"{score!r}:{message_id}"
+            )
+        return Response({"next": next_url, "results": results})
@@ -0,0 +1,158 @@
+"""
+Fast encoding of message events sent over WebSocket.
+
+Events are built from plain rows instead of going through DRF serializers and
+encoded to JSON once, when they are published. The encoded frame travels
+through the channel layer and consumers forward it untouched. The payload has
+the same shape as ``ChatMessageSerializer`` output. Users are rendered from
+their attributes when every ``DEFAULT_USER_SERIALIZER_FIELDS`` entry is a
+plain model field, and through ``UserSerializer`` otherwise.
+"""
+import datetime
+import json
+from functools import lru_cache
+from typing import Any, Callable, Mapping, Optional
+
+from django.contrib.auth import get_user_model
+from django.core.exceptions import FieldDoesNotExist
+from django.db import models
+from rest_framework import serializers
+
+from df_chat.settings import api_settings
+
+MESSAGE_FIELDS = (
+    "id",
+    "created",
+    "modified",
+    "chat_room_id",
+    "created_by_id",
+    "message",
+)
+
+# Model fields whose value is what ``UserSerializer`` renders, once dates and
+# times are formatted.
+PRIMITIVE_FIELDS = (
+    models.BooleanField,
+    models.CharField,
+    models.DateField,
+    models.FloatField,
+    models.IntegerField,
+    models.TextField,
+    models.TimeField,
+)
+
+_datetime_field = serializers.DateTimeField()
+
+
+def _json_dumps(obj: Any) -> bytes:
+    return json.dumps(obj, separators=(",", ":"), ensure_ascii=False).encode("utf8")
+
+
+@lru_cache(maxsize=None)
+def get_dumps() -> Callable[[Any], bytes]:
+    """
+    Return the JSON encoder picked by the ``EVENT_ENCODER`` setting.
+    """
+    backend = api_settings.EVENT_ENCODER
+    if backend in ("auto", "orjson"):
+        try:
+            import orjson
+
+            return orjson.dumps
+        except ImportError:
+            if backend == "orjson":
+                raise
+    if backend in ("auto", "msgspec"):
+        try:
+            import msgspec
+
+            return msgspec.json.Encoder().encode
+        except ImportError:
+            if backend == "msgspec":
+                raise
+    return _json_dumps
+
+
+def dumps(obj: Any) -> bytes:
+    return get_dumps()(obj)
+
+
+def _jsonable(value: Any) -> Any:
+    if isinstance(value, datetime.datetime):
+        return _datetime_field.to_representation(value)
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    return value
+
+
+@lru_cache(maxsize=None)
+def has_primitive_fields(fields: tuple[str, ...]) -> bool:
+    """
+    Tell whether every user field can be rendered without ``UserSerializer``.
+    """
+    opts = get_user_model()._meta
+    for name in fields:
+        try:
+            field = opts.get_field(name)
+        except FieldDoesNotExist:
+            return False
+        if field.is_relation or not isinstance(field, PRIMITIVE_FIELDS):
+            return False
+    return True
+
+
+def user_payload(user: Any) -> dict:
+    fields = tuple(api_settings.DEFAULT_USER_SERIALIZER_FIELDS)
+    if has_primitive_fields(fields):
+        return {name: _jsonable(getattr(user, name)) for name in fields}
+    from df_chat.drf.serializers import UserSerializer
+
+    return dict(UserSerializer(user).data)
+
+
+def user_payload_from_row(row: Mapping[str, Any], prefix: str = "created_by__") -> dict:
+    """
+    Build the user payload from a row with ``created_by__<field>`` values.
+    """
+    fields = tuple(api_settings.DEFAULT_USER_SERIALIZER_FIELDS)
+    values = {name: row[prefix + name] for name in fields}
+    if has_primitive_fields(fields):
+        return {name: _jsonable(value) for name, value in values.items()}
+    return user_payload(get_user_model()(**values))
+
+
+def message_row(message: Any) -> dict:
+    return {name: getattr(message, name) for name in MESSAGE_FIELDS}
+
+
+def message_payload(row: Mapping[str, Any], created_by: dict) -> dict:
+    """
+    Build the message payload from a ``values()`` style row.
+    """
+    return {
+        "id": row["id"],
+        "created": _jsonable(row["created"]),
+        "modified": _jsonable(row["modified"]),
+        "chat_room": row["chat_room_id"],
+        "created_by": created_by,
+        "message": row["message"],
+    }
+
+
+def encode_event(
+    event_type: str, payload: dict, ingested_at: Optional[float] = None
+) -> dict:
+    """
+    Return a channel layer event carrying the pre-encoded WebSocket frame.
+    ``ingested_at`` (a ``time.time()`` timestamp) lets consumers measure the
+    broadcast latency of the message.
+    """
+    frame = dumps({"type": event_type, **payload})
+    event = {"type": event_type, "id": payload.get("id")}
+    if ingested_at is not None:
+        event["ingested_at"] = ingested_at
+    if api_settings.EVENT_FRAME == "binary":
+        event["bytes"] = frame
+    else:
+        event["text"] = frame.decode("utf8")
+    return event
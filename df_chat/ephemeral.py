@@ -0,0 +1,162 @@
+"""
+Ephemeral room activity: typing, stopped typing and viewing a room.
+
+These events are never stored. Each user gets a token bucket per room that
+drops events above ``EPHEMERAL_EVENT_RATE`` per second (bursts of up to
+``EPHEMERAL_EVENT_BURST``). Accepted events are coalesced for
+``EPHEMERAL_EVENT_WINDOW`` seconds, keeping the latest state of each user,
+and published as a single ``chat.activity`` event per room. Clients drop an
+activity state ``ttl`` seconds after receiving it unless it is refreshed, and
+states that got older than ``EPHEMERAL_EVENT_TTL`` before being published
+are discarded.
+"""
+import asyncio
+import time
+import weakref
+from typing import Any, Callable, Optional
+
+from channels.layers import get_channel_layer
+
+from df_chat.dispatchers import GroupEvent, send_group_events
+from df_chat.encoders import encode_event
+from df_chat.fanout import aroom_groups
+from df_chat.metrics import metrics
+from df_chat.settings import api_settings
+
+
+class ActivityState:
+    typing = "typing"
+    stopped_typing = "stopped_typing"
+    viewing = "viewing"
+
+
+# Client frame types and the state they report.
+ACTIVITY_FRAMES = {
+    "chat.typing": ActivityState.typing,
+    "chat.typing.stop": ActivityState.stopped_typing,
+    "chat.viewing": ActivityState.viewing,
+}
+
+
+class TokenBucket:
+    __slots__ = ("rate", "burst", "tokens", "updated_at")
+
+    def __init__(self, rate: float, burst: float, now: float) -> None:
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated_at = now
+
+    def refill(self, now: float) -> None:
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def take(self, now: float) -> bool:
+        self.refill(now)
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+    def is_full(self, now: float) -> bool:
+        self.refill(now)
+        return self.tokens >= self.burst
+
+
+class ActivityBuffer:
+    def __init__(
+        self,
+        channel_layer: Any = None,
+        rate: Optional[float] = None,
+        burst: Optional[float] = None,
+        window: Optional[float] = None,
+        ttl: Optional[float] = None,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.channel_layer = channel_layer or get_channel_layer()
+        self.rate = rate or api_settings.EPHEMERAL_EVENT_RATE
+        self.burst = burst or api_settings.EPHEMERAL_EVENT_BURST
+        self.window = api_settings.EPHEMERAL_EVENT_WINDOW if window is None else window
+        self.ttl = ttl or api_settings.EPHEMERAL_EVENT_TTL
+        self.clock = clock
+        self._buckets: dict[tuple[int, int], TokenBucket] = {}
+        # {room_id: {user_id: (state, accepted_at)}}
+        self._pending: dict[int, dict[int, tuple[str, float]]] = {}
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._tasks: set[asyncio.Task] = set()
+
+    def submit(self, user_id: int, chat_room_id: int, state: str) -> bool:
+        """
+        Queue the activity of a user, return whether it was accepted.
+        """
+        now = self.clock()
+        key = (user_id, chat_room_id)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(self.rate, self.burst, now)
+        if not bucket.take(now):
+            metrics.increment("chat.ephemeral.dropped")
+            return False
+
+        room = self._pending.setdefault(chat_room_id, {})
+        if user_id in room:
+            metrics.increment("chat.ephemeral.coalesced")
+        room[user_id] = (state, now)
+        if self._timer is None:
+            loop = asyncio.get_running_loop()
+            self._timer = loop.call_later(self.window, self._schedule_flush)
+        return True
+
+    def _schedule_flush(self) -> None:
+        self._timer = None
+        task = asyncio.ensure_future(self.flush())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def _prune_buckets(self, now: float) -> None:
+        # A full bucket holds no state a fresh one wouldn't have.
+        self._buckets = {
+            key: bucket
+            for key, bucket in self._buckets.items()
+            if not bucket.is_full(now)
+        }
+
+    async def flush(self) -> None:
+        batch, self._pending = self._pending, {}
+        now = self.clock()
+        self._prune_buckets(now)
+        events: list[GroupEvent] = []
+        for room_id, users in batch.items():
+            activity = [
+                {"user": user_id, "state": state}
+                for user_id, (state, accepted_at) in users.items()
+                if now - accepted_at < self.ttl
+            ]
+            if len(activity) < len(users):
+                metrics.increment("chat.ephemeral.expired", len(users) - len(activity))
+            if not activity:
+                continue
+            event = encode_event(
+                "chat.activity",
+                {"chat_room": room_id, "users": activity, "ttl": self.ttl},
+            )
+            events.extend((group, event) for group in await aroom_groups(room_id))
+        if events:
+            await send_group_events(self.channel_layer, events)
+            metrics.increment("chat.ephemeral.sent", len(events))
+
+
+_buffers: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, ActivityBuffer]" = (
+    weakref.WeakKeyDictionary()
+)
+
+
+def get_activity_buffer() -> ActivityBuffer:
+    """
+    Return the activity buffer of the running event loop.
+    """
+    loop = asyncio.get_running_loop()
+    buffer = _buffers.get(loop)
+    if buffer is None:
+        buffer = _buffers[loop] = ActivityBuffer()
+    return buffer
@@ -0,0 +1,162 @@
+"""
+Streaming export of message history.
+
+Messages are read in id order through ``QuerySet.iterator`` (a server-side
+cursor on PostgreSQL) and written out row by row, so memory stays flat
+whatever the size of the export. Exports can be resumed by passing the id of
+the last exported message as ``after_id``. Archived messages are included.
+
+Under ASGI, ``aiter_export`` reads the same rows chunk by chunk in a worker
+thread, since Django would otherwise consume a sync iterator in full before
+sending the first byte.
+"""
+import csv
+import datetime
+import heapq
+import itertools
+import operator
+from typing import Any, AsyncIterator, Generator, Iterable, Iterator, Optional
+
+from asgiref.sync import sync_to_async
+from django.db.models import QuerySet
+
+from df_chat.encoders import (
+    MESSAGE_FIELDS,
+    dumps,
+    message_payload,
+    user_payload_from_row,
+)
+from df_chat.models import ArchivedChatMessage, ChatMessage
+from df_chat.settings import api_settings
+
+NDJSON = "ndjson"
+CSV = "csv"
+EXPORT_FORMATS = (NDJSON, CSV)
+CONTENT_TYPES = {NDJSON: "application/x-ndjson", CSV: "text/csv"}
+
+
+def export_rows(
+    room_ids: Optional[Iterable[int]] = None,
+    since: Optional[datetime.datetime] = None,
+    until: Optional[datetime.datetime] = None,
+    after_id: Optional[int] = None,
+) -> list[QuerySet]:
+    """
+    Return the ``values()`` rows to export of the archived and the hot
+    messages, each ordered by id. Archival follows the creation time, so the
+    tiers are merged on id while exporting.
+    """
+    querysets = []
+    for model in (ArchivedChatMessage, ChatMessage):
+        queryset = model.objects.all()
+        if room_ids is not None:
+            queryset = queryset.filter(chat_room_id__in=list(room_ids))
+        if since is not None:
+            queryset = queryset.filter(created__gte=since)
+        if until is not None:
+            queryset = queryset.filter(created__lt=until)
+        if after_id is not None:
+            queryset = queryset.filter(id__gt=after_id)
+        querysets.append(
+            queryset.order_by("id").values(
+                *MESSAGE_FIELDS,
+                *(
+                    f"created_by__{name}"
+                    for name in api_settings.DEFAULT_USER_SERIALIZER_FIELDS
+                ),
+            )
+        )
+    return querysets
+
+
+def _payloads(rows: Iterable[QuerySet], chunk_size: Optional[int]) -> Iterator[dict]:
+    chunk_size = chunk_size or api_settings.EXPORT_CHUNK_SIZE
+    users: dict[int, dict] = {}
+    merged = heapq.merge(
+        *(queryset.iterator(chunk_size=chunk_size) for queryset in rows),
+        key=operator.itemgetter("id"),
+    )
+    for i, row in enumerate(merged):
+        if i % chunk_size == 0:
+            # Authors are rendered once per chunk, memory stays flat.
+            users.clear()
+        user_id = row["created_by_id"]
+        if user_id not in users:
+            users[user_id] = user_payload_from_row(row)
+        yield message_payload(row, users[user_id])
+
+
+def iter_ndjson(
+    rows: Iterable[QuerySet], chunk_size: Optional[int] = None
+) -> Generator[bytes, None, None]:
+    for payload in _payloads(rows, chunk_size):
+        yield dumps(payload) + b"\n"
+
+
+class _Echo:
+    """
+    File-like object handing back what ``csv.writer`` writes to it.
+    """
+
+    def write(self, value: str) -> str:
+        return value
+
+
+def csv_header() -> list[str]:
+    return [
+        "id",
+        "created",
+        "modified",
+        "chat_room",
+        *(f"created_by_{name}" for name in api_settings.DEFAULT_USER_SERIALIZER_FIELDS),
+        "message",
+    ]
+
+
+def iter_csv(
+    rows: Iterable[QuerySet], chunk_size: Optional[int] = None
+) -> Generator[str, None, None]:
+    writer: Any = csv.writer(_Echo())
+    yield writer.writerow(csv_header())
+    for payload in _payloads(rows, chunk_size):
+        yield writer.writerow(
+            [
+                payload["id"],
+                payload["created"],
+                payload["modified"],
+                payload["chat_room"],
+                *payload["created_by"].values(),
+                payload["message"],
+            ]
+        )
+
+
+def iter_export(
+    export_format: str, rows: Iterable[QuerySet], chunk_size: Optional[int] = None
+) -> Generator[Any, None, None]:
+    if export_format == NDJSON:
+        return iter_ndjson(rows, chunk_size)
+    if export_format == CSV:
+        return iter_csv(rows, chunk_size)
+    raise ValueError(f"Unknown export format: {export_format}")
+
+
+async def aiter_export(
+    export_format: str, rows: Iterable[QuerySet], chunk_size: Optional[int] = None
+) -> AsyncIterator[Any]:
+    iterator = iter_export(export_format, rows, chunk_size)
+    batch_size = chunk_size or api_settings.EXPORT_CHUNK_SIZE
+
+    def next_batch() -> list[Any]:
+        return list(itertools.islice(iterator, batch_size))
+
+    try:
+        while True:
+            batch = await sync_to_async(next_batch)()
+            if not batch:
+                break
+            for line in batch:
+                yield line
+    finally:
+        # Release the database cursor when the client goes away early.
+        await sync_to_async(iterator.close)()
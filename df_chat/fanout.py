@@ -0,0 +1,72 @@
+import zlib
+
+from df_chat import membership
+from df_chat.constants import (
+    ROOM_CHAT_ALIAS,
+    ROOM_SHARD_CHAT_ALIAS,
+    USER_CHAT_ALIAS,
+)
+from df_chat.dispatchers import get_event_dispatcher
+from df_chat.settings import api_settings
+
+
+class FanoutMode:
+    # One channel layer group per room, every connection joins all its rooms.
+    room = "room"
+    # Connections only join their user group, room events are sent per member.
+    user = "user"
+
+
+def is_user_fanout() -> bool:
+    return api_settings.FANOUT_MODE == FanoutMode.user
+
+
+def room_group(room_id: int, shards: int, channel_name: str) -> str:
+    """
+    Return the group a connection joins for a room. Rooms with several
+    ``ChatRoom.fanout_shards`` spread their connections over one group per
+    shard, picked from a hash of the channel name.
+    """
+    if shards <= 1:
+        return ROOM_CHAT_ALIAS.format(room_id=room_id)
+    shard = zlib.crc32(channel_name.encode("utf8")) % shards
+    return ROOM_SHARD_CHAT_ALIAS.format(room_id=room_id, shard=shard)
+
+
+def shard_groups(room_id: int, shards: int) -> list[str]:
+    """
+    Return every group the connections of a room may have joined.
+    """
+    if shards <= 1:
+        return [ROOM_CHAT_ALIAS.format(room_id=room_id)]
+    return [
+        ROOM_SHARD_CHAT_ALIAS.format(room_id=room_id, shard=shard)
+        for shard in range(shards)
+    ]
+
+
+def room_groups(room_id: int) -> list[str]:
+    """
+    Return the channel layer groups an event for ``room_id`` has to reach.
+    """
+    if is_user_fanout():
+        return [
+            USER_CHAT_ALIAS.format(user_id=user_id)
+            for user_id in sorted(membership.members(room_id))
+        ]
+    return shard_groups(room_id, membership.room_policy(room_id).shards)
+
+
+async def aroom_groups(room_id: int) -> list[str]:
+    if is_user_fanout():
+        return [
+            USER_CHAT_ALIAS.format(user_id=user_id)
+            for user_id in sorted(await membership.amembers(room_id))
+        ]
+    return shard_groups(room_id, (await membership.aroom_policy(room_id)).shards)
+
+
+def dispatch_room_event(room_id: int, event: dict) -> None:
+    get_event_dispatcher().dispatch_many(
+        [(group, event) for group in room_groups(room_id)]
+    )
@@ -0,0 +1,191 @@
+import asyncio
+import logging
+import time
+import weakref
+from dataclasses import dataclass, field
+from typing import Any, Optional
+
+from channels.db import database_sync_to_async
+from django.db import connections, transaction
+
+from df_chat import search
+from df_chat.dispatchers import GroupEvent, get_event_dispatcher
+from df_chat.encoders import (
+    encode_event,
+    message_payload,
+    message_row,
+    user_payload,
+)
+from df_chat.fanout import room_groups
+from df_chat.metrics import metrics
+from df_chat.models import ChatMember, ChatMessage, ChatRoom
+from df_chat.settings import api_settings
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class PendingMessage:
+    user: Any
+    chat_room_id: int
+    message: str
+    future: asyncio.Future = field(repr=False)
+    received_at: Optional[float] = None
+
+
+class MessageWriteBuffer:
+    """
+    Coalesces messages received over WebSocket into bulk inserts.
+
+    Messages are collected for ``flush_interval`` seconds or until
+    ``max_batch_size`` are pending, then inserted with one ``bulk_create``
+    in a single transaction and published as one batch of events. Batches are
+    written in submission order, so per-room ordering is preserved. Each
+    ``submit`` call resolves with the serialized message, including its id.
+    When the bulk insert fails, the batch is retried one message at a time
+    and the messages that still fail resolve with ``None``. Databases that
+    don't return ids from bulk inserts, such as MySQL, always write one
+    message at a time.
+    """
+
+    def __init__(
+        self,
+        max_batch_size: Optional[int] = None,
+        flush_interval: Optional[float] = None,
+    ) -> None:
+        self.max_batch_size = max_batch_size or api_settings.MESSAGE_WRITE_BUFFER_SIZE
+        self.flush_interval = (
+            api_settings.MESSAGE_WRITE_BUFFER_INTERVAL
+            if flush_interval is None
+            else flush_interval
+        )
+        self._pending: list[PendingMessage] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._write_lock = asyncio.Lock()
+        self._tasks: set[asyncio.Task] = set()
+
+    async def submit(
+        self, user: Any, chat_room_id: int, message: str
+    ) -> Optional[dict]:
+        loop = asyncio.get_running_loop()
+        pending = PendingMessage(
+            user,
+            chat_room_id,
+            message,
+            loop.create_future(),
+            time.time() if metrics.enabled else None,
+        )
+        self._pending.append(pending)
+        if len(self._pending) >= self.max_batch_size:
+            self._schedule_flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.flush_interval, self._schedule_flush)
+        return await pending.future
+
+    def _schedule_flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            task = asyncio.ensure_future(self._flush(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _flush(self, batch: list[PendingMessage]) -> None:
+        async with self._write_lock:
+            results: list[Optional[dict]]
+            if not self.can_bulk_insert():
+                with metrics.timer("chat.ingest.flush.seconds"):
+                    results = await database_sync_to_async(self.write_each)(batch)
+            else:
+                try:
+                    with metrics.timer("chat.ingest.flush.seconds"):
+                        results = list(await database_sync_to_async(self.write)(batch))
+                except Exception:
+                    logger.warning(
+                        "Failed to write a batch of %s messages, retrying one by one",
+                        len(batch),
+                        exc_info=True,
+                    )
+                    results = await database_sync_to_async(self.write_each)(batch)
+        metrics.observe("chat.ingest.batch.size", len(batch))
+        for pending, result in zip(batch, results):
+            if not pending.future.done():
+                pending.future.set_result(result)
+
+    @staticmethod
+    def can_bulk_insert() -> bool:
+        """
+        Return whether bulk inserts set the ids of the inserted messages.
+        """
+        return connections[
+            ChatMessage.objects.db
+        ].features.can_return_rows_from_bulk_insert
+
+    def write_each(self, batch: list[PendingMessage]) -> list[Optional[dict]]:
+        results: list[Optional[dict]] = []
+        for pending in batch:
+            try:
+                results.extend(self.write([pending]))
+            except Exception:
+                logger.exception(
+                    "Failed to write a message to %s", pending.chat_room_id
+                )
+                metrics.increment("chat.ingest.failed")
+                results.append(None)
+        return results
+
+    def write(self, batch: list[PendingMessage]) -> list[dict]:
+        with transaction.atomic():
+            messages = [
+                ChatMessage(
+                    chat_room_id=pending.chat_room_id,
+                    created_by=pending.user,
+                    message=pending.message,
+                )
+                for pending in batch
+            ]
+            if self.can_bulk_insert():
+                ChatMessage.objects.bulk_create(messages)
+            else:
+                for message in messages:
+                    message.save()
+            ChatRoom.objects.record_messages(messages)
+            ChatMember.objects.record_messages(messages)
+            search.index_messages(messages, created=True)
+            users: dict[int, dict] = {}
+            groups: dict[int, list[str]] = {}
+            payloads = []
+            events: list[GroupEvent] = []
+            for pending, message in zip(batch, messages):
+                if message.created_by_id not in users:
+                    users[message.created_by_id] = user_payload(message.created_by)
+                if message.chat_room_id not in groups:
+                    groups[message.chat_room_id] = room_groups(message.chat_room_id)
+                payload = message_payload(
+                    message_row(message), users[message.created_by_id]
+                )
+                event = encode_event(
+                    "chat.message.new", payload, ingested_at=pending.received_at
+                )
+                payloads.append(payload)
+                events.extend((group, event) for group in groups[message.chat_room_id])
+            get_event_dispatcher().dispatch_many(events)
+        return payloads
+
+
+_buffers: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, MessageWriteBuffer]" = (
+    weakref.WeakKeyDictionary()
+)
+
+
+def get_write_buffer() -> MessageWriteBuffer:
+    """
+    Return the write buffer of the running event loop.
+    """
+    loop = asyncio.get_running_loop()
+    buffer = _buffers.get(loop)
+    if buffer is None:
+        buffer = _buffers[loop] = MessageWriteBuffer()
+    return buffer
@@ -0,0 +1,49 @@
+import time
+from datetime import timedelta
+from typing import Any
+
+from django.core.management.base import BaseCommand, CommandParser
+
+from df_chat.archive import archive_messages
+
+
+class Command(BaseCommand):
+    help = "Move old chat messages to the archive table"
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument(
+            "--older-than-days",
+            type=float,
+            default=None,
+            help="Archive messages older than this (default: ARCHIVE_AFTER_DAYS)",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=None,
+            help="Number of messages moved per transaction",
+        )
+        parser.add_argument(
+            "--max-batches",
+            type=int,
+            default=None,
+            help="Stop after this many batches",
+        )
+
+    def handle(self, *args: Any, **options: Any) -> None:
+        older_than = (
+            None
+            if options["older_than_days"] is None
+            else timedelta(days=options["older_than_days"])
+        )
+        started = time.perf_counter()
+        archived = archive_messages(
+            older_than=older_than,
+            batch_size=options["batch_size"],
+            max_batches=options["max_batches"],
+        )
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Archived {archived} messages in {time.perf_counter() - started:.3f}s"
+            )
+        )
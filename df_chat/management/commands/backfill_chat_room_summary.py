@@ -0,0 +1,45 @@
+from typing import Any
+
+from django.core.management.base import BaseCommand, CommandParser
+from django.db import transaction
+
+from df_chat.models import ChatRoom
+
+
+class Command(BaseCommand):
+    help = "Recompute the denormalized last message and counters of chat rooms"
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=500,
+            help="Number of rooms updated per transaction",
+        )
+        parser.add_argument(
+            "--room",
+            type=int,
+            action="append",
+            dest="room_ids",
+            help="Only backfill the given room id (can be repeated)",
+        )
+
+    def handle(self, *args: Any, **options: Any) -> None:
+        rooms = ChatRoom.objects.order_by("pk")
+        if options["room_ids"]:
+            rooms = rooms.filter(pk__in=options["room_ids"])
+
+        batch_size = options["batch_size"]
+        last_pk = 0
+        updated = 0
+        while True:
+            pks = list(
+                rooms.filter(pk__gt=last_pk).values_list("pk", flat=True)[:batch_size]
+            )
+            if not pks:
+                break
+            with transaction.atomic():
+                updated += ChatRoom.objects.filter(pk__in=pks).refresh_summary()
+            last_pk = pks[-1]
+
+        self.stdout.write(self.style.SUCCESS(f"Backfilled {updated} chat rooms"))
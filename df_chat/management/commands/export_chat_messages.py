@@ -0,0 +1,85 @@
+from typing import Any, TextIO, Union
+
+from django.core.management.base import (
+    BaseCommand,
+    CommandError,
+    CommandParser,
+    OutputWrapper,
+)
+from django.utils.dateparse import parse_datetime
+
+from df_chat.export import (
+    CSV,
+    EXPORT_FORMATS,
+    NDJSON,
+    export_rows,
+    iter_export,
+)
+
+
+def _datetime(value: str) -> Any:
+    parsed = parse_datetime(value)
+    if parsed is None:
+        raise ValueError(value)
+    return parsed
+
+
+class Command(BaseCommand):
+    help = "Stream chat messages as NDJSON or CSV, oldest first"
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument(
+            "--room",
+            type=int,
+            action="append",
+            dest="room_ids",
+            help="Only export the given room id (can be repeated)",
+        )
+        parser.add_argument(
+            "--since", type=_datetime, help="Only messages created at or after"
+        )
+        parser.add_argument(
+            "--until", type=_datetime, help="Only messages created before"
+        )
+        parser.add_argument(
+            "--after", type=int, help="Resume after the given message id"
+        )
+        parser.add_argument("--export-format", choices=EXPORT_FORMATS, default=NDJSON)
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=None,
+            help="Number of rows fetched from the database at a time",
+        )
+        parser.add_argument(
+            "--output", default="-", help="File to write to, '-' for stdout"
+        )
+
+    def _write_all(self, chunks: Any, output: Union[TextIO, OutputWrapper]) -> int:
+        written = 0
+        for chunk in chunks:
+            output.write(chunk.decode("utf8") if isinstance(chunk, bytes) else chunk)
+            written += 1
+        return written
+
+    def handle(self, *args: Any, **options: Any) -> None:
+        export_format = options["export_format"]
+        rows = export_rows(
+            room_ids=options["room_ids"],
+            since=options["since"],
+            until=options["until"],
+            after_id=options["after"],
+        )
+        chunks = iter_export(export_format, rows, options["chunk_size"])
+
+        if options["output"] == "-":
+            written = self._write_all(chunks, self.stdout)
+        else:
+            try:
+                with open(options["output"], "w", newline="", encoding="utf8") as file:
+                    written = self._write_all(chunks, file)
+            except OSError as exc:
+                raise CommandError(exc)
+
+        exported = written - 1 if export_format == CSV else written
+        self.stderr.write(f"Exported {exported} messages")
@@ -0,0 +1,37 @@
+from typing import Any
+
+from asgiref.sync import async_to_sync
+from django.core.management.base import BaseCommand, CommandParser
+
+from df_chat.reaper import areap_stale_channels
+from df_chat.settings import api_settings
+
+
+class Command(BaseCommand):
+    help = "Remove connections that stopped sending heartbeats and their groups"
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument(
+            "--max-age",
+            type=float,
+            default=None,
+            help="Seconds since the last heartbeat after which a channel is stale "
+            f"(default: PRESENCE_TIMEOUT, {api_settings.PRESENCE_TIMEOUT})",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=None,
+            help="Number of group memberships discarded per channel layer batch",
+        )
+
+    def handle(self, *args: Any, **options: Any) -> None:
+        result = async_to_sync(areap_stale_channels)(
+            max_age=options["max_age"], batch_size=options["batch_size"]
+        )
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Reclaimed {result.channels} channels "
+                f"({result.memberships} group memberships) in {result.seconds:.3f}s"
+            )
+        )
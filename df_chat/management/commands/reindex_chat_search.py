@@ -0,0 +1,42 @@
+from typing import Any
+
+from django.core.management.base import BaseCommand, CommandParser
+from django.db import transaction
+
+from df_chat.models import ArchivedChatMessage, ChatMessage
+from df_chat.search import get_search_backend
+
+
+class Command(BaseCommand):
+    help = "Rebuild the message search index from the message tables"
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Number of messages indexed per transaction",
+        )
+
+    def handle(self, *args: Any, **options: Any) -> None:
+        backend = get_search_backend()
+        batch_size = options["batch_size"]
+        backend.clear()
+
+        indexed = 0
+        for model in (ArchivedChatMessage, ChatMessage):
+            last_pk = 0
+            while True:
+                batch = list(
+                    model.objects.filter(pk__gt=last_pk)
+                    .order_by("pk")
+                    .only("id", "chat_room_id", "message")[:batch_size]
+                )
+                if not batch:
+                    break
+                with transaction.atomic():
+                    backend.index(batch, created=True)
+                indexed += len(batch)
+                last_pk = batch[-1].pk
+
+        self.stdout.write(self.style.SUCCESS(f"Indexed {indexed} messages"))
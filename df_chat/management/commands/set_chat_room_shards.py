@@ -0,0 +1,37 @@
+from typing import Any
+
+from django.core.management.base import (
+    BaseCommand,
+    CommandError,
+    CommandParser,
+)
+
+from df_chat.members import set_fanout_shards
+from df_chat.models import ChatRoom
+
+
+class Command(BaseCommand):
+    help = (
+        "Change the number of fan-out shards of a chat room and move the "
+        "connections of its online members"
+    )
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument("room_id", type=int)
+        parser.add_argument("shards", type=int)
+
+    def handle(self, *args: Any, **options: Any) -> None:
+        if options["shards"] < 1:
+            raise CommandError("shards must be at least 1")
+        try:
+            room = ChatRoom.objects.get(pk=options["room_id"])
+        except ChatRoom.DoesNotExist:
+            raise CommandError(f"Chat room {options['room_id']} does not exist")
+
+        moved = set_fanout_shards(room, options["shards"])
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Chat room {room.pk} uses {room.fanout_shards} shards, "
+                f"moved {moved} connections"
+            )
+        )
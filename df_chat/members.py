@@ -0,0 +1,207 @@
+"""
+Bulk changes to room membership.
+
+Adding or removing thousands of users goes through one validation query,
+batched ``ChatMember`` writes, channel subscriptions updated per batch of
+``MEMBERS_BATCH_SIZE`` users and a single ``chat.members.changed`` event,
+instead of the per-user work of ``room.users.add()``.
+
+Changing the fan-out shards of a room moves the online connections of its
+members to the group of their new shard.
+"""
+import threading
+from dataclasses import dataclass, field
+from typing import Iterable, Iterator, Optional
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+
+from df_chat import membership
+from df_chat.encoders import encode_event
+from df_chat.fanout import dispatch_room_event, is_user_fanout, room_group
+from df_chat.models import ChatMember, ChatRoom
+from df_chat.presence import get_presence_backend
+from df_chat.settings import api_settings
+from df_chat.utils import (
+    DynamicUserGroupSubscriptionHandler,
+    group_add_many,
+    group_discard_many,
+)
+
+User = get_user_model()
+
+
+@dataclass
+class MembersChange:
+    added: list[int] = field(default_factory=list)
+    removed: list[int] = field(default_factory=list)
+    # Requested ids that don't belong to any user.
+    unknown: list[int] = field(default_factory=list)
+
+    def __bool__(self) -> bool:
+        return bool(self.added or self.removed)
+
+
+def _batches(ids: list[int], batch_size: int) -> Iterator[list[int]]:
+    for start in range(0, len(ids), batch_size):
+        yield ids[start : start + batch_size]
+
+
+def _resolve(room: ChatRoom, user_ids: Iterable[int]) -> tuple[set[int], set[int]]:
+    """
+    Return the existing users among ``user_ids`` and those of them already
+    members of the room, with one query.
+    """
+    rows = (
+        User.objects.filter(pk__in=set(user_ids))
+        .annotate(
+            is_member=Exists(
+                ChatMember.objects.filter(chat_room=room, user_id=OuterRef("pk"))
+            )
+        )
+        .values_list("pk", "is_member")
+    )
+    existing, members = set(), set()
+    for user_id, is_member in rows:
+        existing.add(user_id)
+        if is_member:
+            members.add(user_id)
+    return existing, members
+
+
+def _publish(room: ChatRoom, change: MembersChange) -> None:
+    dispatch_room_event(
+        room.id,
+        encode_event(
+            "chat.members.changed",
+            {"chat_room": room.id, "added": change.added, "removed": change.removed},
+        ),
+    )
+
+
+def add_members(
+    room: ChatRoom, user_ids: Iterable[int], batch_size: Optional[int] = None
+) -> MembersChange:
+    """
+    Add the users to the room, skipping unknown ids and existing members.
+    """
+    batch_size = batch_size or api_settings.MEMBERS_BATCH_SIZE
+    user_ids = list(user_ids)
+    existing, members = _resolve(room, user_ids)
+    change = MembersChange(
+        added=sorted(existing - members),
+        unknown=sorted(set(user_ids) - existing),
+    )
+    if not change:
+        return change
+
+    handler = DynamicUserGroupSubscriptionHandler()
+    with transaction.atomic():
+        # Conflicts are users added concurrently since _resolve.
+        ChatMember.objects.bulk_create(
+            [ChatMember(chat_room=room, user_id=user_id) for user_id in change.added],
+            batch_size=batch_size,
+            ignore_conflicts=True,
+        )
+        # Reloaded once after the commit, by the subscriptions or the event's
+        # fan-out.
+        membership.invalidate([room.id])
+
+        def subscribe() -> None:
+            for batch in _batches(change.added, batch_size):
+                handler.subscribe_many(batch, [room.id])
+            _publish(room, change)
+
+        # Connections join the room only once the members are committed, and
+        # before the event so the new members receive it.
+        transaction.on_commit(subscribe)
+    return change
+
+
+def remove_members(
+    room: ChatRoom, user_ids: Iterable[int], batch_size: Optional[int] = None
+) -> MembersChange:
+    """
+    Remove the users from the room, skipping unknown ids and non members.
+    """
+    batch_size = batch_size or api_settings.MEMBERS_BATCH_SIZE
+    user_ids = list(user_ids)
+    existing, members = _resolve(room, user_ids)
+    change = MembersChange(
+        removed=sorted(members), unknown=sorted(set(user_ids) - existing)
+    )
+    if not change:
+        return change
+
+    handler = DynamicUserGroupSubscriptionHandler()
+    with transaction.atomic():
+        for batch in _batches(change.removed, batch_size):
+            # A raw delete skips the per-row post_delete receiver, the cached
+            # members are invalidated once below.
+            members_batch = ChatMember.objects.filter(chat_room=room, user_id__in=batch)
+            members_batch._raw_delete(members_batch.db)
+        membership.invalidate([room.id])
+
+        def unsubscribe() -> None:
+            for batch in _batches(change.removed, batch_size):
+                handler.unsubscribe_many(batch, [room.id])
+            _publish(room, change)
+
+        transaction.on_commit(unsubscribe)
+    return change
+
+
+def move_shards(room: ChatRoom, previous_shards: int) -> int:
+    """
+    Move the online connections of the room's members from the shard groups
+    of ``previous_shards`` to those of ``room.fanout_shards``. Return the
+    number of moved connections.
+
+    Other processes keep publishing to the previous groups until their cached
+    room policy expires, so connections only leave them after
+    ``MEMBERSHIP_LOCAL_CACHE_TTL`` seconds, from a timer thread. Each event is
+    published to one set of groups, so the overlap doesn't duplicate events.
+    """
+    if is_user_fanout() or previous_shards == room.fanout_shards:
+        return 0
+    channels = get_presence_backend().channels_for_users(membership.members(room.id))
+    moves = [
+        (
+            room_group(room.id, previous_shards, channel),
+            room_group(room.id, room.fanout_shards, channel),
+            channel,
+        )
+        for channel in channels
+    ]
+    moves = [move for move in moves if move[0] != move[1]]
+    if not moves:
+        return 0
+
+    channel_layer = get_channel_layer()
+    async_to_sync(group_add_many)(
+        channel_layer, [(new, channel) for _, new, channel in moves]
+    )
+    previous = [(old, channel) for old, _, channel in moves]
+
+    def leave_previous() -> None:
+        async_to_sync(group_discard_many)(channel_layer, previous)
+
+    delay = api_settings.MEMBERSHIP_LOCAL_CACHE_TTL
+    if delay:
+        threading.Timer(delay, leave_previous).start()
+    else:
+        leave_previous()
+    return len(moves)
+
+
+def set_fanout_shards(room: ChatRoom, shards: int) -> int:
+    """
+    Change the fan-out shards of the room, see ``move_shards``.
+    """
+    previous_shards = room.fanout_shards
+    room.fanout_shards = shards
+    room.save(update_fields=["fanout_shards", "modified"])
+    return move_shards(room, previous_shards)
@@ -0,0 +1,196 @@
+"""
+Cached room membership used by permission checks and message fan-out.
+
+Each room entry holds the member ids and the room's ``RoomPolicy`` (fan-out
+shards and who may post), loaded together with one query. Lookups go through
+a per-process LRU first, then the optional Django cache configured by
+``MEMBER_INDEX_CACHE`` and finally the database. Writes invalidate both tiers
+of the current process and the shared Django cache; other processes pick
+changes up once their local entry expires, so keep
+``MEMBERSHIP_LOCAL_CACHE_TTL`` short.
+"""
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Iterable, Optional
+
+from channels.db import database_sync_to_async
+from django.core.cache import BaseCache, caches
+from django.db import transaction
+
+from df_chat.cache import LRUCache
+from df_chat.models import ChatMember
+from df_chat.settings import api_settings
+
+MEMBERS_CACHE_KEY = "df_chat:room:{room_id}"
+
+
+@dataclass(frozen=True)
+class RoomPolicy:
+    # Number of channel layer groups the room's connections are spread over.
+    shards: int = 1
+    # Users allowed to post, None when every member can.
+    posters: Optional[frozenset[int]] = None
+
+
+RoomEntry = tuple[frozenset[int], RoomPolicy]
+
+
+def _cache_key(room_id: int) -> str:
+    return MEMBERS_CACHE_KEY.format(room_id=room_id)
+
+
+@lru_cache(maxsize=None)
+def get_local_cache() -> LRUCache:
+    return LRUCache(
+        maxsize=api_settings.MEMBERSHIP_LOCAL_CACHE_SIZE,
+        ttl=api_settings.MEMBERSHIP_LOCAL_CACHE_TTL,
+    )
+
+
+def _shared_cache() -> Optional[BaseCache]:
+    alias = api_settings.MEMBER_INDEX_CACHE
+    return caches[alias] if alias else None
+
+
+def _load(room_ids: list[int]) -> dict[int, RoomEntry]:
+    members: dict[int, set[int]] = {room_id: set() for room_id in room_ids}
+    posters: dict[int, set[int]] = {}
+    policies: dict[int, tuple[int, bool]] = {}
+    rows = ChatMember.objects.filter(chat_room_id__in=room_ids).values_list(
+        "chat_room_id",
+        "user_id",
+        "is_admin",
+        "is_owner",
+        "chat_room__fanout_shards",
+        "chat_room__admins_only_posting",
+    )
+    for room_id, user_id, is_admin, is_owner, shards, admins_only in rows:
+        members[room_id].add(user_id)
+        policies[room_id] = (shards, admins_only)
+        if is_admin or is_owner:
+            posters.setdefault(room_id, set()).add(user_id)
+
+    entries = {}
+    for room_id, member_ids in members.items():
+        # Rooms without members have nobody to fan out to or to post.
+        shards, admins_only = policies.get(room_id, (1, False))
+        policy = RoomPolicy(
+            shards=max(shards, 1),
+            posters=frozenset(posters.get(room_id, ())) if admins_only else None,
+        )
+        entries[room_id] = (frozenset(member_ids), policy)
+    return entries
+
+
+def _entries(room_ids: Iterable[int]) -> dict[int, RoomEntry]:
+    local_cache = get_local_cache()
+    entries: dict[int, RoomEntry] = {}
+    missing = []
+    for room_id in room_ids:
+        entry = local_cache.get(room_id)
+        if entry is None:
+            missing.append(room_id)
+        else:
+            entries[room_id] = entry
+    if not missing:
+        return entries
+
+    shared_cache = _shared_cache()
+    if shared_cache is not None:
+        cached = shared_cache.get_many([_cache_key(room_id) for room_id in missing])
+        for room_id in missing:
+            entry = cached.get(_cache_key(room_id))
+            if entry is not None:
+                entries[room_id] = entry
+        missing = [room_id for room_id in missing if room_id not in entries]
+    if missing:
+        loaded = _load(missing)
+        if shared_cache is not None:
+            shared_cache.set_many(
+                {_cache_key(room_id): entry for room_id, entry in loaded.items()},
+                api_settings.MEMBER_INDEX_TIMEOUT,
+            )
+        entries.update(loaded)
+    for room_id, entry in entries.items():
+        local_cache.set(room_id, entry)
+    return entries
+
+
+def _entry(room_id: int) -> RoomEntry:
+    return _entries([room_id])[room_id]
+
+
+async def _aentry(room_id: int) -> RoomEntry:
+    """
+    Only leaves the event loop on a miss of the local cache.
+    """
+    entry = get_local_cache().get(room_id)
+    if entry is None:
+        entry = await database_sync_to_async(_entry)(room_id)
+    return entry
+
+
+def members(room_id: int) -> frozenset[int]:
+    """
+    Return the ids of the users belonging to a room.
+    """
+    return _entry(room_id)[0]
+
+
+async def amembers(room_id: int) -> frozenset[int]:
+    return (await _aentry(room_id))[0]
+
+
+def room_policy(room_id: int) -> RoomPolicy:
+    return _entry(room_id)[1]
+
+
+async def aroom_policy(room_id: int) -> RoomPolicy:
+    return (await _aentry(room_id))[1]
+
+
+def room_policies(room_ids: Iterable[int]) -> dict[int, RoomPolicy]:
+    return {room_id: entry[1] for room_id, entry in _entries(room_ids).items()}
+
+
+def is_member(user_id: Optional[int], room_id: int) -> bool:
+    return user_id is not None and user_id in members(room_id)
+
+
+async def ais_member(user_id: Optional[int], room_id: int) -> bool:
+    return user_id is not None and user_id in await amembers(room_id)
+
+
+def _can_post(user_id: Optional[int], entry: RoomEntry) -> bool:
+    member_ids, policy = entry
+    return user_id in member_ids and (
+        policy.posters is None or user_id in policy.posters
+    )
+
+
+def can_post(user_id: Optional[int], room_id: int) -> bool:
+    return user_id is not None and _can_post(user_id, _entry(room_id))
+
+
+async def acan_post(user_id: Optional[int], room_id: int) -> bool:
+    return user_id is not None and _can_post(user_id, await _aentry(room_id))
+
+
+def _drop(room_ids: list[int]) -> None:
+    local_cache = get_local_cache()
+    for room_id in room_ids:
+        local_cache.delete(room_id)
+    shared_cache = _shared_cache()
+    if shared_cache is not None:
+        shared_cache.delete_many([_cache_key(room_id) for room_id in room_ids])
+
+
+def invalidate(room_ids: Iterable[int]) -> None:
+    """
+    Drop cached members of the given rooms now and once more on commit, so a
+    reader racing with the write can't keep the old membership around.
+    """
+    room_ids = list(room_ids)
+    if room_ids:
+        _drop(room_ids)
+        transaction.on_commit(lambda: _drop(room_ids))
@@ -0,0 +1,236 @@
+"""
+Instrumentation of the chat hot paths.
+
+``metrics`` forwards to the sink configured by ``METRICS_SINK``:
+
+- ``NullMetricsSink`` (default) ignores everything. Callers can check
+  ``metrics.enabled`` to skip work that only feeds metrics.
+- ``InMemoryMetricsSink`` keeps counters, gauges and summaries in process,
+  with histogram buckets for ``*.seconds`` timings.
+- ``PrometheusMetricsSink`` also renders them in the Prometheus text format,
+  served by ``df_chat.views.prometheus_metrics``.
+"""
+import bisect
+import contextlib
+import re
+import threading
+import time
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import Any, ContextManager, Iterator
+
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+from df_chat.settings import api_settings
+
+HISTOGRAM_SUFFIX = ".seconds"
+
+
+class BaseMetricsSink:
+    enabled = True
+
+    def increment(self, name: str, value: float = 1) -> None:
+        raise NotImplementedError
+
+    def observe(self, name: str, value: float) -> None:
+        raise NotImplementedError
+
+    def set_gauge(self, name: str, value: float) -> None:
+        raise NotImplementedError
+
+    def adjust_gauge(self, name: str, value: float) -> None:
+        raise NotImplementedError
+
+    def timer(self, name: str) -> ContextManager[None]:
+        return self._timer(name)
+
+    @contextmanager
+    def _timer(self, name: str) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started)
+
+    def snapshot(self) -> dict[str, dict]:
+        return {"counters": {}, "gauges": {}, "summaries": {}}
+
+    def reset(self) -> None:
+        pass
+
+
+class NullMetricsSink(BaseMetricsSink):
+    enabled = False
+
+    def increment(self, name: str, value: float = 1) -> None:
+        pass
+
+    def observe(self, name: str, value: float) -> None:
+        pass
+
+    def set_gauge(self, name: str, value: float) -> None:
+        pass
+
+    def adjust_gauge(self, name: str, value: float) -> None:
+        pass
+
+    def timer(self, name: str) -> ContextManager[None]:
+        return contextlib.nullcontext()
+
+
+class InMemoryMetricsSink(BaseMetricsSink):
+    """
+    Thread safe in-process counters, gauges and timing summaries.
+    """
+
+    def __init__(self) -> None:
+        self.buckets = tuple(sorted(api_settings.METRICS_BUCKETS))
+        self._lock = threading.Lock()
+        self._counters: dict[str, float] = {}
+        self._gauges: dict[str, float] = {}
+        self._summaries: dict[str, dict[str, Any]] = {}
+
+    def increment(self, name: str, value: float = 1) -> None:
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def set_gauge(self, name: str, value: float) -> None:
+        with self._lock:
+            self._gauges[name] = value
+
+    def adjust_gauge(self, name: str, value: float) -> None:
+        with self._lock:
+            self._gauges[name] = self._gauges.get(name, 0) + value
+
+    def observe(self, name: str, value: float) -> None:
+        with self._lock:
+            summary = self._summaries.get(name)
+            if summary is None:
+                summary = self._summaries[name] = {
+                    "count": 1,
+                    "sum": value,
+                    "min": value,
+                    "max": value,
+                }
+                if name.endswith(HISTOGRAM_SUFFIX):
+                    summary["buckets"] = [0] * len(self.buckets)
+            else:
+                summary["count"] += 1
+                summary["sum"] += value
+                summary["min"] = min(summary["min"], value)
+                summary["max"] = max(summary["max"], value)
+            if "buckets" in summary:
+                # Observations above the last bound only count towards +Inf.
+                index = bisect.bisect_left(self.buckets, value)
+                if index < len(self.buckets):
+                    summary["buckets"][index] += 1
+
+    def snapshot(self) -> dict[str, dict]:
+        with self._lock:
+            return {
+                "counters": dict(self._counters),
+                "gauges": dict(self._gauges),
+                "summaries": {
+                    name: {
+                        key: list(value) if key == "buckets" else value
+                        for key, value in summary.items()
+                    }
+                    for name, summary in self._summaries.items()
+                },
+            }
+
+    def reset(self) -> None:
+        with self._lock:
+            self._counters.clear()
+            self._gauges.clear()
+            self._summaries.clear()
+
+
+def _metric_name(name: str) -> str:
+    return re.sub(r"[^a-zA-Z0-9_]", "_", name)
+
+
+def _number(value: float) -> str:
+    return repr(float(value))
+
+
+class PrometheusMetricsSink(InMemoryMetricsSink):
+    """
+    In-memory sink rendered in the Prometheus text exposition format.
+    Timings become histograms, other observations summaries.
+    """
+
+    content_type = "text/plain; version=0.0.4; charset=utf-8"
+
+    def render(self) -> str:
+        snapshot = self.snapshot()
+        lines = []
+        for name, value in sorted(snapshot["counters"].items()):
+            metric = f"{_metric_name(name)}_total"
+            lines += [f"# TYPE {metric} counter", f"{metric} {_number(value)}"]
+        for name, value in sorted(snapshot["gauges"].items()):
+            metric = _metric_name(name)
+            lines += [f"# TYPE {metric} gauge", f"{metric} {_number(value)}"]
+        for name, summary in sorted(snapshot["summaries"].items()):
+            metric = _metric_name(name)
+            if "buckets" in summary:
+                lines.append(f"# TYPE {metric} histogram")
+                cumulative = 0
+                for bound, count in zip(self.buckets, summary["buckets"]):
+                    cumulative += count
+                    lines.append(f'{metric}_bucket{{le="{bound}"}} {cumulative}')
+                lines.append(f'{metric}_bucket{{le="+Inf"}} {summary["count"]}')
+            else:
+                lines.append(f"# TYPE {metric} summary")
+            lines += [
+                f"{metric}_sum {_number(summary['sum'])}",
+                f"{metric}_count {summary['count']}",
+            ]
+        return "\n".join(lines) + "\n"
+
+
+@lru_cache(maxsize=None)
+def get_metrics_sink() -> BaseMetricsSink:
+    return api_settings.METRICS_SINK()
+
+
+@receiver(setting_changed)
+def reset_metrics_sink(*, setting: str, **kwargs: Any) -> None:
+    if setting == "DF_CHAT":
+        get_metrics_sink.cache_clear()
+
+
+class _Metrics:
+    """
+    Forwards to the configured sink, so modules can import ``metrics`` before
+    settings are read.
+    """
+
+    @property
+    def enabled(self) -> bool:
+        return get_metrics_sink().enabled
+
+    def increment(self, name: str, value: float = 1) -> None:
+        get_metrics_sink().increment(name, value)
+
+    def observe(self, name: str, value: float) -> None:
+        get_metrics_sink().observe(name, value)
+
+    def set_gauge(self, name: str, value: float) -> None:
+        get_metrics_sink().set_gauge(name, value)
+
+    def adjust_gauge(self, name: str, value: float) -> None:
+        get_metrics_sink().adjust_gauge(name, value)
+
+    def timer(self, name: str) -> ContextManager[None]:
+        return get_metrics_sink().timer(name)
+
+    def snapshot(self) -> dict[str, dict]:
+        return get_metrics_sink().snapshot()
+
+    def reset(self) -> None:
+        get_metrics_sink().reset()
+
+
+metrics = _Metrics()
@@ -1,4 +1,8 @@
+import hashlib
+import time
 import traceback
+from functools import lru_cache
+from typing import Any, Optional
 from urllib.parse import parse_qs
 
 from channels.auth import AuthMiddlewareStack
@@ -6,17 +10,68 @@ from channels.db import database_sync_to_async
 from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.contrib.auth.models import AnonymousUser
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
 from jwt import DecodeError, ExpiredSignatureError, InvalidSignatureError
 from jwt import decode as jwt_decode
 
+from df_chat.cache import LRUCache
+from df_chat.metrics import metrics
+from df_chat.settings import api_settings
+
 User = get_user_model()
 
 
+@lru_cache(maxsize=None)
+def get_token_cache() -> Optional[LRUCache]:
+    """
+    Decoded JWT payloads keyed by token hash, kept until the token expires.
+    """
+    if not api_settings.JWT_CACHE_SIZE:
+        return None
+    return LRUCache(maxsize=api_settings.JWT_CACHE_SIZE, ttl=api_settings.JWT_CACHE_TTL)
+
+
+@lru_cache(maxsize=None)
+def get_user_cache() -> Optional[LRUCache]:
+    """
+    Authenticated users keyed by id, dropped whenever the user is saved.
+    """
+    if not api_settings.JWT_USER_CACHE_SIZE:
+        return None
+    return LRUCache(
+        maxsize=api_settings.JWT_USER_CACHE_SIZE,
+        ttl=api_settings.JWT_USER_CACHE_TTL,
+    )
+
+
+def get_cache_stats() -> dict[str, Optional[dict[str, int]]]:
+    token_cache = get_token_cache()
+    user_cache = get_user_cache()
+    return {
+        "tokens": token_cache.stats() if token_cache else None,
+        "users": user_cache.stats() if user_cache else None,
+    }
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_cached_user(instance: Any, **kwargs: Any) -> None:
+    user_cache = get_user_cache()
+    if user_cache is not None:
+        user_cache.delete(instance.pk)
+
+
 class JWTAuthMiddleware:
     def __init__(self, inner):
         self.inner = inner
 
     async def __call__(self, scope, receive, send):
+        with metrics.timer("chat.auth.seconds"):
+            await self.authenticate(scope)
+        return await self.inner(scope, receive, send)
+
+    async def authenticate(self, scope: dict) -> None:
         try:
             if jwt_token_list := parse_qs(scope["query_string"].decode("utf8")).get(
                 "token", None
@@ -32,9 +87,24 @@ class JWTAuthMiddleware:
             traceback.print_exc()
         except Exception:
             scope["user"] = AnonymousUser()
-        return await self.inner(scope, receive, send)
 
     def get_payload(self, jwt_token):
+        token_cache = get_token_cache()
+        if token_cache is None:
+            return self.decode_token(jwt_token)
+
+        key = hashlib.sha256(jwt_token.encode("utf8")).hexdigest()
+        payload = token_cache.get(key)
+        if payload is None:
+            payload = self.decode_token(jwt_token)
+            ttl = api_settings.JWT_CACHE_TTL
+            if "exp" in payload:
+                ttl = min(ttl, payload["exp"] - time.time())
+            if ttl > 0:
+                token_cache.set(key, payload, ttl=ttl)
+        return payload
+
+    def decode_token(self, jwt_token: str) -> dict:
         payload = jwt_decode(jwt_token, settings.SECRET_KEY, algorithms=["HS256"])
         return payload
 
@@ -47,7 +117,14 @@ class JWTAuthMiddleware:
         return user_id
 
     async def get_logged_in_user(self, user_id):
+        user_cache = get_user_cache()
+        if user_cache is not None:
+            user = user_cache.get(user_id)
+            if user is not None:
+                return user
         user = await self.get_user(user_id)
+        if user_cache is not None and user.is_authenticated:
+            user_cache.set(user_id, user)
         return user
 
     @database_sync_to_async
@@ -0,0 +1,54 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:56
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+
+def remove_duplicate_members(apps, schema_editor):
+    ChatMember = apps.get_model("df_chat", "ChatMember")
+    duplicates = (
+        ChatMember.objects.values("user", "chat_room")
+        .annotate(keep_id=Min("id"), total=Count("id"))
+        .filter(total__gt=1)
+    )
+    for duplicate in duplicates:
+        ChatMember.objects.filter(
+            user=duplicate["user"], chat_room=duplicate["chat_room"]
+        ).exclude(id=duplicate["keep_id"]).delete()
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("df_chat", "0002_chatroom_summary"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="chatmessage",
+            index=models.Index(
+                fields=["chat_room", "-created", "-id"],
+                name="df_chat_msg_room_created_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="memberchannel",
+            index=models.Index(
+                fields=["channel_name"], name="df_chat_channel_name_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="memberchannel",
+            index=models.Index(
+                fields=["user", "channel_name"], name="df_chat_channel_user_idx"
+            ),
+        ),
+        migrations.RunPython(remove_duplicate_members, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name="chatmember",
+            constraint=models.UniqueConstraint(
+                fields=("user", "chat_room"), name="df_chat_member_user_room_uniq"
+            ),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:11
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("df_chat", "0003_chat_indexes"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="memberchannel",
+            index=models.Index(
+                fields=["last_alive_at"], name="df_chat_channel_alive_idx"
+            ),
+        ),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:18
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("df_chat", "0004_memberchannel_alive_index"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ArchivedChatMessage",
+            fields=[
+                ("id", models.IntegerField(primary_key=True, serialize=False)),
+                ("created", models.DateTimeField()),
+                ("modified", models.DateTimeField()),
+                ("message", models.TextField()),
+                (
+                    "archived_at",
+                    models.DateTimeField(
+                        default=django.utils.timezone.now, editable=False
+                    ),
+                ),
+                (
+                    "chat_room",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="df_chat.chatroom",
+                    ),
+                ),
+                (
+                    "created_by",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["chat_room", "-created", "-id"],
+                        name="df_chat_archived_room_idx",
+                    )
+                ],
+            },
+        ),
+    ]
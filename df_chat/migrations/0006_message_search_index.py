@@ -0,0 +1,52 @@
+from django.db import OperationalError, migrations, transaction
+
+SQLITE_TABLE = "df_chat_message_fts"
+POSTGRES_TABLE = "df_chat_message_search"
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == "sqlite":
+        try:
+            with transaction.atomic(using=schema_editor.connection.alias):
+                schema_editor.execute(
+                    f"CREATE VIRTUAL TABLE IF NOT EXISTS {SQLITE_TABLE} USING fts5("
+                    "message, chat_room_id UNINDEXED, tokenize = 'unicode61')"
+                )
+        except OperationalError:
+            # SQLite built without FTS5, search falls back to
+            # BasicSearchBackend.
+            pass
+    elif vendor == "postgresql":
+        schema_editor.execute(
+            f"CREATE TABLE IF NOT EXISTS {POSTGRES_TABLE} ("
+            "message_id integer PRIMARY KEY, "
+            "chat_room_id integer NOT NULL, "
+            "document tsvector NOT NULL)"
+        )
+        schema_editor.execute(
+            f"CREATE INDEX IF NOT EXISTS {POSTGRES_TABLE}_document_idx "
+            f"ON {POSTGRES_TABLE} USING GIN (document)"
+        )
+        schema_editor.execute(
+            f"CREATE INDEX IF NOT EXISTS {POSTGRES_TABLE}_room_idx "
+            f"ON {POSTGRES_TABLE} (chat_room_id)"
+        )
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == "sqlite":
+        schema_editor.execute(f"DROP TABLE IF EXISTS {SQLITE_TABLE}")
+    elif vendor == "postgresql":
+        schema_editor.execute(f"DROP TABLE IF EXISTS {POSTGRES_TABLE}")
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("df_chat", "0005_archivedchatmessage"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
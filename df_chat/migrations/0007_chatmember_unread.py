@@ -0,0 +1,22 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("df_chat", "0006_message_search_index"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="chatmember",
+            name="last_read_message_id",
+            field=models.IntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name="chatmember",
+            name="unread_count",
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("df_chat", "0007_chatmember_unread"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="chatroom",
+            name="admins_only_posting",
+            field=models.BooleanField(
+                default=False, help_text="Only owners and admins can post messages."
+            ),
+        ),
+        migrations.AddField(
+            model_name="chatroom",
+            name="fanout_shards",
+            field=models.PositiveSmallIntegerField(
+                default=1,
+                help_text="Number of channel layer groups the connections of the room are spread over. Raise it for rooms with many thousands of members.",
+            ),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:36
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("df_chat", "0008_chatroom_fanout"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="chatmessage",
+            index=models.Index(
+                fields=["created", "id"], name="df_chat_msg_created_idx"
+            ),
+        ),
+    ]
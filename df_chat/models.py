@@ -1,8 +1,107 @@
+from typing import Iterable
+
 from django.conf import settings
 from django.db import models
+from django.db.models import Case, Count, F, OuterRef, Q, Subquery, Value, When
+from django.db.models.functions import Coalesce, Greatest, Least, Substr
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 from model_utils.models import TimeStampedModel
 
+LAST_MESSAGE_PREVIEW_LENGTH = 255
+
+
+class ChatRoomQuerySet(models.QuerySet):
+    def record_messages(self, messages: Iterable["ChatMessage"]) -> None:
+        """
+        Fold newly created messages into the denormalized room summary.
+
+        Issues a single UPDATE per room. The last message fields only move
+        forward, so concurrent writers can't overwrite a newer message.
+        """
+        by_room: dict[int, list[ChatMessage]] = {}
+        for message in messages:
+            by_room.setdefault(message.chat_room_id, []).append(message)
+
+        for room_id, room_messages in by_room.items():
+            last = max(room_messages, key=lambda message: message.id)
+            is_newer = Q(last_message_id__isnull=True) | Q(last_message_id__lt=last.id)
+            self.filter(pk=room_id).update(
+                message_count=F("message_count") + len(room_messages),
+                last_message_id=Case(
+                    When(is_newer, then=Value(last.id)),
+                    default=F("last_message_id"),
+                ),
+                last_message_preview=Case(
+                    When(
+                        is_newer,
+                        then=Value(last.message[:LAST_MESSAGE_PREVIEW_LENGTH]),
+                    ),
+                    default=F("last_message_preview"),
+                ),
+                last_activity_at=Case(
+                    When(is_newer, then=Value(last.created)),
+                    default=F("last_activity_at"),
+                ),
+            )
+
+    def record_message_edit(self, message: "ChatMessage") -> None:
+        self.filter(pk=message.chat_room_id, last_message_id=message.id).update(
+            last_message_preview=message.message[:LAST_MESSAGE_PREVIEW_LENGTH]
+        )
+
+    def record_message_removal(self, chat_room_id: int, message_id: int) -> None:
+        self.filter(pk=chat_room_id).update(
+            message_count=Greatest(F("message_count") - 1, 0)
+        )
+        self.filter(pk=chat_room_id, last_message_id=message_id)._refresh_last_message()
+
+    def refresh_summary(self) -> int:
+        """
+        Recompute the denormalized summary of every room in the queryset,
+        counting archived messages too.
+        """
+
+        def count(model: type[models.Model]) -> Coalesce:
+            return Coalesce(
+                Subquery(
+                    model.objects.filter(chat_room=OuterRef("pk"))
+                    .order_by()
+                    .values("chat_room")
+                    .annotate(count=Count("id"))
+                    .values("count")
+                ),
+                0,
+            )
+
+        self.update(message_count=count(ChatMessage) + count(ArchivedChatMessage))
+        return self._refresh_last_message()
+
+    def _refresh_last_message(self) -> int:
+        # Archived messages are all older than the hot ones.
+        tiers = [
+            model.objects.filter(chat_room=OuterRef("pk"))
+            .order_by("-created", "-id")
+            .annotate(preview=Substr("message", 1, LAST_MESSAGE_PREVIEW_LENGTH))
+            for model in (ChatMessage, ArchivedChatMessage)
+        ]
+
+        def newest(field: str, output_field: models.Field) -> Coalesce:
+            return Coalesce(
+                *(Subquery(tier.values(field)[:1]) for tier in tiers),
+                output_field=output_field,
+            )
+
+        return self.update(
+            last_message_id=newest("id", models.IntegerField()),
+            last_message_preview=Coalesce(
+                newest("preview", models.CharField()), Value("")
+            ),
+            last_activity_at=Coalesce(
+                newest("created", models.DateTimeField()), F("created")
+            ),
+        )
+
 
 class ChatRoom(TimeStampedModel):
     class ChatType(models.TextChoices):
@@ -17,6 +116,32 @@ class ChatRoom(TimeStampedModel):
         max_length=30, choices=ChatType.choices, default=ChatType.private
     )
 
+    last_message_id = models.IntegerField(null=True, blank=True, editable=False)
+    last_message_preview = models.CharField(
+        max_length=LAST_MESSAGE_PREVIEW_LENGTH, blank=True, default="", editable=False
+    )
+    last_activity_at = models.DateTimeField(default=timezone.now, editable=False)
+    message_count = models.PositiveIntegerField(default=0, editable=False)
+    fanout_shards = models.PositiveSmallIntegerField(
+        default=1,
+        help_text=_(
+            "Number of channel layer groups the connections of the room are "
+            "spread over. Raise it for rooms with many thousands of members."
+        ),
+    )
+    admins_only_posting = models.BooleanField(
+        default=False, help_text=_("Only owners and admins can post messages.")
+    )
+
+    objects = ChatRoomQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["-last_activity_at", "-id"], name="df_chat_room_activity_idx"
+            ),
+        ]
+
     def __str__(self) -> str:
         return self.title
 
@@ -29,6 +154,11 @@ class MemberChannelQuerySet(models.QuerySet):
     def subscribed_channels(self, user_id: int) -> "models.QuerySet[MemberChannel]":
         return self.filter(user_id=user_id)
 
+    def subscribed_channels_for_users(
+        self, user_ids: Iterable[int]
+    ) -> "MemberChannelQuerySet":
+        return self.filter(user_id__in=user_ids, channel_name__isnull=False)
+
 
 class MemberChannel(TimeStampedModel):
     objects = MemberChannelQuerySet.as_manager()
@@ -36,18 +166,147 @@ class MemberChannel(TimeStampedModel):
     channel_name = models.CharField(max_length=128, null=True, blank=True)
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=["channel_name"], name="df_chat_channel_name_idx"),
+            models.Index(
+                fields=["user", "channel_name"], name="df_chat_channel_user_idx"
+            ),
+            models.Index(fields=["last_alive_at"], name="df_chat_channel_alive_idx"),
+        ]
+
     def __str__(self) -> str:
         return f"{self.id}"
 
 
+class ChatMemberQuerySet(models.QuerySet):
+    def record_messages(self, messages: Iterable["ChatMessage"]) -> None:
+        """
+        Count new messages as unread for every member but their author.
+
+        Issues a single UPDATE per room.
+        """
+        by_room: dict[int, dict[int, int]] = {}
+        for message in messages:
+            authors = by_room.setdefault(message.chat_room_id, {})
+            authors[message.created_by_id] = authors.get(message.created_by_id, 0) + 1
+
+        for room_id, authors in by_room.items():
+            total = sum(authors.values())
+            members = self.filter(chat_room_id=room_id)
+            if len(authors) == 1:
+                (author_id,) = authors
+                members.exclude(user_id=author_id).update(
+                    unread_count=F("unread_count") + total
+                )
+            else:
+                members.update(
+                    unread_count=F("unread_count")
+                    + Case(
+                        *(
+                            When(user_id=author_id, then=Value(total - count))
+                            for author_id, count in authors.items()
+                        ),
+                        default=Value(total),
+                    )
+                )
+
+    def record_message_removal(self, message: "ChatMessage") -> None:
+        """
+        Take a deleted message out of the unread count of the members that
+        hadn't read it yet.
+        """
+        self.filter(
+            Q(last_read_message_id__isnull=True)
+            | Q(last_read_message_id__lt=message.id),
+            chat_room_id=message.chat_room_id,
+            unread_count__gt=0,
+        ).exclude(user_id=message.created_by_id).update(
+            unread_count=F("unread_count") - 1
+        )
+
+    def record_message_removals(self, messages: "models.QuerySet[ChatMessage]") -> int:
+        """
+        Take messages about to be deleted out of the unread count of the
+        members that hadn't read them yet. Must run before the delete.
+
+        Issues a single UPDATE for all rooms of the messages.
+        """
+        unread = (
+            messages.filter(
+                chat_room_id=OuterRef("chat_room_id"),
+                id__gt=Coalesce(OuterRef("last_read_message_id"), 0),
+            )
+            .exclude(created_by_id=OuterRef("user_id"))
+            .order_by()
+            .values("chat_room")
+            .annotate(count=Count("id"))
+            .values("count")
+        )
+        return self.filter(
+            chat_room__in=messages.order_by().values("chat_room"),
+            unread_count__gt=0,
+        ).update(
+            unread_count=Greatest(F("unread_count") - Coalesce(Subquery(unread), 0), 0)
+        )
+
+    def mark_read(self, user_id: int, chat_room_id: int, message_id: int) -> int:
+        """
+        Move the read marker of a member forward to ``message_id`` and
+        recount the messages after it. Ids past the last message of the room
+        are clamped to it, so the marker can't get ahead of the room.
+        """
+        # Ids out of the integer column's range are past any message anyway.
+        message_id = min(message_id, 2**31 - 1)
+        last_message_id = ChatRoom.objects.filter(pk=OuterRef("chat_room_id")).values(
+            "last_message_id"
+        )
+        read_up_to = Least(
+            Value(message_id), Coalesce(Subquery(last_message_id), Value(0))
+        )
+        unread = (
+            ChatMessage.objects.filter(chat_room_id=chat_room_id, id__gt=message_id)
+            .exclude(created_by_id=user_id)
+            .order_by()
+            .values("chat_room")
+            .annotate(count=Count("id"))
+            .values("count")
+        )
+        return (
+            self.alias(read_up_to=read_up_to)
+            .filter(
+                Q(last_read_message_id__isnull=True)
+                | Q(last_read_message_id__lt=F("read_up_to")),
+                user_id=user_id,
+                chat_room_id=chat_room_id,
+                read_up_to__gt=0,
+            )
+            .update(
+                last_read_message_id=read_up_to,
+                unread_count=Coalesce(Subquery(unread), 0),
+            )
+        )
+
+
 class ChatMember(TimeStampedModel):
     is_owner = models.BooleanField(default=False)
     is_admin = models.BooleanField(default=False)
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     chat_room = models.ForeignKey(ChatRoom, on_delete=models.CASCADE)
+    last_read_message_id = models.IntegerField(null=True, blank=True, editable=False)
+    unread_count = models.PositiveIntegerField(default=0, editable=False)
+
+    objects = ChatMemberQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "chat_room"], name="df_chat_member_user_room_uniq"
+            ),
+        ]
 
     def __str__(self) -> str:
-        return f"Room: {self.chat_room.id} - User {self.user.id}"
+        return f"Room: {self.chat_room_id} - User {self.user_id}"
 
 
 class ChatMessage(TimeStampedModel):
@@ -59,5 +318,42 @@ class ChatMessage(TimeStampedModel):
     created_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     message = models.TextField(null=False, blank=False)
 
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["chat_room", "-created", "-id"],
+                name="df_chat_msg_room_created_idx",
+            ),
+            # Archival picks the oldest messages of every room.
+            models.Index(fields=["created", "id"], name="df_chat_msg_created_idx"),
+        ]
+
+    def __str__(self) -> str:
+        return f"{self.created_by} >> {self.message}"
+
+
+class ArchivedChatMessage(models.Model):
+    """
+    Messages moved out of ``ChatMessage`` once older than
+    ``ARCHIVE_AFTER_DAYS``. Rows keep the id and timestamps of the original
+    message, so they read the same as hot messages.
+    """
+
+    id = models.IntegerField(primary_key=True)
+    created = models.DateTimeField()
+    modified = models.DateTimeField()
+    chat_room = models.ForeignKey(ChatRoom, on_delete=models.CASCADE)
+    created_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    message = models.TextField()
+    archived_at = models.DateTimeField(default=timezone.now, editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["chat_room", "-created", "-id"],
+                name="df_chat_archived_room_idx",
+            ),
+        ]
+
     def __str__(self) -> str:
         return f"{self.created_by} >> {self.message}"
@@ -0,0 +1,199 @@
+"""
+Bounded outbound queue of a WebSocket connection.
+
+Channel layer events are queued instead of being written to the socket from
+the consumer's handler, so a client on a slow link doesn't stop its consumer
+from draining the channel layer (and the channel layer from raising
+``ChannelFull`` to publishers). A writer task sends queued events in order.
+
+Once more than ``OUTBOUND_QUEUE_HIGH_WATER`` events are queued, the oldest
+ephemeral events (typing and viewing activity) are dropped. Updates of a
+message still waiting in the queue are always coalesced into the latest one.
+A connection staying above the high-water mark for
+``OUTBOUND_QUEUE_EVICT_AFTER`` seconds, or reaching
+``OUTBOUND_QUEUE_MAX_SIZE`` queued events, is evicted.
+
+Replies to client frames (acks and sync frames) go through the same queue,
+so the client receives every frame in the order it was queued. A reply can
+still follow events queued while its frame was being served, such as the
+``chat.message.new`` of an acknowledged message.
+"""
+import asyncio
+import collections
+import logging
+import time
+import weakref
+from typing import Any, Awaitable, Callable, Optional
+
+from df_chat.metrics import metrics
+from df_chat.settings import api_settings
+
+logger = logging.getLogger(__name__)
+
+EPHEMERAL_EVENTS = frozenset({"chat.activity"})
+COALESCED_EVENTS = frozenset({"chat.message.update"})
+
+# Close code sent to evicted clients, which should reconnect and chat.sync.
+SLOW_CONSUMER_CLOSE_CODE = 4008
+
+_queues: "weakref.WeakSet[OutboundQueue]" = weakref.WeakSet()
+
+
+class _Entry:
+    __slots__ = ("event", "dropped")
+
+    def __init__(self, event: dict) -> None:
+        self.event = event
+        self.dropped = False
+
+
+class OutboundQueue:
+    def __init__(
+        self,
+        send: Callable[[dict], Awaitable[Any]],
+        high_water: Optional[int] = None,
+        max_size: Optional[int] = None,
+        evict_after: Optional[float] = None,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.send = send
+        self.high_water = high_water or api_settings.OUTBOUND_QUEUE_HIGH_WATER
+        self.max_size = max_size or api_settings.OUTBOUND_QUEUE_MAX_SIZE
+        self.evict_after = (
+            api_settings.OUTBOUND_QUEUE_EVICT_AFTER
+            if evict_after is None
+            else evict_after
+        )
+        self.clock = clock
+        self.closed = False
+        self._entries: "collections.deque[_Entry]" = collections.deque()
+        self._ephemeral: "collections.deque[_Entry]" = collections.deque()
+        self._updates: dict[Any, _Entry] = {}
+        self._size = 0
+        # Dropped entries still in ``_entries``.
+        self._dropped = 0
+        self._over_since: Optional[float] = None
+        self._ready = asyncio.Event()
+        self._writable = asyncio.Event()
+        self._writable.set()
+        self._task: Optional[asyncio.Task] = None
+        _queues.add(self)
+
+    def __len__(self) -> int:
+        return self._size
+
+    def start(self) -> None:
+        self._task = asyncio.ensure_future(self._run())
+
+    def stop(self) -> None:
+        self.closed = True
+        self._writable.set()
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        self._entries.clear()
+        self._ephemeral.clear()
+        self._updates.clear()
+        self._size = 0
+        self._dropped = 0
+
+    def put(self, event: dict) -> bool:
+        """
+        Queue an event, return ``False`` when the connection has to be evicted.
+        """
+        if self.closed:
+            return True
+        event_type = event.get("type")
+        key = (event_type, event.get("id"))
+        if event_type in COALESCED_EVENTS and key in self._updates:
+            self._updates[key].event = event
+            metrics.increment("chat.outbound.coalesced")
+            return True
+
+        entry = _Entry(event)
+        self._entries.append(entry)
+        self._size += 1
+        if event_type in EPHEMERAL_EVENTS:
+            self._ephemeral.append(entry)
+        elif event_type in COALESCED_EVENTS:
+            self._updates[key] = entry
+        self._ready.set()
+
+        while self._size > self.high_water and self._ephemeral:
+            dropped = self._ephemeral.popleft()
+            if not dropped.dropped:
+                dropped.dropped = True
+                self._size -= 1
+                self._dropped += 1
+                metrics.increment("chat.outbound.dropped")
+        if self._dropped > self._size:
+            # Compact the queue while the writer is stalled, or a stream of
+            # dropped events grows it without ever reaching the max size.
+            self._entries = collections.deque(
+                entry for entry in self._entries if not entry.dropped
+            )
+            self._dropped = 0
+        return not self._is_slow()
+
+    async def wait_writable(self) -> None:
+        """
+        Wait until the queue is back at the high-water mark, to pace bulk
+        replies with what the client reads.
+        """
+        while self._size > self.high_water and not self.closed:
+            self._writable.clear()
+            await self._writable.wait()
+
+    def _is_slow(self) -> bool:
+        if self._size <= self.high_water:
+            self._over_since = None
+            return False
+        if self._size >= self.max_size:
+            return True
+        now = self.clock()
+        if self._over_since is None:
+            self._over_since = now
+        return now - self._over_since >= self.evict_after
+
+    def _pop(self) -> Optional[dict]:
+        while self._entries:
+            entry = self._entries.popleft()
+            if entry.dropped:
+                self._dropped -= 1
+                continue
+            # Sent entries can't be dropped or coalesced anymore.
+            entry.dropped = True
+            self._size -= 1
+            if self._size <= self.high_water:
+                self._writable.set()
+            event = entry.event
+            key = (event.get("type"), event.get("id"))
+            if self._updates.get(key) is entry:
+                del self._updates[key]
+            return event
+        self._ephemeral.clear()
+        return None
+
+    async def _run(self) -> None:
+        while True:
+            event = self._pop()
+            if event is None:
+                self._ready.clear()
+                await self._ready.wait()
+                continue
+            try:
+                await self.send(event)
+            except Exception:
+                logger.exception("Failed to send %s", event.get("type"))
+
+
+def queue_stats() -> dict[str, int]:
+    """
+    Return the queued events of the open connections of this worker.
+    """
+    depths = [len(queue) for queue in list(_queues) if not queue.closed]
+    return {
+        "connections": len(depths),
+        "depth": sum(depths),
+        "max_depth": max(depths, default=0),
+    }
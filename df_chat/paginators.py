@@ -1,11 +1,251 @@
-from rest_framework.pagination import LimitOffsetPagination
+import contextlib
+from typing import Any, Optional
+
+from django.db.models import Q, QuerySet
+from django.utils.translation import gettext_lazy as _
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, LimitOffsetPagination
+from rest_framework.request import Request
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
 
 
 class ChatRoomPagination(LimitOffsetPagination):
-    ordering = ("-last_message_id",)
+    ordering = ("-last_activity_at", "-id")
     page_size = 10
 
 
-class ChatMessagePagination(LimitOffsetPagination):
-    ordering = ("-created",)
+def positive_int(value: str, cutoff: Optional[int] = None) -> int:
+    """
+    Parse a strictly positive integer, capped at ``cutoff``.
+    """
+    number = int(value)
+    if number <= 0:
+        raise ValueError(f"{value!r} is not a positive integer")
+    if cutoff is not None:
+        return min(number, cutoff)
+    return number
+
+
+class ChatMessageCursorPagination(BasePagination):
+    """
+    Keyset pagination for the message history of a single room.
+
+    Pages are anchored on a message id passed as ``before``, ``after`` or
+    ``around`` and seek on ``(created, id)``, so deep history pages cost
+    the same as the first one: there is no ``OFFSET`` scan and no ``COUNT(*)``.
+    Results are always returned newest first.
+    """
+
+    ordering = ("-created", "-id")
     page_size = 10
+    max_page_size = 100
+    page_size_query_param = "limit"
+    before_query_param = "before"
+    after_query_param = "after"
+    around_query_param = "around"
+    invalid_anchor_message = _("Invalid anchor message")
+
+    def __init__(self) -> None:
+        self.base_url: Optional[str] = None
+        self.next_anchor: Optional[int] = None
+        self.previous_anchor: Optional[int] = None
+
+    def get_page_size(self, request: Request) -> int:
+        with contextlib.suppress(KeyError, ValueError):
+            return positive_int(
+                request.query_params[self.page_size_query_param],
+                cutoff=self.max_page_size,
+            )
+        return self.page_size
+
+    def get_anchor(self, request: Request) -> tuple[Optional[str], Optional[int]]:
+        anchors = [
+            (param, request.query_params[param])
+            for param in (
+                self.before_query_param,
+                self.after_query_param,
+                self.around_query_param,
+            )
+            if param in request.query_params
+        ]
+        if not anchors:
+            return None, None
+        if len(anchors) > 1:
+            raise NotFound(self.invalid_anchor_message)
+        param, value = anchors[0]
+        try:
+            return param, positive_int(value)
+        except ValueError:
+            raise NotFound(self.invalid_anchor_message)
+
+    def _older(self, queryset: QuerySet, created: Any, pk: int) -> QuerySet:
+        return queryset.filter(
+            Q(created__lt=created) | Q(created=created, id__lt=pk),
+            created__lte=created,
+        ).order_by("-created", "-id")
+
+    def _newer(self, queryset: QuerySet, created: Any, pk: int) -> QuerySet:
+        return queryset.filter(
+            Q(created__gt=created) | Q(created=created, id__gt=pk),
+            created__gte=created,
+        ).order_by("created", "id")
+
+    def get_tiers(self, queryset: QuerySet, view: Any) -> list[QuerySet]:
+        """
+        Return the querysets to page through, newest tier first. Views can
+        add older tiers with ``get_archive_queryset``.
+        """
+        get_archive_queryset = getattr(view, "get_archive_queryset", None)
+        if get_archive_queryset is None:
+            return [queryset]
+        return [queryset, get_archive_queryset()]
+
+    def _take(self, querysets: list[QuerySet], limit: int) -> list:
+        # Archival moves messages oldest first on (created, id), so tiers
+        # don't overlap and reading them in order keeps the result ordered.
+        results: list = []
+        for queryset in querysets:
+            if len(results) >= limit:
+                break
+            results.extend(queryset[: limit - len(results)])
+        return results
+
+    def _take_older(
+        self, tiers: list[QuerySet], limit: int, anchor: Any = None
+    ) -> list:
+        if anchor is None:
+            return self._take([tier.order_by(*self.ordering) for tier in tiers], limit)
+        return self._take(
+            [self._older(tier, anchor.created, anchor.id) for tier in tiers], limit
+        )
+
+    def _take_newer(self, tiers: list[QuerySet], limit: int, anchor: Any) -> list:
+        return self._take(
+            [self._newer(tier, anchor.created, anchor.id) for tier in tiers[::-1]],
+            limit,
+        )
+
+    def paginate_queryset(
+        self, queryset: QuerySet, request: Request, view: Any = None
+    ) -> list:
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        page_size = self.get_page_size(request)
+        param, anchor_id = self.get_anchor(request)
+        tiers = self.get_tiers(queryset, view)
+
+        if anchor_id is None:
+            older = self._take_older(tiers, page_size + 1)
+            page = older[:page_size]
+            self.next_anchor = page[-1].id if len(older) > page_size else None
+            self.previous_anchor = None
+            return page
+
+        anchor = next(
+            (found for tier in tiers for found in tier.filter(pk=anchor_id)[:1]),
+            None,
+        )
+        if anchor is None:
+            raise NotFound(self.invalid_anchor_message)
+
+        if param == self.before_query_param:
+            older = self._take_older(tiers, page_size + 1, anchor)
+            page = older[:page_size]
+            has_older, has_newer = len(older) > page_size, True
+        elif param == self.after_query_param:
+            newer = self._take_newer(tiers, page_size + 1, anchor)
+            page = newer[:page_size][::-1]
+            has_older, has_newer = True, len(newer) > page_size
+        else:
+            newer_size = (page_size - 1) // 2
+            older_size = page_size - 1 - newer_size
+            newer = self._take_newer(tiers, newer_size + 1, anchor)
+            older = [anchor] + self._take_older(tiers, older_size + 1, anchor)
+            page = newer[:newer_size][::-1] + older[: older_size + 1]
+            has_older = len(older) > older_size + 1
+            has_newer = len(newer) > newer_size
+
+        self.next_anchor = page[-1].id if page and has_older else None
+        self.previous_anchor = page[0].id if page and has_newer else None
+        return page
+
+    def _build_link(self, param: str, anchor_id: Optional[int]) -> Optional[str]:
+        if anchor_id is None or self.base_url is None:
+            return None
+        url = self.base_url
+        for other in (
+            self.before_query_param,
+            self.after_query_param,
+            self.around_query_param,
+        ):
+            url = remove_query_param(url, other)
+        return replace_query_param(url, param, anchor_id)
+
+    def get_next_link(self) -> Optional[str]:
+        return self._build_link(self.before_query_param, self.next_anchor)
+
+    def get_previous_link(self) -> Optional[str]:
+        return self._build_link(self.after_query_param, self.previous_anchor)
+
+    def get_paginated_response(self, data: list) -> Response:
+        return Response(
+            {
+                "next": self.get_next_link(),
+                "previous": self.get_previous_link(),
+                "results": data,
+            }
+        )
+
+    def get_paginated_response_schema(self, schema: dict) -> dict:
+        return {
+            "type": "object",
+            "required": ["results"],
+            "properties": {
+                "next": {
+                    "type": "string",
+                    "nullable": True,
+                    "format": "uri",
+                    "example": f"http://api.example.org/messages/?{self.before_query_param}=400",
+                },
+                "previous": {
+                    "type": "string",
+                    "nullable": True,
+                    "format": "uri",
+                    "example": f"http://api.example.org/messages/?{self.after_query_param}=411",
+                },
+                "results": schema,
+            },
+        }
+
+    def get_schema_operation_parameters(self, view: Any) -> list[dict]:
+        return [
+            {
+                "name": self.page_size_query_param,
+                "required": False,
+                "in": "query",
+                "description": "Number of messages to return per page.",
+                "schema": {"type": "integer"},
+            },
+            {
+                "name": self.before_query_param,
+                "required": False,
+                "in": "query",
+                "description": "Return messages older than this message id.",
+                "schema": {"type": "integer"},
+            },
+            {
+                "name": self.after_query_param,
+                "required": False,
+                "in": "query",
+                "description": "Return messages newer than this message id.",
+                "schema": {"type": "integer"},
+            },
+            {
+                "name": self.around_query_param,
+                "required": False,
+                "in": "query",
+                "description": "Return messages surrounding this message id.",
+                "schema": {"type": "integer"},
+            },
+        ]
@@ -1,6 +1,22 @@
 from rest_framework.permissions import BasePermission
+from rest_framework.request import Request
+from rest_framework.views import APIView
+
+from df_chat import membership
 
 
 class IsChatRoomRelatedUser(BasePermission):
     def has_object_permission(self, request, view, obj):
-        return obj.users.filter(id=request.user.id).exists()
+        return membership.is_member(request.user.id, obj.id)
+
+
+class IsChatRoomMember(BasePermission):
+    """
+    Allows access to views nested under a room only to the room members.
+    """
+
+    def has_permission(self, request: Request, view: APIView) -> bool:
+        room_id = view.kwargs.get("room_id")
+        return room_id is not None and membership.is_member(
+            request.user.id, int(room_id)
+        )
@@ -0,0 +1,329 @@
+"""
+Presence of WebSocket connections.
+
+Each process keeps a ``PresenceTracker`` per event loop that registers its
+connections with the configured ``PRESENCE_BACKEND`` and refreshes all of them
+with one batched heartbeat every ``PRESENCE_HEARTBEAT_INTERVAL`` seconds.
+Channels of crashed workers stop being refreshed and are removed by
+``expire_stale`` once they are older than ``PRESENCE_TIMEOUT``.
+"""
+import asyncio
+import logging
+import threading
+import time
+import weakref
+from datetime import timedelta
+from functools import lru_cache
+from typing import Any, Iterable, Optional
+
+from channels.db import database_sync_to_async
+from django.db.models import Q
+from django.utils import timezone
+
+from df_chat import membership
+from df_chat.models import MemberChannel
+from df_chat.settings import api_settings
+
+logger = logging.getLogger(__name__)
+
+ChannelOwner = tuple[int, str]
+
+
+class BasePresenceBackend:
+    def connect(self, user_id: int, channel_name: str) -> None:
+        raise NotImplementedError
+
+    def disconnect(self, channel_names: Iterable[str]) -> None:
+        raise NotImplementedError
+
+    def heartbeat(self, channel_names: Iterable[str]) -> None:
+        """
+        Mark the channels as alive now.
+        """
+        raise NotImplementedError
+
+    def channels_for_users(self, user_ids: Iterable[int]) -> list[str]:
+        raise NotImplementedError
+
+    def online_user_ids(self, user_ids: Iterable[int]) -> set[int]:
+        raise NotImplementedError
+
+    def expire_stale(self, max_age: float) -> list[ChannelOwner]:
+        """
+        Remove channels not seen for ``max_age`` seconds and return them as
+        ``(user_id, channel_name)`` pairs.
+        """
+        raise NotImplementedError
+
+
+class DatabasePresenceBackend(BasePresenceBackend):
+    """
+    Stores channels as ``MemberChannel`` rows.
+    """
+
+    def connect(self, user_id: int, channel_name: str) -> None:
+        MemberChannel.objects.create(
+            user_id=user_id, channel_name=channel_name, last_alive_at=timezone.now()
+        )
+
+    def disconnect(self, channel_names: Iterable[str]) -> None:
+        MemberChannel.objects.filter(channel_name__in=list(channel_names)).delete()
+
+    def heartbeat(self, channel_names: Iterable[str]) -> None:
+        MemberChannel.objects.filter(channel_name__in=list(channel_names)).update(
+            last_alive_at=timezone.now()
+        )
+
+    def channels_for_users(self, user_ids: Iterable[int]) -> list[str]:
+        channel_names = MemberChannel.objects.subscribed_channels_for_users(
+            user_ids
+        ).values_list("channel_name", flat=True)
+        return [channel_name for channel_name in channel_names if channel_name]
+
+    def online_user_ids(self, user_ids: Iterable[int]) -> set[int]:
+        return set(
+            MemberChannel.objects.subscribed_channels_for_users(user_ids).values_list(
+                "user_id", flat=True
+            )
+        )
+
+    def expire_stale(self, max_age: float) -> list[ChannelOwner]:
+        cutoff = timezone.now() - timedelta(seconds=max_age)
+        stale = list(
+            MemberChannel.objects.filter(
+                Q(last_alive_at__lt=cutoff)
+                | Q(last_alive_at__isnull=True, created__lt=cutoff)
+            ).values_list("id", "user_id", "channel_name")
+        )
+        if stale:
+            MemberChannel.objects.filter(id__in=[row[0] for row in stale]).delete()
+        return [
+            (user_id, channel_name)
+            for _, user_id, channel_name in stale
+            if channel_name
+        ]
+
+
+class InMemoryPresenceBackend(BasePresenceBackend):
+    """
+    Keeps channels in process memory. Only suitable for a single process and
+    for tests; mirrors ``RedisPresenceBackend``.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._alive: dict[str, float] = {}
+        self._owners: dict[str, int] = {}
+        self._channels: dict[int, set[str]] = {}
+
+    def connect(self, user_id: int, channel_name: str) -> None:
+        with self._lock:
+            self._alive[channel_name] = time.time()
+            self._owners[channel_name] = user_id
+            self._channels.setdefault(user_id, set()).add(channel_name)
+
+    def _remove(self, channel_name: str) -> Optional[int]:
+        self._alive.pop(channel_name, None)
+        user_id = self._owners.pop(channel_name, None)
+        if user_id is not None:
+            channels = self._channels.get(user_id, set())
+            channels.discard(channel_name)
+            if not channels:
+                self._channels.pop(user_id, None)
+        return user_id
+
+    def disconnect(self, channel_names: Iterable[str]) -> None:
+        with self._lock:
+            for channel_name in channel_names:
+                self._remove(channel_name)
+
+    def heartbeat(self, channel_names: Iterable[str]) -> None:
+        now = time.time()
+        with self._lock:
+            for channel_name in channel_names:
+                if channel_name in self._alive:
+                    self._alive[channel_name] = now
+
+    def channels_for_users(self, user_ids: Iterable[int]) -> list[str]:
+        with self._lock:
+            return [
+                channel_name
+                for user_id in user_ids
+                for channel_name in self._channels.get(user_id, ())
+            ]
+
+    def online_user_ids(self, user_ids: Iterable[int]) -> set[int]:
+        with self._lock:
+            return {user_id for user_id in user_ids if user_id in self._channels}
+
+    def expire_stale(self, max_age: float) -> list[ChannelOwner]:
+        cutoff = time.time() - max_age
+        with self._lock:
+            stale = [name for name, seen in self._alive.items() if seen < cutoff]
+            owners = [(self._remove(name), name) for name in stale]
+        return [(user_id, name) for user_id, name in owners if user_id is not None]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._alive.clear()
+            self._owners.clear()
+            self._channels.clear()
+
+
+class RedisPresenceBackend(BasePresenceBackend):
+    """
+    Keeps channels in Redis: a sorted set of channels scored by the last
+    heartbeat, a hash of channel owners and a set of channels per user.
+    Commands are pipelined, so bulk calls cost a round trip or two.
+    """
+
+    alive_key = "df_chat:presence:alive"
+    owners_key = "df_chat:presence:owners"
+    user_key = "df_chat:presence:user:{user_id}"
+
+    def __init__(self, url: Optional[str] = None, client: Any = None) -> None:
+        if client is None:
+            import redis
+
+            client = redis.Redis.from_url(url or api_settings.PRESENCE_REDIS_URL)
+        self.client = client
+
+    def _user_key(self, user_id: int) -> str:
+        return self.user_key.format(user_id=user_id)
+
+    def connect(self, user_id: int, channel_name: str) -> None:
+        pipeline = self.client.pipeline(transaction=False)
+        pipeline.zadd(self.alive_key, {channel_name: time.time()})
+        pipeline.hset(self.owners_key, channel_name, user_id)
+        pipeline.sadd(self._user_key(user_id), channel_name)
+        pipeline.execute()
+
+    def _remove(self, owners: list[ChannelOwner]) -> None:
+        if not owners:
+            return
+        pipeline = self.client.pipeline(transaction=False)
+        channel_names = [channel_name for _, channel_name in owners]
+        pipeline.zrem(self.alive_key, *channel_names)
+        pipeline.hdel(self.owners_key, *channel_names)
+        for user_id, channel_name in owners:
+            pipeline.srem(self._user_key(user_id), channel_name)
+        pipeline.execute()
+
+    def _owners(self, channel_names: list[str]) -> list[ChannelOwner]:
+        if not channel_names:
+            return []
+        user_ids = self.client.hmget(self.owners_key, channel_names)
+        return [
+            (int(user_id), channel_name)
+            for user_id, channel_name in zip(user_ids, channel_names)
+            if user_id is not None
+        ]
+
+    def disconnect(self, channel_names: Iterable[str]) -> None:
+        self._remove(self._owners(list(channel_names)))
+
+    def heartbeat(self, channel_names: Iterable[str]) -> None:
+        now = time.time()
+        mapping = {channel_name: now for channel_name in channel_names}
+        if mapping:
+            self.client.zadd(self.alive_key, mapping, xx=True)
+
+    def channels_for_users(self, user_ids: Iterable[int]) -> list[str]:
+        pipeline = self.client.pipeline(transaction=False)
+        for user_id in user_ids:
+            pipeline.smembers(self._user_key(user_id))
+        return [
+            channel_name.decode() if isinstance(channel_name, bytes) else channel_name
+            for channels in pipeline.execute()
+            for channel_name in channels
+        ]
+
+    def online_user_ids(self, user_ids: Iterable[int]) -> set[int]:
+        user_ids = list(user_ids)
+        pipeline = self.client.pipeline(transaction=False)
+        for user_id in user_ids:
+            pipeline.scard(self._user_key(user_id))
+        return {
+            user_id for user_id, count in zip(user_ids, pipeline.execute()) if count
+        }
+
+    def expire_stale(self, max_age: float) -> list[ChannelOwner]:
+        stale = [
+            channel_name.decode() if isinstance(channel_name, bytes) else channel_name
+            for channel_name in self.client.zrangebyscore(
+                self.alive_key, "-inf", time.time() - max_age
+            )
+        ]
+        owners = self._owners(stale)
+        self._remove(owners)
+        return owners
+
+
+@lru_cache(maxsize=None)
+def get_presence_backend() -> BasePresenceBackend:
+    return api_settings.PRESENCE_BACKEND()
+
+
+def online_users(room_id: int) -> set[int]:
+    """
+    Return the ids of the room members with at least one open connection.
+    """
+    return get_presence_backend().online_user_ids(membership.members(room_id))
+
+
+class PresenceTracker:
+    """
+    Registers the connections of one event loop and keeps them alive with a
+    single batched heartbeat.
+    """
+
+    def __init__(
+        self,
+        backend: Optional[BasePresenceBackend] = None,
+        interval: Optional[float] = None,
+    ) -> None:
+        self.backend = backend or get_presence_backend()
+        self.interval = interval or api_settings.PRESENCE_HEARTBEAT_INTERVAL
+        self.channels: set[str] = set()
+        self._task: Optional[asyncio.Task] = None
+
+    async def connect(self, user_id: int, channel_name: str) -> None:
+        await database_sync_to_async(self.backend.connect)(user_id, channel_name)
+        self.channels.add(channel_name)
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._run())
+
+    async def disconnect(self, channel_name: str) -> None:
+        self.channels.discard(channel_name)
+        if not self.channels and self._task is not None:
+            self._task.cancel()
+            self._task = None
+        await database_sync_to_async(self.backend.disconnect)([channel_name])
+
+    async def beat(self) -> None:
+        if self.channels:
+            await database_sync_to_async(self.backend.heartbeat)(list(self.channels))
+
+    async def _run(self) -> None:
+        while self.channels:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.beat()
+            except Exception:
+                logger.exception("Presence heartbeat failed")
+
+
+_trackers: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, PresenceTracker]" = (
+    weakref.WeakKeyDictionary()
+)
+
+
+def get_presence_tracker() -> PresenceTracker:
+    """
+    Return the presence tracker of the running event loop.
+    """
+    loop = asyncio.get_running_loop()
+    tracker = _trackers.get(loop)
+    if tracker is None:
+        tracker = _trackers[loop] = PresenceTracker()
+    return tracker
@@ -0,0 +1,123 @@
+"""
+Cleanup of connections left behind by workers that died without running
+``disconnect``.
+
+Stale channels are removed from the presence backend in bulk and discarded
+from every group they were subscribed to with batched channel layer calls.
+Run it with the ``reap_chat_channels`` command or let every worker run it
+periodically by setting ``PRESENCE_REAPER_INTERVAL``.
+"""
+import asyncio
+import logging
+import time
+import weakref
+from dataclasses import dataclass
+from typing import Any, Iterable, Optional
+
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+
+from df_chat.constants import SYSTEM_CHAT_ALIAS, USER_CHAT_ALIAS
+from df_chat.fanout import is_user_fanout, room_group
+from df_chat.metrics import metrics
+from df_chat.models import ChatMember
+from df_chat.presence import ChannelOwner, get_presence_backend
+from df_chat.settings import api_settings
+from df_chat.utils import GroupMembership, group_discard_many
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class ReapResult:
+    channels: int
+    memberships: int
+    seconds: float
+
+
+def stale_memberships(owners: Iterable[ChannelOwner]) -> list[GroupMembership]:
+    """
+    Return every ``(group, channel)`` pair a connection subscribes to on
+    connect, for the given ``(user_id, channel_name)`` pairs.
+    """
+    owners = list(owners)
+    rooms: dict[int, list[tuple[int, int]]] = {}
+    if owners and not is_user_fanout():
+        for user_id, room_id, shards in ChatMember.objects.filter(
+            user_id__in={user_id for user_id, _ in owners}
+        ).values_list("user_id", "chat_room_id", "chat_room__fanout_shards"):
+            rooms.setdefault(user_id, []).append((room_id, shards))
+
+    memberships: list[tuple[str, str]] = []
+    for user_id, channel_name in owners:
+        groups = [
+            SYSTEM_CHAT_ALIAS,
+            USER_CHAT_ALIAS.format(user_id=user_id),
+            *(
+                room_group(room_id, shards, channel_name)
+                for room_id, shards in rooms.get(user_id, ())
+            ),
+        ]
+        memberships.extend((group, channel_name) for group in groups)
+    return memberships
+
+
+def _expire(max_age: float) -> tuple[list[ChannelOwner], list[GroupMembership]]:
+    owners = get_presence_backend().expire_stale(max_age)
+    return owners, stale_memberships(owners)
+
+
+async def areap_stale_channels(
+    max_age: Optional[float] = None,
+    batch_size: Optional[int] = None,
+    channel_layer: Any = None,
+) -> ReapResult:
+    max_age = max_age or api_settings.PRESENCE_TIMEOUT
+    batch_size = batch_size or api_settings.PRESENCE_REAPER_BATCH_SIZE
+    channel_layer = channel_layer or get_channel_layer()
+
+    started = time.perf_counter()
+    owners, memberships = await database_sync_to_async(_expire)(max_age)
+    for start in range(0, len(memberships), batch_size):
+        await group_discard_many(channel_layer, memberships[start : start + batch_size])
+    result = ReapResult(len(owners), len(memberships), time.perf_counter() - started)
+
+    metrics.increment("chat.reaper.channels", result.channels)
+    metrics.observe("chat.reaper.seconds", result.seconds)
+    if result.channels:
+        logger.info(
+            "Reclaimed %s stale channels (%s group memberships) in %.3fs",
+            result.channels,
+            result.memberships,
+            result.seconds,
+        )
+    return result
+
+
+async def _run_reaper(interval: float) -> None:
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await areap_stale_channels()
+        except Exception:
+            logger.exception("Reaping stale channels failed")
+
+
+_reapers: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Task]" = (
+    weakref.WeakKeyDictionary()
+)
+
+
+def ensure_reaper() -> Optional[asyncio.Task]:
+    """
+    Start the periodic reaper on the running event loop if
+    ``PRESENCE_REAPER_INTERVAL`` is set and it isn't running yet.
+    """
+    interval = api_settings.PRESENCE_REAPER_INTERVAL
+    if not interval:
+        return None
+    loop = asyncio.get_running_loop()
+    task = _reapers.get(loop)
+    if task is None or task.done():
+        task = _reapers[loop] = loop.create_task(_run_reaper(interval))
+    return task
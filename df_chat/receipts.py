@@ -0,0 +1,79 @@
+"""
+Coalesced read receipts received over WebSocket.
+
+Clients report the newest message they have seen as they scroll. Instead of
+one write per report, the highest message id per ``(user, room)`` is kept in
+memory and written every ``READ_RECEIPT_INTERVAL`` seconds.
+"""
+import asyncio
+import weakref
+from typing import Optional
+
+from channels.db import database_sync_to_async
+
+from df_chat.metrics import metrics
+from df_chat.models import ChatMember
+from df_chat.settings import api_settings
+
+
+class ReadReceiptBuffer:
+    def __init__(self, flush_interval: Optional[float] = None) -> None:
+        self.flush_interval = (
+            api_settings.READ_RECEIPT_INTERVAL
+            if flush_interval is None
+            else flush_interval
+        )
+        self._pending: dict[tuple[int, int], int] = {}
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._tasks: set[asyncio.Task] = set()
+
+    def submit(self, user_id: int, chat_room_id: int, message_id: int) -> None:
+        key = (user_id, chat_room_id)
+        if message_id <= self._pending.get(key, 0):
+            return
+        self._pending[key] = message_id
+        if self._timer is None:
+            loop = asyncio.get_running_loop()
+            self._timer = loop.call_later(self.flush_interval, self._schedule_flush)
+
+    def _schedule_flush(self) -> None:
+        self._timer = None
+        task = asyncio.ensure_future(self.flush())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def flush(self, user_id: Optional[int] = None) -> None:
+        """
+        Write the pending receipts, only those of ``user_id`` if given.
+        """
+        if user_id is None:
+            batch, self._pending = self._pending, {}
+        else:
+            batch = {
+                key: self._pending.pop(key)
+                for key in list(self._pending)
+                if key[0] == user_id
+            }
+        if batch:
+            await database_sync_to_async(self.write)(batch)
+            metrics.observe("chat.receipts.batch.size", len(batch))
+
+    def write(self, batch: dict[tuple[int, int], int]) -> None:
+        for (user_id, chat_room_id), message_id in batch.items():
+            ChatMember.objects.mark_read(user_id, chat_room_id, message_id)
+
+
+_buffers: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, ReadReceiptBuffer]" = (
+    weakref.WeakKeyDictionary()
+)
+
+
+def get_read_buffer() -> ReadReceiptBuffer:
+    """
+    Return the read receipt buffer of the running event loop.
+    """
+    loop = asyncio.get_running_loop()
+    buffer = _buffers.get(loop)
+    if buffer is None:
+        buffer = _buffers[loop] = ReadReceiptBuffer()
+    return buffer
@@ -0,0 +1,113 @@
+"""
+Catch-up of missed messages after a WebSocket reconnect.
+
+Clients send the last message id they have seen per room and receive every
+newer message of all their rooms in one stream instead of paging each room
+over REST. Rooms are processed in chunks of ``SYNC_ROOM_CHUNK_SIZE``, reading
+at most the ``SYNC_MAX_MESSAGES_PER_ROOM`` newest messages of each room.
+Archived messages are read too, so old cursors still catch up.
+"""
+import itertools
+from dataclasses import dataclass, field
+from typing import Iterable, Iterator, Mapping, Optional, Union
+
+from django.db import connections
+from django.db.models import QuerySet
+
+from df_chat.encoders import (
+    MESSAGE_FIELDS,
+    message_payload,
+    user_payload_from_row,
+)
+from df_chat.models import ArchivedChatMessage, ChatMessage
+from df_chat.settings import api_settings
+
+
+@dataclass
+class MissedMessages:
+    # Payloads ordered by room, then oldest first.
+    messages: list[dict] = field(default_factory=list)
+    # Rooms that have more missed messages than were returned.
+    truncated: list[int] = field(default_factory=list)
+
+
+def room_chunks(
+    room_ids: Iterable[int],
+    last_seen: Mapping[int, int],
+    chunk_size: Optional[int] = None,
+) -> Iterator[dict[int, int]]:
+    """
+    Split rooms into chunks of ``{room_id: last_seen_message_id}``. Rooms
+    missing from ``last_seen`` start from scratch.
+    """
+    chunk_size = chunk_size or api_settings.SYNC_ROOM_CHUNK_SIZE
+    room_ids = sorted(set(room_ids))
+    for start in range(0, len(room_ids), chunk_size):
+        yield {
+            room_id: last_seen.get(room_id, 0)
+            for room_id in room_ids[start : start + chunk_size]
+        }
+
+
+def _room_rows(
+    room_id: int,
+    message_id: int,
+    limit: int,
+    model: type[Union[ChatMessage, ArchivedChatMessage]] = ChatMessage,
+) -> QuerySet:
+    # The extra row only tells that the room has more messages.
+    return (
+        model.objects.filter(chat_room_id=room_id, id__gt=message_id)
+        .order_by("-id")
+        .values(
+            *MESSAGE_FIELDS,
+            *(
+                f"created_by__{name}"
+                for name in api_settings.DEFAULT_USER_SERIALIZER_FIELDS
+            ),
+        )[: limit + 1]
+    )
+
+
+def chunk_messages(
+    last_seen: Mapping[int, int], limit: Optional[int] = None
+) -> MissedMessages:
+    """
+    Return the newest ``limit`` messages after the last seen one of each room.
+    Each room and tier is read with its own ``LIMIT`` query, combined with
+    ``UNION ALL`` where the database allows it, so a room is never scanned
+    past the messages returned.
+    """
+    limit = limit or api_settings.SYNC_MAX_MESSAGES_PER_ROOM
+    if not last_seen:
+        return MissedMessages()
+    querysets = [
+        _room_rows(room_id, message_id, limit, model)
+        for room_id, message_id in sorted(last_seen.items())
+        for model in (ChatMessage, ArchivedChatMessage)
+    ]
+    rows: Iterable[dict]
+    features = connections[ChatMessage.objects.db].features
+    if len(querysets) > 1 and features.supports_slicing_ordering_in_compound:
+        rows = querysets[0].union(*querysets[1:], all=True)
+    else:
+        # SQLite can't limit the parts of a compound query.
+        rows = itertools.chain.from_iterable(querysets)
+
+    by_room: dict[int, list[dict]] = {}
+    for row in rows:
+        by_room.setdefault(row["chat_room_id"], []).append(row)
+    missed = MissedMessages()
+    users: dict[int, dict] = {}
+    for room_id in sorted(by_room):
+        # Archival follows the creation time, so the tiers can interleave on id.
+        room_rows = sorted(by_room[room_id], key=lambda row: row["id"])
+        if len(room_rows) > limit:
+            missed.truncated.append(room_id)
+            room_rows = room_rows[-limit:]
+        for row in room_rows:
+            user_id = row["created_by_id"]
+            if user_id not in users:
+                users[user_id] = user_payload_from_row(row)
+            missed.messages.append(message_payload(row, users[user_id]))
+    return missed
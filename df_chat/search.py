@@ -0,0 +1,278 @@
+"""
+Full-text search over messages.
+
+The index lives next to the message tables and is kept in sync in the same
+transaction as message writes. Backends:
+
+- ``PostgresSearchBackend``: ``tsvector`` column with a GIN index, ranked
+  with ``ts_rank_cd``.
+- ``SQLiteSearchBackend``: FTS5 virtual table ranked with ``bm25``.
+- ``BasicSearchBackend``: unindexed ``icontains`` fallback for other
+  databases and SQLite builds without FTS5.
+
+Index tables are created by migrations. Messages deleted along with their
+room or author are removed from the index by signal receivers. Results are ordered by score, then
+newest first, and paged with a ``(score, id)`` keyset. Archived messages stay
+in the index.
+"""
+from functools import lru_cache
+from typing import Any, Iterable, Optional
+
+from django.db import connection
+from django.db.models import Q
+
+from df_chat.models import ArchivedChatMessage, ChatMessage
+from df_chat.settings import api_settings
+
+# (score, message_id), higher scores first.
+SearchHit = tuple[float, int]
+
+SQLITE_TABLE = "df_chat_message_fts"
+POSTGRES_TABLE = "df_chat_message_search"
+SQLITE_BATCH_SIZE = 500
+
+
+class BaseSearchBackend:
+    def index(self, messages: Iterable[Any], created: bool = False) -> None:
+        """
+        Add or refresh messages in the index. ``created`` skips removing
+        previous entries for messages that were just inserted.
+        """
+        raise NotImplementedError
+
+    def remove(self, message_ids: Iterable[int]) -> None:
+        raise NotImplementedError
+
+    def remove_rooms(self, room_ids: Iterable[int]) -> None:
+        """
+        Remove every message of the rooms, archived ones included.
+        """
+        raise NotImplementedError
+
+    def clear(self) -> None:
+        raise NotImplementedError
+
+    def search(
+        self,
+        query: str,
+        room_ids: list[int],
+        limit: int,
+        after: Optional[SearchHit] = None,
+    ) -> list[SearchHit]:
+        """
+        Return up to ``limit`` hits in the given rooms, after the ``after``
+        hit of the previous page.
+        """
+        raise NotImplementedError
+
+
+def _placeholders(values: list) -> str:
+    return ", ".join(["%s"] * len(values))
+
+
+class SQLiteSearchBackend(BaseSearchBackend):
+    def index(self, messages: Iterable[Any], created: bool = False) -> None:
+        messages = list(messages)
+        if not messages:
+            return
+        if not created:
+            self.remove(message.id for message in messages)
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f"INSERT INTO {SQLITE_TABLE} (rowid, message, chat_room_id) "  # noqa: S608
+                "VALUES (%s, %s, %s)",
+                [
+                    (message.id, message.message, message.chat_room_id)
+                    for message in messages
+                ],
+            )
+
+    def remove(self, message_ids: Iterable[int]) -> None:
+        message_ids = list(message_ids)
+        with connection.cursor() as cursor:
+            # Stay below the number of parameters SQLite accepts.
+            for start in range(0, len(message_ids), SQLITE_BATCH_SIZE):
+                batch = message_ids[start : start + SQLITE_BATCH_SIZE]
+                cursor.execute(
+                    f"DELETE FROM {SQLITE_TABLE} "  # noqa: S608
+                    f"WHERE rowid IN ({_placeholders(batch)})",
+                    batch,
+                )
+
+    def remove_rooms(self, room_ids: Iterable[int]) -> None:
+        room_ids = list(room_ids)
+        if room_ids:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f"DELETE FROM {SQLITE_TABLE} "  # noqa: S608
+                    f"WHERE chat_room_id IN ({_placeholders(room_ids)})",
+                    room_ids,
+                )
+
+    def clear(self) -> None:
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {SQLITE_TABLE}")  # noqa: S608
+
+    @staticmethod
+    def match_expression(query: str) -> str:
+        # Quote every term so user input can't use the FTS5 query syntax.
+        return " ".join(
+            '"{}"'.format(term.replace('"', '""')) for term in query.split()
+        )
+
+    def search(
+        self,
+        query: str,
+        room_ids: list[int],
+        limit: int,
+        after: Optional[SearchHit] = None,
+    ) -> list[SearchHit]:
+        if not room_ids or not query.split():
+            return []
+        params: list = [self.match_expression(query), *room_ids]
+        keyset = ""
+        if after is not None:
+            keyset = "WHERE score < %s OR (score = %s AND id < %s)"
+            params += [after[0], after[0], after[1]]
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT score, id FROM ("  # noqa: S608
+                f"  SELECT -bm25({SQLITE_TABLE}) AS score, rowid AS id"
+                f"  FROM {SQLITE_TABLE}"
+                f"  WHERE {SQLITE_TABLE} MATCH %s"
+                f"  AND chat_room_id IN ({_placeholders(room_ids)})"
+                f") {keyset} ORDER BY score DESC, id DESC LIMIT %s",
+                [*params, limit],
+            )
+            return [(score, message_id) for score, message_id in cursor.fetchall()]
+
+
+class PostgresSearchBackend(BaseSearchBackend):
+    def index(self, messages: Iterable[Any], created: bool = False) -> None:
+        messages = list(messages)
+        if not messages:
+            return
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f"INSERT INTO {POSTGRES_TABLE} (message_id, chat_room_id, document) "  # noqa: S608
+                "VALUES (%s, %s, to_tsvector(%s::regconfig, %s)) "
+                "ON CONFLICT (message_id) DO UPDATE SET document = EXCLUDED.document",
+                [
+                    (
+                        message.id,
+                        message.chat_room_id,
+                        api_settings.SEARCH_CONFIG,
+                        message.message,
+                    )
+                    for message in messages
+                ],
+            )
+
+    def remove(self, message_ids: Iterable[int]) -> None:
+        message_ids = list(message_ids)
+        if message_ids:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f"DELETE FROM {POSTGRES_TABLE} WHERE message_id = ANY(%s)",  # noqa: S608
+                    [message_ids],
+                )
+
+    def remove_rooms(self, room_ids: Iterable[int]) -> None:
+        room_ids = list(room_ids)
+        if room_ids:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f"DELETE FROM {POSTGRES_TABLE} WHERE chat_room_id = ANY(%s)",  # noqa: S608
+                    [room_ids],
+                )
+
+    def clear(self) -> None:
+        with connection.cursor() as cursor:
+            cursor.execute(f"TRUNCATE {POSTGRES_TABLE}")
+
+    def search(
+        self,
+        query: str,
+        room_ids: list[int],
+        limit: int,
+        after: Optional[SearchHit] = None,
+    ) -> list[SearchHit]:
+        if not room_ids or not query.split():
+            return []
+        params: list = [api_settings.SEARCH_CONFIG, query, room_ids]
+        keyset = ""
+        if after is not None:
+            keyset = "WHERE score < %s::real OR (score = %s::real AND id < %s)"
+            params += [after[0], after[0], after[1]]
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT score, id FROM ("  # noqa: S608
+                "  SELECT ts_rank_cd(document, query) AS score, message_id AS id"
+                f"  FROM {POSTGRES_TABLE},"
+                "  websearch_to_tsquery(%s::regconfig, %s) AS query"
+                "  WHERE document @@ query AND chat_room_id = ANY(%s)"
+                f") AS hits {keyset} ORDER BY score DESC, id DESC LIMIT %s",
+                [*params, limit],
+            )
+            return [(score, message_id) for score, message_id in cursor.fetchall()]
+
+
+class BasicSearchBackend(BaseSearchBackend):
+    """
+    Unranked substring search without an index.
+    """
+
+    def index(self, messages: Iterable[Any], created: bool = False) -> None:
+        pass
+
+    def remove(self, message_ids: Iterable[int]) -> None:
+        pass
+
+    def remove_rooms(self, room_ids: Iterable[int]) -> None:
+        pass
+
+    def clear(self) -> None:
+        pass
+
+    def search(
+        self,
+        query: str,
+        room_ids: list[int],
+        limit: int,
+        after: Optional[SearchHit] = None,
+    ) -> list[SearchHit]:
+        condition = Q(chat_room_id__in=room_ids)
+        for term in query.split():
+            condition &= Q(message__icontains=term)
+        if after is not None:
+            condition &= Q(id__lt=after[1])
+        hits: list[SearchHit] = []
+        for model in (ChatMessage, ArchivedChatMessage):
+            ids = model.objects.filter(condition).order_by("-id")
+            hits.extend((0.0, pk) for pk in ids.values_list("id", flat=True)[:limit])
+        return sorted(hits, key=lambda hit: -hit[1])[:limit]
+
+
+@lru_cache(maxsize=None)
+def get_search_backend() -> BaseSearchBackend:
+    if api_settings.SEARCH_BACKEND is not None:
+        return api_settings.SEARCH_BACKEND()
+    if connection.vendor == "postgresql":
+        return PostgresSearchBackend()
+    if connection.vendor == "sqlite":
+        # The index table is only created when SQLite was built with FTS5.
+        if SQLITE_TABLE in connection.introspection.table_names():
+            return SQLiteSearchBackend()
+    return BasicSearchBackend()
+
+
+def index_messages(messages: Iterable[Any], created: bool = False) -> None:
+    get_search_backend().index(messages, created=created)
+
+
+def remove_messages(message_ids: Iterable[int]) -> None:
+    get_search_backend().remove(message_ids)
+
+
+def remove_rooms(room_ids: Iterable[int]) -> None:
+    get_search_backend().remove_rooms(room_ids)
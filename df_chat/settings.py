@@ -1,4 +1,7 @@
+from typing import Any
+
 from django.conf import settings
+from django.core.signals import setting_changed
 from rest_framework.settings import APISettings
 
 DEFAULTS: dict = {
@@ -6,7 +9,68 @@ DEFAULTS: dict = {
         "id",
         "first_name",
         "last_name",
-    )
+    ),
+    "EVENT_DISPATCHER": "df_chat.dispatchers.ThreadedEventDispatcher",
+    "EVENT_DISPATCHER_QUEUE_SIZE": 10000,
+    "EVENT_DISPATCHER_BATCH_SIZE": 100,
+    "GROUP_SUBSCRIPTION_CONCURRENCY": 100,
+    "FANOUT_MODE": "room",
+    "MEMBER_INDEX_CACHE": "default",
+    "MEMBER_INDEX_TIMEOUT": 300,
+    "MEMBERSHIP_LOCAL_CACHE_SIZE": 10000,
+    "MEMBERSHIP_LOCAL_CACHE_TTL": 5,
+    "JWT_CACHE_SIZE": 50000,
+    "JWT_CACHE_TTL": 3600,
+    "JWT_USER_CACHE_SIZE": 50000,
+    "JWT_USER_CACHE_TTL": 30,
+    "MESSAGE_WRITE_BUFFER": True,
+    "MESSAGE_WRITE_BUFFER_SIZE": 100,
+    "MESSAGE_WRITE_BUFFER_INTERVAL": 0.005,
+    "EVENT_ENCODER": "auto",
+    "EVENT_FRAME": "text",
+    "PRESENCE_BACKEND": "df_chat.presence.DatabasePresenceBackend",
+    "PRESENCE_HEARTBEAT_INTERVAL": 30,
+    "PRESENCE_TIMEOUT": 90,
+    "PRESENCE_REDIS_URL": "redis://localhost:6379/0",
+    "PRESENCE_REAPER_INTERVAL": None,
+    "PRESENCE_REAPER_BATCH_SIZE": 500,
+    "SYNC_MAX_MESSAGES_PER_ROOM": 100,
+    "SYNC_ROOM_CHUNK_SIZE": 200,
+    "EXPORT_CHUNK_SIZE": 2000,
+    "ARCHIVE_AFTER_DAYS": 365,
+    "ARCHIVE_BATCH_SIZE": 1000,
+    "SEARCH_BACKEND": None,
+    "SEARCH_CONFIG": "simple",
+    "SEARCH_PAGE_SIZE": 20,
+    "READ_RECEIPT_INTERVAL": 1.0,
+    "EPHEMERAL_EVENT_RATE": 2,
+    "EPHEMERAL_EVENT_BURST": 5,
+    "EPHEMERAL_EVENT_WINDOW": 0.25,
+    "EPHEMERAL_EVENT_TTL": 6,
+    "OUTBOUND_QUEUE_HIGH_WATER": 100,
+    "OUTBOUND_QUEUE_MAX_SIZE": 1000,
+    "OUTBOUND_QUEUE_EVICT_AFTER": 10,
+    "MEMBERS_BATCH_SIZE": 1000,
+    "MEMBERS_BULK_MAX_SIZE": 10000,
+    "METRICS_SINK": "df_chat.metrics.NullMetricsSink",
+    "METRICS_BUCKETS": (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
 }
 
-api_settings = APISettings(getattr(settings, "DF_CHAT", None), DEFAULTS)
+IMPORT_STRINGS = (
+    "EVENT_DISPATCHER",
+    "PRESENCE_BACKEND",
+    "SEARCH_BACKEND",
+    "METRICS_SINK",
+)
+
+api_settings = APISettings(getattr(settings, "DF_CHAT", None), DEFAULTS, IMPORT_STRINGS)
+
+
+def reload_api_settings(*, setting: str, value: Any, **kwargs: Any) -> None:
+    if setting == "DF_CHAT":
+        api_settings.reload()
+        # reload() would fall back to REST_FRAMEWORK.
+        api_settings._user_settings = value or {}
+
+
+setting_changed.connect(reload_api_settings)
@@ -1,19 +1,101 @@
 from typing import Any
 
-from django.db.models.signals import m2m_changed
+from django.contrib.auth import get_user_model
+from django.db.models.signals import (
+    m2m_changed,
+    post_delete,
+    post_save,
+    pre_delete,
+)
 from django.dispatch import receiver
 
-from df_chat.models import ChatRoom
+from df_chat import membership, search
+from df_chat.models import (
+    ArchivedChatMessage,
+    ChatMember,
+    ChatMessage,
+    ChatRoom,
+)
 from df_chat.utils import DynamicUserGroupSubscriptionHandler
 
+User = get_user_model()
+
 
 @receiver(m2m_changed, sender=ChatRoom.users.through)
 def room_user_actions(
-    instance: Any, action: str, pk_set: set, **kwargs: dict[str, Any]
+    instance: Any,
+    action: str,
+    pk_set: set,
+    reverse: bool = False,
+    **kwargs: dict[str, Any],
 ) -> None:
+    if action not in ("post_add", "post_remove") or not pk_set:
+        return
+    if reverse:
+        # user.chatroom_set.add(...) reports room ids for a single user.
+        user_ids, room_ids = {instance.pk}, pk_set
+    else:
+        user_ids, room_ids = pk_set, {instance.pk}
+
     subscription_handler = DynamicUserGroupSubscriptionHandler()
-    for user_id in pk_set:
-        if action == "post_remove":
-            subscription_handler.unsubscribe(user_id, instance.id)
-        if action == "post_add":
-            subscription_handler.subscribe(user_id, instance.id)
+    if action == "post_remove":
+        subscription_handler.unsubscribe_many(user_ids, room_ids)
+    if action == "post_add":
+        subscription_handler.subscribe_many(user_ids, room_ids)
+
+
+@receiver(m2m_changed, sender=ChatRoom.users.through)
+def invalidate_room_members(
+    instance: Any,
+    action: str,
+    pk_set: set,
+    reverse: bool = False,
+    **kwargs: dict[str, Any],
+) -> None:
+    if action not in ("post_add", "post_remove", "pre_clear", "post_clear"):
+        return
+    if not reverse:
+        room_ids = {instance.pk}
+    elif pk_set:
+        room_ids = pk_set
+    elif action == "pre_clear":
+        room_ids = set(instance.chatroom_set.values_list("pk", flat=True))
+    else:
+        return
+    membership.invalidate(room_ids)
+
+
+@receiver(post_save, sender=ChatMember)
+@receiver(post_delete, sender=ChatMember)
+def invalidate_member(instance: ChatMember, **kwargs: dict[str, Any]) -> None:
+    membership.invalidate([instance.chat_room_id])
+
+
+@receiver(post_save, sender=ChatRoom)
+def invalidate_room_policy(instance: ChatRoom, **kwargs: dict[str, Any]) -> None:
+    # Fan-out shards and posting rights are cached with the members.
+    membership.invalidate([instance.pk])
+
+
+@receiver(post_delete, sender=ChatRoom)
+def remove_room_from_search(instance: ChatRoom, **kwargs: dict[str, Any]) -> None:
+    # Messages deleted by cascade don't go through the views.
+    search.remove_rooms([instance.pk])
+
+
+@receiver(pre_delete, sender=User)
+def remove_user_messages_from_search(instance: Any, **kwargs: dict[str, Any]) -> None:
+    for model in (ChatMessage, ArchivedChatMessage):
+        search.remove_messages(
+            model.objects.filter(created_by_id=instance.pk).values_list("id", flat=True)
+        )
+
+
+@receiver(pre_delete, sender=User)
+def remove_user_messages_from_unread_counts(
+    instance: Any, **kwargs: dict[str, Any]
+) -> None:
+    # The messages of the user are deleted by cascade.
+    ChatMember.objects.record_message_removals(
+        ChatMessage.objects.filter(created_by_id=instance.pk)
+    )
@@ -1,28 +1,140 @@
+import asyncio
+import time
+from typing import Any, Iterable, Optional
+
 from asgiref.sync import async_to_sync
 from channels.layers import get_channel_layer
 
-from df_chat.constants import ROOM_CHAT_ALIAS
-from df_chat.models import MemberChannel
+from df_chat import membership
+from df_chat.fanout import is_user_fanout, room_group
+from df_chat.metrics import metrics
+from df_chat.presence import get_presence_backend
+from df_chat.settings import api_settings
+
+GroupMembership = tuple[str, str]
+
+
+def _supports_pipelining(channel_layer: Any) -> bool:
+    # channels_redis keeps groups in sorted sets spread over its hosts.
+    return all(
+        hasattr(channel_layer, name)
+        for name in ("_group_key", "consistent_hash", "connection", "group_expiry")
+    )
+
+
+async def _pipeline_group_changes(
+    channel_layer: Any, memberships: Iterable[GroupMembership], add: bool
+) -> None:
+    by_group: dict[str, list[str]] = {}
+    for group, channel in memberships:
+        by_group.setdefault(group, []).append(channel)
+
+    by_connection: dict[int, list[str]] = {}
+    for group in by_group:
+        index = channel_layer.consistent_hash(group)
+        by_connection.setdefault(index, []).append(group)
+
+    async def execute(index: int, groups: list[str]) -> None:
+        connection = channel_layer.connection(index)
+        pipeline = connection.pipeline(transaction=False)
+        now = time.time()
+        for group in groups:
+            key = channel_layer._group_key(group)
+            if add:
+                pipeline.zadd(key, {channel: now for channel in by_group[group]})
+                pipeline.expire(key, channel_layer.group_expiry)
+            else:
+                pipeline.zrem(key, *by_group[group])
+        await pipeline.execute()
+
+    await asyncio.gather(
+        *(execute(index, groups) for index, groups in by_connection.items())
+    )
+
+
+async def _apply_group_changes(
+    channel_layer: Any,
+    memberships: Iterable[GroupMembership],
+    add: bool,
+    concurrency: Optional[int] = None,
+) -> None:
+    memberships = list(memberships)
+    if not memberships:
+        return
+    if _supports_pipelining(channel_layer):
+        await _pipeline_group_changes(channel_layer, memberships, add)
+        return
+
+    method = channel_layer.group_add if add else channel_layer.group_discard
+    semaphore = asyncio.Semaphore(
+        concurrency or api_settings.GROUP_SUBSCRIPTION_CONCURRENCY
+    )
+
+    async def apply(group: str, channel: str) -> None:
+        async with semaphore:
+            await method(group, channel)
+
+    await asyncio.gather(*(apply(group, channel) for group, channel in memberships))
+
+
+async def group_add_many(
+    channel_layer: Any,
+    memberships: Iterable[GroupMembership],
+    concurrency: Optional[int] = None,
+) -> None:
+    """
+    Add many ``(group, channel)`` pairs to the channel layer at once.
+    """
+    await _apply_group_changes(channel_layer, memberships, True, concurrency)
+
+
+async def group_discard_many(
+    channel_layer: Any,
+    memberships: Iterable[GroupMembership],
+    concurrency: Optional[int] = None,
+) -> None:
+    """
+    Remove many ``(group, channel)`` pairs from the channel layer at once.
+    """
+    await _apply_group_changes(channel_layer, memberships, False, concurrency)
 
 
 class DynamicUserGroupSubscriptionHandler(object):
     def __init__(self) -> None:
         self.channel_layer = get_channel_layer()
 
+    def _memberships(
+        self, user_ids: Iterable[int], room_ids: Iterable[int]
+    ) -> list[GroupMembership]:
+        if is_user_fanout():
+            # Connections only listen on their user group, nothing to update.
+            return []
+        channels = get_presence_backend().channels_for_users(user_ids)
+        if not channels:
+            return []
+        policies = membership.room_policies(room_ids)
+        return [
+            (room_group(room_id, policy.shards, channel), channel)
+            for channel in channels
+            for room_id, policy in policies.items()
+        ]
+
+    def unsubscribe_many(
+        self, user_ids: Iterable[int], room_ids: Iterable[int]
+    ) -> None:
+        memberships = self._memberships(user_ids, room_ids)
+        if memberships:
+            with metrics.timer("chat.subscriptions.discard.seconds"):
+                async_to_sync(group_discard_many)(self.channel_layer, memberships)
+
+    def subscribe_many(self, user_ids: Iterable[int], room_ids: Iterable[int]) -> None:
+        memberships = self._memberships(user_ids, room_ids)
+        if memberships:
+            with metrics.timer("chat.subscriptions.add.seconds"):
+                async_to_sync(group_add_many)(self.channel_layer, memberships)
+
     def unsubscribe(self, user_id: int, room_id: int) -> None:
-        channels = MemberChannel.objects.subscribed_channels(user_id).values_list(
-            "channel_name", flat=True
-        )
-        for channel in channels:
-            async_to_sync(self.channel_layer.group_discard)(
-                ROOM_CHAT_ALIAS.format(room_id=room_id), channel
-            )
+        self.unsubscribe_many([user_id], [room_id])
 
     def subscribe(self, user_id: int, room_id: int) -> None:
-        channels = MemberChannel.objects.subscribed_channels(user_id).values_list(
-            "channel_name", flat=True
-        )
-        for channel in channels:
-            async_to_sync(self.channel_layer.group_add)(
-                ROOM_CHAT_ALIAS.format(room_id=room_id), channel
-            )
+        self.subscribe_many([user_id], [room_id])
@@ -0,0 +1,17 @@
+from django.http import Http404, HttpRequest, HttpResponse
+
+from df_chat.metrics import PrometheusMetricsSink, get_metrics_sink
+from df_chat.outbound import queue_stats
+
+
+def prometheus_metrics(request: HttpRequest) -> HttpResponse:
+    """
+    Metrics of this worker in the Prometheus text format. Not routed by
+    default; expose it on an internal URL only.
+    """
+    sink = get_metrics_sink()
+    if not isinstance(sink, PrometheusMetricsSink):
+        raise Http404("METRICS_SINK is not a PrometheusMetricsSink")
+    for name, value in queue_stats().items():
+        sink.set_gauge(f"chat.outbound.{name}", value)
+    return HttpResponse(sink.render(), content_type=sink.content_type)
@@ -1,9 +1,12 @@
 from typing import Callable, TypeVar
 
 import pytest
+from django.core.cache import cache
 from faker import Faker
 from rest_framework.test import APIClient
 
+from df_chat.membership import get_local_cache
+
 T = TypeVar("T")
 Factory = Callable[..., T]
 
@@ -16,3 +19,9 @@ def client() -> APIClient:
 @pytest.fixture
 def faker() -> Faker:
     return Faker()
+
+
+@pytest.fixture(autouse=True)
+def clear_caches() -> None:
+    cache.clear()
+    get_local_cache().clear()
@@ -106,6 +106,8 @@ SPECTACULAR_SETTINGS = {
 
 DF_CHAT = {
     "CHAT_USER_MODEL": "test_app.ChatUser",
+    "EVENT_DISPATCHER": "df_chat.dispatchers.SyncEventDispatcher",
+    "METRICS_SINK": "df_chat.metrics.InMemoryMetricsSink",
 }
 
 # Local in-memory backend
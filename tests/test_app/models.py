@@ -3,7 +3,7 @@ from django.db import models
 
 
 class User(AbstractUser):
-    pass
+    avatar = models.ImageField(upload_to="avatars", blank=True)
 
 
 class ChatUser(models.Model):  # type: ignore
@@ -0,0 +1,122 @@
+import json
+from datetime import timedelta
+from io import StringIO
+from typing import Any
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.utils import timezone
+from rest_framework.test import APITestCase
+
+from df_chat.archive import archive_messages
+from df_chat.export import export_rows, iter_ndjson
+from df_chat.models import ArchivedChatMessage, ChatMessage, ChatRoom
+
+User = get_user_model()
+
+
+class ArchiveTestCase(APITestCase):
+    def setUp(self) -> None:
+        self.user = User.objects.create_user(username="user", password="pass")
+        self.room = ChatRoom.objects.create(title="room", chat_type="group")
+        self.room.users.add(self.user)
+        self.messages = [
+            ChatMessage.objects.create(
+                chat_room=self.room, created_by=self.user, message=f"message {i}"
+            )
+            for i in range(10)
+        ]
+        # The first six messages are two years old.
+        old = timezone.now() - timedelta(days=730)
+        for i, message in enumerate(self.messages[:6]):
+            ChatMessage.objects.filter(pk=message.pk).update(
+                created=old + timedelta(minutes=i), modified=old
+            )
+        ChatRoom.objects.filter(pk=self.room.pk).refresh_summary()
+        self.url = f"/api/v1/chat/rooms/{self.room.id}/messages/"
+        self.client.force_authenticate(self.user)
+
+    def ids(self, response: Any) -> list[int]:
+        return [message["id"] for message in response.data["results"]]
+
+    def test_archive_moves_old_messages_in_batches(self) -> None:
+        self.assertEqual(archive_messages(batch_size=2, max_batches=2), 4)
+        self.assertEqual(archive_messages(batch_size=2), 2)
+
+        self.assertEqual(
+            list(ArchivedChatMessage.objects.values_list("id", flat=True)),
+            [message.id for message in self.messages[:6]],
+        )
+        self.assertEqual(ChatMessage.objects.count(), 4)
+        ChatRoom.objects.filter(pk=self.room.pk).refresh_summary()
+        self.room.refresh_from_db()
+        self.assertEqual(self.room.message_count, 10)
+        self.assertEqual(self.room.last_message_id, self.messages[-1].id)
+
+    def test_archive_follows_the_created_order(self) -> None:
+        # A message stamped old after newer ones were written is archived
+        # with the old ones, pages still list every message once.
+        late = self.messages[8]
+        ChatMessage.objects.filter(pk=late.pk).update(
+            created=timezone.now() - timedelta(days=730, minutes=1)
+        )
+
+        self.assertEqual(archive_messages(), 7)
+        self.assertEqual(
+            set(ArchivedChatMessage.objects.values_list("id", flat=True)),
+            {message.id for message in self.messages[:6]} | {late.id},
+        )
+
+        expected = [
+            message.id for message in self.messages[::-1] if message != late
+        ] + [late.id]
+        pages = [self.client.get(self.url, {"limit": 3})]
+        while pages[-1].data["next"]:
+            pages.append(self.client.get(pages[-1].data["next"]))
+        self.assertEqual([i for page in pages for i in self.ids(page)], expected)
+
+        previous = [self.client.get(self.url, {"limit": 3, "after": late.id})]
+        while previous[-1].data["previous"]:
+            previous.append(self.client.get(previous[-1].data["previous"]))
+        self.assertEqual(
+            [i for page in reversed(previous) for i in self.ids(page)],
+            expected[:-1],
+        )
+
+        # Exports still go through ids in order and resume after any of them.
+        exported = [json.loads(line)["id"] for line in iter_ndjson(export_rows())]
+        self.assertEqual(exported, sorted(expected))
+        resumed = iter_ndjson(export_rows(after_id=self.messages[7].id))
+        self.assertEqual(
+            [json.loads(line)["id"] for line in resumed],
+            [late.id, self.messages[9].id],
+        )
+
+    def test_list_and_retrieve_read_both_tiers(self) -> None:
+        archive_messages()
+        expected = [message.id for message in self.messages[::-1]]
+
+        first = self.client.get(self.url, {"limit": 3})
+        second = self.client.get(self.url, {"limit": 3, "before": expected[2]})
+        third = self.client.get(self.url, {"limit": 6, "before": expected[5]})
+        around = self.client.get(self.url, {"limit": 3, "around": expected[4]})
+
+        self.assertEqual(self.ids(first), expected[:3])
+        self.assertEqual(self.ids(second), expected[3:6])
+        self.assertEqual(self.ids(third), expected[6:])
+        self.assertIsNone(third.data["next"])
+        self.assertEqual(self.ids(around), expected[3:6])
+
+        archived = self.messages[0]
+        response = self.client.get(f"{self.url}{archived.id}/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["message"], "message 0")
+        response = self.client.patch(f"{self.url}{archived.id}/", {"message": "x"})
+        self.assertEqual(response.status_code, 404)
+
+    def test_command(self) -> None:
+        stdout = StringIO()
+
+        call_command("archive_chat_messages", "--older-than-days", "365", stdout=stdout)
+
+        self.assertIn("Archived 6 messages", stdout.getvalue())
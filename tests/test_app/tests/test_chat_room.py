@@ -1,9 +1,67 @@
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
 from rest_framework.test import APITestCase
 
+from df_chat.models import ChatMessage, ChatRoom
+
+User = get_user_model()
+
 
 class ChatRoomViewSetTestCase(APITestCase):
     def setUp(self) -> None:
-        pass
+        self.user = User.objects.create_user(username="user", password="pass")
+        self.quiet_room = ChatRoom.objects.create(title="quiet", chat_type="group")
+        self.busy_room = ChatRoom.objects.create(title="busy", chat_type="group")
+        self.quiet_room.users.add(self.user)
+        self.busy_room.users.add(self.user)
+        self.client.force_authenticate(self.user)
+
+    def post_message(self, room: ChatRoom, message: str) -> int:
+        response = self.client.post(
+            f"/api/v1/chat/rooms/{room.id}/messages/", {"message": message}
+        )
+        self.assertEqual(response.status_code, 201)
+        return response.data["id"]
 
     def test_list_chat_rooms(self) -> None:
-        pass
+        self.post_message(self.quiet_room, "hello")
+        message_id = self.post_message(self.busy_room, "first")
+        message_id = self.post_message(self.busy_room, "second")
+
+        response = self.client.get("/api/v1/chat/rooms/")
+
+        self.assertEqual(response.status_code, 200)
+        busy, quiet = response.data["results"]
+        self.assertEqual(busy["id"], self.busy_room.id)
+        self.assertEqual(busy["newest_message"], "second")
+        self.assertEqual(busy["last_message_id"], message_id)
+        self.assertEqual(busy["message_count"], 2)
+        self.assertEqual(quiet["newest_message"], "hello")
+
+    def test_summary_follows_edit_and_delete(self) -> None:
+        first_id = self.post_message(self.busy_room, "first")
+        last_id = self.post_message(self.busy_room, "second")
+        url = f"/api/v1/chat/rooms/{self.busy_room.id}/messages/{last_id}/"
+
+        self.client.patch(url, {"message": "edited"})
+        self.busy_room.refresh_from_db()
+        self.assertEqual(self.busy_room.last_message_preview, "edited")
+
+        self.client.delete(url)
+        self.busy_room.refresh_from_db()
+        self.assertEqual(self.busy_room.last_message_id, first_id)
+        self.assertEqual(self.busy_room.last_message_preview, "first")
+        self.assertEqual(self.busy_room.message_count, 1)
+
+    def test_backfill_command(self) -> None:
+        message = ChatMessage.objects.create(
+            chat_room=self.quiet_room, created_by=self.user, message="raw insert"
+        )
+
+        call_command("backfill_chat_room_summary", verbosity=0, stdout=None)
+
+        self.quiet_room.refresh_from_db()
+        self.assertEqual(self.quiet_room.last_message_id, message.id)
+        self.assertEqual(self.quiet_room.last_message_preview, "raw insert")
+        self.assertEqual(self.quiet_room.last_activity_at, message.created)
+        self.assertEqual(self.quiet_room.message_count, 1)
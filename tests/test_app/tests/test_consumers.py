@@ -0,0 +1,489 @@
+import asyncio
+import json
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth import get_user_model
+from django.db import connection
+from rest_framework.test import APITransactionTestCase
+
+from df_chat import members, membership
+from df_chat.asgi.consumers import ChatConsumer
+from df_chat.constants import ROOM_CHAT_ALIAS
+from df_chat.drf.serializers import ChatMessageSerializer
+from df_chat.fanout import FanoutMode
+from df_chat.metrics import metrics
+from df_chat.models import ChatMember, ChatMessage, ChatRoom, MemberChannel
+from df_chat.settings import api_settings
+
+User = get_user_model()
+
+
+class ChatConsumerTestCase(APITransactionTestCase):
+    def setUp(self) -> None:
+        self.channel_layer = get_channel_layer()
+        self.user = User.objects.create_user(username="user", password="pass")
+        self.rooms = [
+            ChatRoom.objects.create(title=f"room{i}", chat_type="group")
+            for i in range(3)
+        ]
+        for room in self.rooms:
+            room.users.add(self.user)
+        metrics.reset()
+
+    def tearDown(self) -> None:
+        async_to_sync(self.channel_layer.flush)()
+
+    def communicator(self) -> WebsocketCommunicator:
+        communicator = WebsocketCommunicator(ChatConsumer.as_asgi(), "/ws/chat/")
+        communicator.scope["user"] = self.user
+        return communicator
+
+    def room_channels(self) -> list[set[str]]:
+        return [
+            set(
+                self.channel_layer.groups.get(
+                    ROOM_CHAT_ALIAS.format(room_id=room.id), {}
+                )
+            )
+            for room in self.rooms
+        ]
+
+    def test_connect_and_disconnect_reuse_room_ids(self) -> None:
+        async def scenario() -> None:
+            communicator = self.communicator()
+            connected, _ = await communicator.connect()
+            self.assertTrue(connected)
+            channel_name = await database_sync_to_async(
+                lambda: MemberChannel.objects.get(user=self.user).channel_name
+            )()
+            self.assertEqual(self.room_channels(), [{channel_name}] * 3)
+
+            # Leaving a room must not change what is discarded on disconnect.
+            await database_sync_to_async(
+                ChatRoom.users.through.objects.filter(chat_room=self.rooms[0]).delete
+            )()
+            await communicator.disconnect()
+            self.assertEqual(self.room_channels(), [set()] * 3)
+
+        async_to_sync(scenario)()
+
+        self.assertFalse(MemberChannel.objects.exists())
+        snapshot = metrics.snapshot()["summaries"]
+        self.assertEqual(snapshot["chat.connect.seconds"]["count"], 1)
+        self.assertEqual(snapshot["chat.connect.rooms"]["max"], 3)
+
+    def test_rooms_joined_after_connect_are_left_on_disconnect(self) -> None:
+        late = ChatRoom.objects.create(title="late", chat_type="group")
+        group = ROOM_CHAT_ALIAS.format(room_id=late.id)
+
+        async def scenario() -> tuple[set[str], set[str]]:
+            communicator = self.communicator()
+            await communicator.connect()
+            await database_sync_to_async(late.users.add)(self.user)
+            joined = set(self.channel_layer.groups.get(group, {}))
+            await communicator.disconnect()
+            return joined, set(self.channel_layer.groups.get(group, {}))
+
+        joined, left = async_to_sync(scenario)()
+
+        self.assertEqual(len(joined), 1)
+        self.assertEqual(left, set())
+
+    def test_user_fanout_mode_delivers_through_user_group(self) -> None:
+        def post_message() -> None:
+            serializer = ChatMessageSerializer(data={"message": "hello"})
+            serializer.is_valid(raise_exception=True)
+            serializer.save(created_by=self.user, chat_room_id=self.rooms[1].id)
+
+        async def scenario() -> dict:
+            communicator = self.communicator()
+            await communicator.connect()
+            self.assertEqual(self.room_channels(), [set()] * 3)
+            await database_sync_to_async(post_message)()
+            event = await communicator.receive_json_from()
+            await communicator.disconnect()
+            return event
+
+        with mock.patch.object(api_settings, "FANOUT_MODE", FanoutMode.user):
+            event = async_to_sync(scenario)()
+
+        self.assertEqual(event["type"], "chat.message.new")
+        self.assertEqual(event["chat_room"], self.rooms[1].id)
+
+    def test_buffered_messages_are_acked_with_ids(self) -> None:
+        room = self.rooms[0]
+
+        async def scenario() -> list[dict]:
+            communicators = [self.communicator() for _ in range(2)]
+            for communicator in communicators:
+                await communicator.connect()
+            for i, communicator in enumerate(communicators):
+                await communicator.send_json_to(
+                    {
+                        "type": "chat.message.new",
+                        "chat_room": room.id,
+                        "message": f"message {i}",
+                        "client_id": f"client-{i}",
+                    }
+                )
+            acks = []
+            for communicator in communicators:
+                while True:
+                    frame = await communicator.receive_json_from()
+                    if frame["type"] == "chat.message.ack":
+                        acks.append(frame)
+                        break
+            for communicator in communicators:
+                await communicator.disconnect()
+            return acks
+
+        acks = async_to_sync(scenario)()
+
+        # Ordering across connections is not defined, check each ack instead.
+        stored = dict(ChatMessage.objects.values_list("message", "id"))
+        self.assertEqual(
+            {ack["client_id"]: ack["id"] for ack in acks},
+            {"client-0": stored["message 0"], "client-1": stored["message 1"]},
+        )
+        room.refresh_from_db()
+        self.assertEqual(room.message_count, 2)
+        self.assertEqual(
+            metrics.snapshot()["summaries"]["chat.ingest.batch.size"]["max"], 2
+        )
+
+    def test_messages_are_saved_one_by_one_without_bulk_insert_ids(self) -> None:
+        room = self.rooms[0]
+
+        async def scenario() -> list[dict]:
+            communicator = self.communicator()
+            await communicator.connect()
+            for i in range(2):
+                await communicator.send_json_to(
+                    {
+                        "type": "chat.message.new",
+                        "chat_room": room.id,
+                        "message": f"message {i}",
+                        "client_id": f"client-{i}",
+                    }
+                )
+            frames: list[dict] = []
+            while len(frames) < 4:
+                frames.append(await communicator.receive_json_from())
+            await communicator.disconnect()
+            return frames
+
+        # Like MySQL, which doesn't return the ids of bulk inserted rows.
+        with mock.patch.object(
+            type(connection.features),
+            "can_return_rows_from_bulk_insert",
+            new_callable=mock.PropertyMock,
+            return_value=False,
+        ), mock.patch.object(
+            ChatMessage.objects, "bulk_create", side_effect=AssertionError
+        ):
+            frames = async_to_sync(scenario)()
+
+        stored = dict(ChatMessage.objects.values_list("message", "id"))
+        self.assertEqual(
+            {
+                frame["client_id"]: frame["id"]
+                for frame in frames
+                if frame["type"] == "chat.message.ack"
+            },
+            {"client-0": stored["message 0"], "client-1": stored["message 1"]},
+        )
+        self.assertEqual(
+            sorted(
+                frame["id"] for frame in frames if frame["type"] == "chat.message.new"
+            ),
+            sorted(stored.values()),
+        )
+        room.refresh_from_db()
+        self.assertEqual(room.last_message_id, stored["message 1"])
+        self.assertEqual(room.message_count, 2)
+
+    def test_failed_messages_do_not_fail_their_batch(self) -> None:
+        room, deleted_room = self.rooms[0], self.rooms[1]
+        deleted_room_id = deleted_room.id
+
+        async def scenario() -> list[dict]:
+            communicator = self.communicator()
+            await communicator.connect()
+            # Another process deletes the room, this one still has it cached.
+            await membership.ais_member(self.user.id, deleted_room_id)
+            cached = membership.get_local_cache().get(deleted_room_id)
+            await database_sync_to_async(deleted_room.delete)()
+            membership.get_local_cache().set(deleted_room_id, cached)
+            for i, room_id in enumerate((room.id, deleted_room_id, room.id)):
+                await communicator.send_json_to(
+                    {
+                        "type": "chat.message.new",
+                        "chat_room": room_id,
+                        "message": f"message {i}",
+                        "client_id": f"client-{i}",
+                    }
+                )
+            frames: list[dict] = []
+            while len(frames) < 3:
+                frame = await communicator.receive_json_from()
+                if frame["type"] != "chat.message.new":
+                    frames.append(frame)
+            await communicator.disconnect()
+            return frames
+
+        with mock.patch.object(api_settings, "MESSAGE_WRITE_BUFFER_INTERVAL", 0.05):
+            frames = async_to_sync(scenario)()
+
+        self.assertEqual(
+            sorted((frame["client_id"], frame["type"]) for frame in frames),
+            [
+                ("client-0", "chat.message.ack"),
+                ("client-1", "chat.message.error"),
+                ("client-2", "chat.message.ack"),
+            ],
+        )
+        self.assertEqual(
+            list(ChatMessage.objects.values_list("message", flat=True)),
+            ["message 0", "message 2"],
+        )
+        self.assertEqual(metrics.snapshot()["counters"]["chat.ingest.failed"], 1)
+
+    def test_messages_to_foreign_rooms_are_rejected(self) -> None:
+        foreign_room = ChatRoom.objects.create(title="foreign", chat_type="group")
+
+        async def scenario() -> dict:
+            communicator = self.communicator()
+            await communicator.connect()
+            await communicator.send_json_to(
+                {
+                    "type": "chat.message.new",
+                    "chat_room": foreign_room.id,
+                    "message": "x",
+                }
+            )
+            frame = await communicator.receive_json_from()
+            await communicator.disconnect()
+            return frame
+
+        self.assertEqual(async_to_sync(scenario)()["type"], "chat.message.error")
+        self.assertFalse(ChatMessage.objects.exists())
+
+    def test_membership_changes_are_relayed(self) -> None:
+        room = self.rooms[0]
+        other = User.objects.create_user(username="other", password="pass")
+
+        async def scenario() -> dict:
+            communicator = self.communicator()
+            await communicator.connect()
+            await database_sync_to_async(members.add_members)(room, [other.id])
+            frame = await communicator.receive_json_from()
+            await communicator.disconnect()
+            return frame
+
+        self.assertEqual(
+            async_to_sync(scenario)(),
+            {
+                "type": "chat.members.changed",
+                "chat_room": room.id,
+                "added": [other.id],
+                "removed": [],
+            },
+        )
+
+    def test_read_receipts_are_coalesced(self) -> None:
+        room = self.rooms[0]
+        other = User.objects.create_user(username="other", password="pass")
+        room.users.add(other)
+        messages = [
+            ChatMessage.objects.create(chat_room=room, created_by=other, message="x")
+            for _ in range(3)
+        ]
+        ChatRoom.objects.record_messages(messages)
+        ChatMember.objects.record_messages(messages)
+
+        async def scenario() -> None:
+            communicator = self.communicator()
+            await communicator.connect()
+            for message in messages[1::-1] + messages[2:]:
+                await communicator.send_json_to(
+                    {
+                        "type": "chat.read",
+                        "chat_room": room.id,
+                        "message_id": message.id,
+                    }
+                )
+            # Pending receipts are written on disconnect at the latest.
+            await communicator.disconnect()
+
+        with mock.patch.object(api_settings, "READ_RECEIPT_INTERVAL", 60):
+            async_to_sync(scenario)()
+
+        member = ChatMember.objects.get(user=self.user, chat_room=room)
+        self.assertEqual(member.last_read_message_id, messages[-1].id)
+        self.assertEqual(member.unread_count, 0)
+        self.assertEqual(
+            metrics.snapshot()["summaries"]["chat.receipts.batch.size"]["count"], 1
+        )
+
+    def test_typing_is_relayed_once_per_window(self) -> None:
+        room = self.rooms[0]
+        other = User.objects.create_user(username="other", password="pass")
+        room.users.add(other)
+
+        async def scenario() -> tuple[dict, bool]:
+            typist, watcher = self.communicator(), self.communicator()
+            watcher.scope["user"] = other
+            await typist.connect()
+            await watcher.connect()
+            for frame_type in ("chat.typing", "chat.typing", "chat.viewing"):
+                await typist.send_json_to({"type": frame_type, "chat_room": room.id})
+            frame = await watcher.receive_json_from()
+            nothing_else = await watcher.receive_nothing(timeout=0.1)
+            await typist.disconnect()
+            await watcher.disconnect()
+            return frame, nothing_else
+
+        with mock.patch.object(api_settings, "EPHEMERAL_EVENT_WINDOW", 0.05):
+            frame, nothing_else = async_to_sync(scenario)()
+
+        self.assertEqual(
+            frame,
+            {
+                "type": "chat.activity",
+                "chat_room": room.id,
+                "users": [{"user": self.user.id, "state": "viewing"}],
+                "ttl": api_settings.EPHEMERAL_EVENT_TTL,
+            },
+        )
+        self.assertTrue(nothing_else)
+        self.assertEqual(metrics.snapshot()["counters"]["chat.ephemeral.coalesced"], 2)
+
+    def test_slow_clients_are_evicted_with_a_resync_hint(self) -> None:
+        group = ROOM_CHAT_ALIAS.format(room_id=self.rooms[0].id)
+
+        async def stalled(consumer: ChatConsumer, event: dict) -> None:
+            await asyncio.Event().wait()
+
+        async def scenario() -> tuple[dict, dict]:
+            communicator = self.communicator()
+            await communicator.connect()
+            for i in range(3):
+                await self.channel_layer.group_send(
+                    group, {"type": "chat.message.new", "id": i, "text": "{}"}
+                )
+            frame = await communicator.receive_output()
+            closed = await communicator.receive_output()
+            await communicator.disconnect()
+            return frame, closed
+
+        with mock.patch.object(ChatConsumer, "send_frame", stalled), mock.patch.object(
+            api_settings, "OUTBOUND_QUEUE_HIGH_WATER", 1
+        ), mock.patch.object(api_settings, "OUTBOUND_QUEUE_MAX_SIZE", 2):
+            frame, closed = async_to_sync(scenario)()
+
+        self.assertEqual(
+            json.loads(frame["text"]),
+            {"type": "chat.resync", "reason": "slow_consumer"},
+        )
+        self.assertEqual(closed, {"type": "websocket.close", "code": 4008})
+        self.assertEqual(metrics.snapshot()["counters"]["chat.outbound.evicted"], 1)
+
+    def test_replies_go_through_the_outbound_queue(self) -> None:
+        sent = []
+        send_frame = ChatConsumer.send_frame
+
+        async def recording(consumer: ChatConsumer, event: dict) -> None:
+            sent.append(event["type"])
+            await send_frame(consumer, event)
+
+        async def scenario() -> dict:
+            communicator = self.communicator()
+            await communicator.connect()
+            await communicator.send_json_to(
+                {"type": "chat.sync", "rooms": [1], "client_id": "c1"}
+            )
+            frame = await communicator.receive_json_from()
+            await communicator.disconnect()
+            return frame
+
+        with mock.patch.object(ChatConsumer, "send_frame", recording):
+            frame = async_to_sync(scenario)()
+
+        self.assertEqual(frame, {"type": "chat.sync.error", "client_id": "c1"})
+        self.assertEqual(sent, ["chat.sync.error"])
+
+    def test_hot_paths_are_instrumented(self) -> None:
+        room = self.rooms[0]
+
+        async def scenario() -> float:
+            communicator = self.communicator()
+            await communicator.connect()
+            active = metrics.snapshot()["gauges"]["chat.connections.active"]
+            await communicator.send_json_to(
+                {"type": "chat.message.new", "chat_room": room.id, "message": "hi"}
+            )
+            frames = {
+                (await communicator.receive_json_from())["type"] for _ in range(2)
+            }
+            self.assertEqual(frames, {"chat.message.ack", "chat.message.new"})
+            await communicator.disconnect()
+            return active
+
+        self.assertEqual(async_to_sync(scenario)(), 1)
+
+        snapshot = metrics.snapshot()
+        self.assertEqual(snapshot["gauges"]["chat.connections.active"], 0)
+        for name in (
+            "chat.subscribe.seconds",
+            "chat.consumer.subscribe.db.seconds",
+            "chat.consumer.receive_message.seconds",
+            "chat.message.broadcast.seconds",
+            "chat.group_send.seconds",
+        ):
+            self.assertGreaterEqual(snapshot["summaries"][name]["count"], 1, name)
+
+    def test_sync_replays_missed_messages_of_all_rooms(self) -> None:
+        messages = {
+            room.id: ChatMessage.objects.bulk_create(
+                ChatMessage(chat_room=room, created_by=self.user, message=f"{i}")
+                for i in range(4)
+            )
+            for room in self.rooms
+        }
+        first, second, third = self.rooms
+        last_seen = {
+            first.id: messages[first.id][1].id,
+            second.id: messages[second.id][-1].id,
+        }
+
+        async def scenario() -> list[dict]:
+            communicator = self.communicator()
+            await communicator.connect()
+            await communicator.send_json_to(
+                {"type": "chat.sync", "client_id": "sync", "rooms": last_seen}
+            )
+            frames = [await communicator.receive_json_from() for _ in range(2)]
+            await communicator.disconnect()
+            return frames
+
+        with mock.patch.object(api_settings, "SYNC_MAX_MESSAGES_PER_ROOM", 3):
+            batch, done = async_to_sync(scenario)()
+
+        self.assertEqual(batch["type"], "chat.sync.messages")
+        self.assertEqual(
+            [message["id"] for message in batch["messages"]],
+            [message.id for message in messages[first.id][2:]]
+            + [message.id for message in messages[third.id][1:]],
+        )
+        self.assertEqual(batch["truncated"], [third.id])
+        self.assertEqual(
+            batch["messages"][0], ChatMessageSerializer(messages[first.id][2]).data
+        )
+        self.assertEqual(
+            done,
+            {"type": "chat.sync.done", "client_id": "sync", "rooms": 3, "messages": 5},
+        )
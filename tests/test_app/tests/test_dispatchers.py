@@ -0,0 +1,91 @@
+import json
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.contrib.auth import get_user_model
+from django.test import override_settings
+from rest_framework.test import APITestCase
+
+from df_chat.constants import ROOM_CHAT_ALIAS
+from df_chat.dispatchers import (
+    SyncEventDispatcher,
+    ThreadedEventDispatcher,
+    get_event_dispatcher,
+)
+from df_chat.models import ChatRoom
+
+User = get_user_model()
+
+
+class EventDispatcherTestCase(APITestCase):
+    def setUp(self) -> None:
+        self.channel_layer = get_channel_layer()
+        self.channel_name = async_to_sync(self.channel_layer.new_channel)()
+        self.group = ROOM_CHAT_ALIAS.format(room_id=1)
+        async_to_sync(self.channel_layer.group_add)(self.group, self.channel_name)
+
+    def tearDown(self) -> None:
+        async_to_sync(self.channel_layer.flush)()
+
+    def receive(self) -> dict:
+        return async_to_sync(self.channel_layer.receive)(self.channel_name)
+
+    def test_message_create_is_published_after_commit(self) -> None:
+        user = User.objects.create_user(username="user", password="pass")
+        room = ChatRoom.objects.create(title="room", chat_type="group")
+        room.users.add(user)
+        async_to_sync(self.channel_layer.group_add)(
+            ROOM_CHAT_ALIAS.format(room_id=room.id), self.channel_name
+        )
+        self.client.force_authenticate(user)
+
+        with self.captureOnCommitCallbacks(execute=False) as callbacks:
+            response = self.client.post(
+                f"/api/v1/chat/rooms/{room.id}/messages/", {"message": "hi"}
+            )
+        self.assertEqual(len(callbacks), 1)
+        before = get_event_dispatcher().stats()["published"]
+        callbacks[0]()
+
+        event = self.receive()
+        self.assertEqual(event["type"], "chat.message.new")
+        self.assertEqual(event["id"], response.data["id"])
+        self.assertEqual(json.loads(event["text"])["created_by"]["id"], user.id)
+        self.assertEqual(get_event_dispatcher().stats()["published"], before + 1)
+
+    def test_dispatcher_follows_setting_changes(self) -> None:
+        with override_settings(
+            DF_CHAT={"EVENT_DISPATCHER": "df_chat.dispatchers.ThreadedEventDispatcher"}
+        ):
+            dispatcher = get_event_dispatcher()
+            self.assertIsInstance(dispatcher, ThreadedEventDispatcher)
+            self.assertIs(get_event_dispatcher(), dispatcher)
+
+        self.assertIs(type(get_event_dispatcher()), SyncEventDispatcher)
+
+    def test_threaded_dispatcher_batches_in_order(self) -> None:
+        dispatcher = ThreadedEventDispatcher(max_queue_size=100, batch_size=10)
+
+        dispatcher.publish(
+            [(self.group, {"type": "chat.message.new", "id": i}) for i in range(25)]
+        )
+
+        self.assertTrue(dispatcher.flush(timeout=5))
+        self.assertEqual([self.receive()["id"] for _ in range(25)], list(range(25)))
+        stats = dispatcher.stats()
+        self.assertEqual(stats["published"], 25)
+        self.assertEqual(stats["queue_depth"], 0)
+        self.assertGreaterEqual(stats["batches"], 3)
+
+    def test_threaded_dispatcher_publishes_inline_when_full(self) -> None:
+        dispatcher = ThreadedEventDispatcher(max_queue_size=1, batch_size=1)
+
+        # Without a worker the queue never drains.
+        with mock.patch.object(dispatcher, "_ensure_worker"):
+            dispatcher.publish(
+                [(self.group, {"type": "chat.message.new", "id": i}) for i in range(3)]
+            )
+
+        self.assertEqual(dispatcher.stats()["overflowed"], 2)
+        self.assertEqual([self.receive()["id"] for _ in range(2)], [1, 2])
@@ -0,0 +1,87 @@
+import json
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from rest_framework.test import APITestCase
+
+from df_chat.drf.serializers import ChatMessageSerializer, UserSerializer
+from df_chat.encoders import (
+    encode_event,
+    get_dumps,
+    has_primitive_fields,
+    message_payload,
+    message_row,
+    user_payload,
+    user_payload_from_row,
+)
+from df_chat.models import ChatMessage, ChatRoom
+from df_chat.settings import api_settings
+
+User = get_user_model()
+
+
+class EncodersTestCase(APITestCase):
+    def setUp(self) -> None:
+        self.user = User.objects.create_user(username="user", password="pass")
+        room = ChatRoom.objects.create(title="room", chat_type="group")
+        self.message = ChatMessage.objects.create(
+            chat_room=room, created_by=self.user, message="héllo"
+        )
+
+    def tearDown(self) -> None:
+        get_dumps.cache_clear()
+
+    def test_payload_matches_serializer(self) -> None:
+        payload = message_payload(
+            message_row(self.message), user_payload(self.message.created_by)
+        )
+
+        self.assertEqual(payload, ChatMessageSerializer(self.message).data)
+
+    def test_payload_from_values_row(self) -> None:
+        row = ChatMessage.objects.values(*message_row(self.message)).get()
+
+        payload = message_payload(row, user_payload(self.user))
+
+        self.assertEqual(payload, ChatMessageSerializer(self.message).data)
+
+    def test_primitive_user_fields(self) -> None:
+        self.assertTrue(has_primitive_fields(("id", "username", "date_joined")))
+        self.assertFalse(has_primitive_fields(("id", "avatar")))
+        self.assertFalse(has_primitive_fields(("id", "get_full_name")))
+
+    def test_other_user_fields_are_rendered_by_the_serializer(self) -> None:
+        self.user.avatar = "avatars/user.png"
+        self.user.save()
+        fields = ("id", "first_name", "avatar")
+        row = ChatMessage.objects.values(
+            *(f"created_by__{name}" for name in fields)
+        ).get()
+
+        with mock.patch.object(
+            api_settings, "DEFAULT_USER_SERIALIZER_FIELDS", fields
+        ), mock.patch.object(UserSerializer.Meta, "fields", fields):
+            expected = UserSerializer(self.user).data
+            self.assertEqual(user_payload(self.user), expected)
+            self.assertEqual(user_payload_from_row(row), expected)
+        self.assertTrue(expected["avatar"].endswith("avatars/user.png"))
+
+    def test_encode_event_with_each_backend(self) -> None:
+        payload = ChatMessageSerializer(self.message).data
+        for backend in ("json", "auto"):
+            get_dumps.cache_clear()
+            with mock.patch.object(api_settings, "EVENT_ENCODER", backend):
+                event = encode_event("chat.message.new", payload)
+
+            self.assertEqual(event["id"], self.message.id)
+            self.assertEqual(
+                json.loads(event["text"]), {"type": "chat.message.new", **payload}
+            )
+
+    def test_binary_frames(self) -> None:
+        with mock.patch.object(api_settings, "EVENT_FRAME", "binary"):
+            event = encode_event("chat.message.new", {"id": 1})
+
+        self.assertEqual(
+            json.loads(event["bytes"]), {"type": "chat.message.new", "id": 1}
+        )
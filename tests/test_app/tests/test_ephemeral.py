@@ -0,0 +1,116 @@
+import json
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from rest_framework.test import APITestCase
+
+from df_chat.constants import ROOM_CHAT_ALIAS
+from df_chat.ephemeral import ActivityBuffer, ActivityState, TokenBucket
+from df_chat.metrics import metrics
+
+
+class Clock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class TokenBucketTestCase(APITestCase):
+    def test_burst_then_rate(self) -> None:
+        bucket = TokenBucket(rate=2, burst=3, now=0)
+        self.assertEqual([bucket.take(0) for _ in range(4)], [True] * 3 + [False])
+        self.assertTrue(bucket.take(0.5))
+        self.assertFalse(bucket.take(0.5))
+        self.assertFalse(bucket.is_full(1))
+        self.assertTrue(bucket.is_full(10))
+
+
+class ActivityBufferTestCase(APITestCase):
+    def setUp(self) -> None:
+        self.channel_layer = get_channel_layer()
+        self.clock = Clock()
+        metrics.reset()
+
+    def tearDown(self) -> None:
+        async_to_sync(self.channel_layer.flush)()
+
+    def buffer(self) -> ActivityBuffer:
+        return ActivityBuffer(
+            self.channel_layer, rate=1, burst=2, window=60, ttl=5, clock=self.clock
+        )
+
+    async def listen(self, room_id: int) -> str:
+        channel = await self.channel_layer.new_channel()
+        await self.channel_layer.group_add(
+            ROOM_CHAT_ALIAS.format(room_id=room_id), channel
+        )
+        return channel
+
+    async def received(self, channel: str) -> list[dict]:
+        events = []
+        while self.channel_layer.channels.get(channel):
+            event = await self.channel_layer.receive(channel)
+            events.append(json.loads(event["text"]))
+        return events
+
+    def test_events_are_coalesced_per_room(self) -> None:
+        async def scenario() -> list[dict]:
+            channel = await self.listen(1)
+            buffer = self.buffer()
+            buffer.submit(10, 1, ActivityState.typing)
+            buffer.submit(11, 1, ActivityState.viewing)
+            buffer.submit(10, 1, ActivityState.stopped_typing)
+            buffer.submit(10, 2, ActivityState.typing)
+            await buffer.flush()
+            return await self.received(channel)
+
+        events = async_to_sync(scenario)()
+
+        self.assertEqual(
+            events,
+            [
+                {
+                    "type": "chat.activity",
+                    "chat_room": 1,
+                    "users": [
+                        {"user": 10, "state": "stopped_typing"},
+                        {"user": 11, "state": "viewing"},
+                    ],
+                    "ttl": 5,
+                }
+            ],
+        )
+        counters = metrics.snapshot()["counters"]
+        self.assertEqual(counters["chat.ephemeral.coalesced"], 1)
+        self.assertEqual(counters["chat.ephemeral.sent"], 2)
+
+    def test_events_above_the_rate_are_dropped(self) -> None:
+        async def scenario() -> list[bool]:
+            buffer = self.buffer()
+            accepted = [buffer.submit(10, 1, ActivityState.typing) for _ in range(3)]
+            self.clock.now = 1
+            accepted.append(buffer.submit(10, 1, ActivityState.typing))
+            # Other users and rooms have their own bucket.
+            accepted.append(buffer.submit(11, 1, ActivityState.typing))
+            accepted.append(buffer.submit(10, 2, ActivityState.typing))
+            await buffer.flush()
+            return accepted
+
+        accepted = async_to_sync(scenario)()
+
+        self.assertEqual(accepted, [True, True, False, True, True, True])
+        self.assertEqual(metrics.snapshot()["counters"]["chat.ephemeral.dropped"], 1)
+
+    def test_stale_events_expire(self) -> None:
+        async def scenario() -> list[dict]:
+            channel = await self.listen(1)
+            buffer = self.buffer()
+            buffer.submit(10, 1, ActivityState.typing)
+            self.clock.now = 5
+            await buffer.flush()
+            return await self.received(channel)
+
+        self.assertEqual(async_to_sync(scenario)(), [])
+        self.assertEqual(metrics.snapshot()["counters"]["chat.ephemeral.expired"], 1)
@@ -0,0 +1,163 @@
+import asyncio
+import csv
+import io
+import json
+from datetime import timedelta
+from typing import Any, Mapping
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from django.contrib.auth import get_user_model
+from django.core.handlers.asgi import ASGIHandler
+from django.core.management import call_command
+from django.utils import timezone
+from rest_framework.test import APITestCase, APITransactionTestCase
+
+from df_chat import export
+from df_chat.drf.serializers import ChatMessageSerializer
+from df_chat.models import ChatMessage, ChatRoom
+from df_chat.settings import api_settings
+
+User = get_user_model()
+
+
+class MessageExportTestCase(APITestCase):
+    def setUp(self) -> None:
+        self.user = User.objects.create_user(
+            username="user", password="pass", first_name="Ann"
+        )
+        self.room = ChatRoom.objects.create(title="room", chat_type="group")
+        self.room.users.add(self.user)
+        other_room = ChatRoom.objects.create(title="other", chat_type="group")
+        self.messages = [
+            ChatMessage.objects.create(
+                chat_room=self.room, created_by=self.user, message=f'line {i}, "q"'
+            )
+            for i in range(5)
+        ]
+        ChatMessage.objects.create(
+            chat_room=other_room, created_by=self.user, message="elsewhere"
+        )
+        self.url = f"/api/v1/chat/rooms/{self.room.id}/messages/export/"
+        self.client.force_authenticate(self.user)
+
+    def export(self, **params: Any) -> tuple:
+        response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, 200)
+        return response, b"".join(response.streaming_content).decode()
+
+    def test_ndjson_export_streams_the_room_history(self) -> None:
+        response, content = self.export()
+
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        self.assertEqual(
+            [json.loads(line) for line in content.splitlines()],
+            [ChatMessageSerializer(message).data for message in self.messages],
+        )
+
+    def test_csv_export_resumes_after_a_message(self) -> None:
+        response, content = self.export(export_format="csv", after=self.messages[2].id)
+
+        self.assertEqual(response["Content-Type"], "text/csv")
+        header, *rows = csv.reader(io.StringIO(content))
+        self.assertEqual(header[0], "id")
+        self.assertEqual(
+            [(int(row[0]), row[-1]) for row in rows],
+            [(message.id, message.message) for message in self.messages[3:]],
+        )
+        self.assertIn("Ann", rows[0])
+
+    def test_date_range_and_invalid_params(self) -> None:
+        ChatMessage.objects.filter(pk=self.messages[0].pk).update(
+            created=timezone.now() - timedelta(days=2)
+        )
+        since = (timezone.now() - timedelta(days=1)).isoformat()
+
+        _, content = self.export(since=since)
+
+        self.assertEqual(len(content.splitlines()), 4)
+        response = self.client.get(self.url, {"export_format": "xml"})
+        self.assertEqual(response.status_code, 400)
+
+    def test_outsider_cannot_export(self) -> None:
+        self.client.force_authenticate(User.objects.create_user(username="other"))
+
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+
+    def test_command_exports_all_rooms(self) -> None:
+        stdout = io.StringIO()
+
+        call_command(
+            "export_chat_messages",
+            "--chunk-size",
+            "2",
+            stdout=stdout,
+            stderr=io.StringIO(),
+        )
+
+        lines = [json.loads(line) for line in stdout.getvalue().splitlines()]
+        self.assertEqual(len(lines), 6)
+        self.assertEqual(lines[-1]["message"], "elsewhere")
+
+
+class AsgiMessageExportTestCase(APITransactionTestCase):
+    def setUp(self) -> None:
+        self.user = User.objects.create_user(username="user", password="pass")
+        self.room = ChatRoom.objects.create(title="room", chat_type="group")
+        self.room.users.add(self.user)
+        self.messages = [
+            ChatMessage.objects.create(
+                chat_room=self.room, created_by=self.user, message=f"line {i}"
+            )
+            for i in range(5)
+        ]
+        self.client.force_login(self.user)
+
+    def test_export_streams_in_chunks_under_asgi(self) -> None:
+        scope = {
+            "type": "http",
+            "method": "GET",
+            "path": f"/api/v1/chat/rooms/{self.room.id}/messages/export/",
+            "query_string": b"",
+            "headers": [
+                (
+                    b"cookie",
+                    f"sessionid={self.client.cookies['sessionid'].value}".encode(),
+                )
+            ],
+        }
+
+        events: list[dict] = []
+        # Messages read when each response event was sent.
+        read_at_send: list[int] = []
+
+        requests = [{"type": "http.request", "body": b""}]
+
+        async def receive() -> dict:
+            if requests:
+                return requests.pop()
+            # Django listens for a disconnect while streaming.
+            await asyncio.Event().wait()
+            return {"type": "http.disconnect"}
+
+        async def send(event: Mapping[str, Any]) -> None:
+            events.append(dict(event))
+            read_at_send.append(payload.call_count)
+
+        async def scenario() -> None:
+            await ASGIHandler()(scope, receive, send)
+
+        with mock.patch.object(api_settings, "EXPORT_CHUNK_SIZE", 2), mock.patch.object(
+            export, "message_payload", wraps=export.message_payload
+        ) as payload:
+            async_to_sync(scenario)()
+
+        start, *bodies = events
+        self.assertEqual(start["status"], 200)
+        # The first line went out before the rest of the room was read.
+        self.assertEqual(read_at_send[1], 2)
+        content = b"".join(body.get("body", b"") for body in bodies)
+        self.assertEqual(
+            [json.loads(line)["id"] for line in content.splitlines()],
+            [message.id for message in self.messages],
+        )
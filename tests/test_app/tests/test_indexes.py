@@ -0,0 +1,107 @@
+import unittest
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.db.models import QuerySet
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APITestCase
+
+from df_chat.models import ChatMember, ChatMessage, ChatRoom, MemberChannel
+
+User = get_user_model()
+
+# SQLite backs table level unique constraints with an automatic index.
+MEMBER_INDEX = {
+    "sqlite": "sqlite_autoindex_df_chat_chatmember_1",
+    "postgresql": "df_chat_member_user_room_uniq",
+}
+# Index Django creates for the ``ChatMember.user`` foreign key.
+MEMBER_USER_INDEX = "df_chat_chatmember_user_id_ccef25f8"
+
+
+@unittest.skipUnless(
+    connection.vendor in MEMBER_INDEX, "EXPLAIN output is vendor specific"
+)
+class QueryPlanTestCase(APITestCase):
+    def setUp(self) -> None:
+        self.user = User.objects.create_user(username="user", password="pass")
+        self.room = ChatRoom.objects.create(title="room", chat_type="group")
+        self.room.users.add(self.user)
+        ChatMessage.objects.create(
+            chat_room=self.room, created_by=self.user, message="hello"
+        )
+        MemberChannel.objects.create(user=self.user, channel_name="channel")
+        self.client.force_authenticate(self.user)
+
+    def explain(self, sql: str, params: tuple = ()) -> str:
+        with connection.cursor() as cursor:
+            if connection.vendor == "postgresql":
+                # Tiny test tables would otherwise always be sequentially scanned.
+                cursor.execute("SET LOCAL enable_seqscan = off")
+                cursor.execute(f"EXPLAIN {sql}", params)
+            else:
+                cursor.execute(f"EXPLAIN QUERY PLAN {sql}", params)
+            return "\n".join(str(row[-1]) for row in cursor.fetchall())
+
+    def explain_queryset(self, queryset: QuerySet) -> str:
+        return self.explain(*queryset.query.sql_with_params())
+
+    def plans_for(self, url: str, table: str) -> list[str]:
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        plans = [
+            self.explain(query["sql"])
+            for query in context.captured_queries
+            if query["sql"].startswith("SELECT") and f'FROM "{table}"' in query["sql"]
+        ]
+        self.assertTrue(plans)
+        return plans
+
+    def test_message_list_uses_room_created_index(self) -> None:
+        url = f"/api/v1/chat/rooms/{self.room.id}/messages/"
+        for plan in self.plans_for(url, "df_chat_chatmessage"):
+            self.assertIn("df_chat_msg_room_created_idx", plan)
+
+    def test_room_list_uses_member_index(self) -> None:
+        # The list reads the unread counters from the member rows, so the
+        # planner may prefer the user foreign key index over the unique one.
+        for plan in self.plans_for("/api/v1/chat/rooms/", "df_chat_chatroom"):
+            self.assertTrue(
+                MEMBER_INDEX[connection.vendor] in plan or MEMBER_USER_INDEX in plan,
+                plan,
+            )
+            self.assertNotIn("df_chat_chatmessage", plan)
+
+    def test_room_detail_uses_member_index(self) -> None:
+        url = f"/api/v1/chat/rooms/{self.room.id}/"
+        for plan in self.plans_for(url, "df_chat_chatroom"):
+            self.assertIn(MEMBER_INDEX[connection.vendor], plan)
+
+    def test_member_lookup_uses_unique_constraint(self) -> None:
+        members = ChatMember.objects.filter(user=self.user, chat_room=self.room)
+        plan = self.explain_queryset(members)
+        self.assertIn(MEMBER_INDEX[connection.vendor], plan)
+
+    def test_member_channel_lookups_use_indexes(self) -> None:
+        channels = MemberChannel.objects.subscribed_channels(self.user.id)
+        plan = self.explain_queryset(channels.values_list("channel_name", flat=True))
+        self.assertIn("df_chat_channel_user_idx", plan)
+
+        plan = self.explain_queryset(
+            MemberChannel.objects.filter(channel_name="channel")
+        )
+        self.assertIn("df_chat_channel_name_idx", plan)
+
+    def test_rooms_by_activity_use_activity_index(self) -> None:
+        rooms = ChatRoom.objects.order_by("-last_activity_at", "-id")[:10]
+        plan = self.explain_queryset(rooms)
+        self.assertIn("df_chat_room_activity_idx", plan)
+
+    def test_archive_uses_created_index(self) -> None:
+        oldest = ChatMessage.objects.filter(created__lt=timezone.now()).order_by(
+            "created", "id"
+        )[:100]
+        plan = self.explain_queryset(oldest.values("id"))
+        self.assertIn("df_chat_msg_created_idx", plan)
@@ -0,0 +1,154 @@
+import json
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from rest_framework.test import APITestCase
+
+from df_chat import membership
+from df_chat.constants import ROOM_CHAT_ALIAS
+from df_chat.members import add_members, remove_members
+from df_chat.models import ChatMember, ChatRoom, MemberChannel
+from df_chat.settings import api_settings
+
+User = get_user_model()
+
+
+class BulkMembersTestCase(APITestCase):
+    def setUp(self) -> None:
+        self.channel_layer = get_channel_layer()
+        self.owner = User.objects.create_user(username="owner", password="pass")
+        self.room = ChatRoom.objects.create(title="room", chat_type="group")
+        self.room.users.add(self.owner)
+        self.group = ROOM_CHAT_ALIAS.format(room_id=self.room.id)
+        self.url = f"/api/v1/chat/rooms/{self.room.id}/members/bulk/"
+        self.client.force_authenticate(self.owner)
+
+    def tearDown(self) -> None:
+        async_to_sync(self.channel_layer.flush)()
+
+    def create_users(self, count: int) -> list[int]:
+        users = User.objects.bulk_create(
+            User(username=f"bulk{User.objects.count()}.{i}") for i in range(count)
+        )
+        return [user.id for user in users]
+
+    def group_events(self) -> str:
+        channel = async_to_sync(self.channel_layer.new_channel)()
+        async_to_sync(self.channel_layer.group_add)(self.group, channel)
+        return channel
+
+    def received(self, channel: str) -> list[dict]:
+        events = []
+        while self.channel_layer.channels.get(channel):
+            event = async_to_sync(self.channel_layer.receive)(channel)
+            events.append(json.loads(event["text"]))
+        return events
+
+    def test_bulk_add_reports_added_and_unknown_ids(self) -> None:
+        user_ids = self.create_users(3)
+        channel = self.group_events()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                self.url,
+                {"action": "add", "users": [*user_ids, self.owner.id, 999999]},
+                format="json",
+            )
+
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(
+            response.data, {"added": user_ids, "removed": [], "unknown": [999999]}
+        )
+        self.assertEqual(membership.members(self.room.id), {self.owner.id, *user_ids})
+        self.assertEqual(
+            self.received(channel),
+            [
+                {
+                    "type": "chat.members.changed",
+                    "chat_room": self.room.id,
+                    "added": user_ids,
+                    "removed": [],
+                }
+            ],
+        )
+
+    def test_bulk_add_runs_a_fixed_number_of_queries(self) -> None:
+        for count in (10, 100):
+            user_ids = self.create_users(count)
+            for user_id in user_ids:
+                MemberChannel.objects.create(
+                    user_id=user_id, channel_name=f"channel.{user_id}"
+                )
+            # Validation, then insert inside a savepoint, then the presence
+            # lookup and the reload of the room's members and fan-out shards.
+            with self.assertNumQueries(6), self.captureOnCommitCallbacks(execute=True):
+                change = add_members(self.room, user_ids)
+            self.assertEqual(change.added, user_ids)
+        self.assertEqual(len(self.channel_layer.groups[self.group]), 110)
+
+    def test_batches(self) -> None:
+        user_ids = self.create_users(5)
+        add_members(self.room, user_ids, batch_size=2)
+        self.assertEqual(ChatMember.objects.filter(chat_room=self.room).count(), 6)
+
+        change = remove_members(self.room, user_ids[:3], batch_size=2)
+        self.assertEqual(change.removed, user_ids[:3])
+        self.assertEqual(
+            set(
+                ChatMember.objects.filter(chat_room=self.room).values_list(
+                    "user_id", flat=True
+                )
+            ),
+            {self.owner.id, *user_ids[3:]},
+        )
+
+    def test_bulk_remove(self) -> None:
+        user_ids = self.create_users(2)
+        add_members(self.room, user_ids)
+        MemberChannel.objects.create(user_id=user_ids[0], channel_name="removed")
+        async_to_sync(self.channel_layer.group_add)(self.group, "removed")
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                self.url, {"action": "remove", "users": user_ids}, format="json"
+            )
+
+        self.assertEqual(response.data["removed"], user_ids)
+        self.assertEqual(membership.members(self.room.id), {self.owner.id})
+        self.assertNotIn("removed", self.channel_layer.groups.get(self.group, {}))
+
+    def test_subscriptions_wait_for_the_commit(self) -> None:
+        user_ids = self.create_users(1)
+        MemberChannel.objects.create(user_id=user_ids[0], channel_name="added")
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            add_members(self.room, user_ids)
+            self.assertNotIn("added", self.channel_layer.groups.get(self.group, {}))
+
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            remove_members(self.room, user_ids)
+            raise RuntimeError
+        # The rolled back removal left the subscription alone.
+        for callback in callbacks:
+            callback()
+        self.assertIn("added", self.channel_layer.groups[self.group])
+
+    def test_rejected_requests(self) -> None:
+        private_room = ChatRoom.objects.create(title="private", chat_type="private")
+        private_room.users.add(self.owner)
+        response = self.client.post(
+            f"/api/v1/chat/rooms/{private_room.id}/members/bulk/",
+            {"action": "add", "users": [self.owner.id]},
+            format="json",
+        )
+        self.assertEqual(response.status_code, 400)
+
+        with mock.patch.object(api_settings, "MEMBERS_BULK_MAX_SIZE", 2):
+            response = self.client.post(
+                self.url, {"action": "add", "users": [1, 2, 3]}, format="json"
+            )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data["errors"][0]["field"], "users")
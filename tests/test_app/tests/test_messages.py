@@ -0,0 +1,108 @@
+from typing import Any
+
+from django.contrib.auth import get_user_model
+from rest_framework.test import APITestCase
+
+from df_chat.models import ChatMember, ChatMessage, ChatRoom
+
+User = get_user_model()
+
+
+class MessageViewSetPaginationTestCase(APITestCase):
+    def setUp(self) -> None:
+        self.user = User.objects.create_user(username="user", password="pass")
+        self.room = ChatRoom.objects.create(title="room", chat_type="group")
+        self.room.users.add(self.user)
+        self.messages = [
+            ChatMessage.objects.create(
+                chat_room=self.room, created_by=self.user, message=f"message {i}"
+            )
+            for i in range(25)
+        ]
+        self.url = f"/api/v1/chat/rooms/{self.room.id}/messages/"
+        self.client.force_authenticate(self.user)
+
+    def ids(self, response: Any) -> list[int]:
+        return [message["id"] for message in response.data["results"]]
+
+    def test_first_page_is_newest_without_count(self) -> None:
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn("count", response.data)
+        self.assertEqual(self.ids(response), [m.id for m in self.messages[::-1][:10]])
+        self.assertIsNone(response.data["previous"])
+        self.assertIn(f"before={self.messages[15].id}", response.data["next"])
+
+    def test_before_walks_back_to_the_oldest_message(self) -> None:
+        response = self.client.get(
+            self.url, {"before": self.messages[5].id, "limit": 10}
+        )
+        self.assertEqual(self.ids(response), [m.id for m in self.messages[4::-1]])
+        self.assertIsNone(response.data["next"])
+        self.assertIn(f"after={self.messages[4].id}", response.data["previous"])
+
+    def test_after_returns_newer_messages_newest_first(self) -> None:
+        response = self.client.get(self.url, {"after": self.messages[5].id})
+        self.assertEqual(self.ids(response), [m.id for m in self.messages[15:5:-1]])
+        self.assertIn(f"after={self.messages[15].id}", response.data["previous"])
+        self.assertIn(f"before={self.messages[6].id}", response.data["next"])
+
+    def test_around_centers_page_on_anchor(self) -> None:
+        response = self.client.get(
+            self.url, {"around": self.messages[12].id, "limit": 5}
+        )
+        self.assertEqual(self.ids(response), [m.id for m in self.messages[14:9:-1]])
+
+    def test_invalid_limits_and_anchors(self) -> None:
+        for limit in ("0", "-1", "x"):
+            response = self.client.get(self.url, {"limit": limit})
+            self.assertEqual(len(response.data["results"]), 10)
+        response = self.client.get(self.url, {"limit": 1000})
+        self.assertEqual(len(response.data["results"]), 25)
+
+        for anchor in ("0", "-1", "x"):
+            response = self.client.get(self.url, {"before": anchor})
+            self.assertEqual(response.status_code, 404)
+
+    def test_anchor_from_another_room_is_rejected(self) -> None:
+        other_room = ChatRoom.objects.create(title="other", chat_type="group")
+        message = ChatMessage.objects.create(
+            chat_room=other_room, created_by=self.user, message="hidden"
+        )
+        response = self.client.get(self.url, {"before": message.id})
+        self.assertEqual(response.status_code, 404)
+
+
+class MessageViewSetMembershipTestCase(APITestCase):
+    def setUp(self) -> None:
+        self.member = User.objects.create_user(username="member", password="pass")
+        self.outsider = User.objects.create_user(username="outsider", password="pass")
+        self.room = ChatRoom.objects.create(title="room", chat_type="group")
+        self.room.users.add(self.member)
+        self.url = f"/api/v1/chat/rooms/{self.room.id}/messages/"
+
+    def test_membership_is_cached(self) -> None:
+        self.client.force_authenticate(self.member)
+        self.client.get(self.url)
+
+        # Only the page query of each tier: no membership lookup, no anchor,
+        # no count.
+        with self.assertNumQueries(2):
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+
+    def test_outsider_cannot_read_or_post(self) -> None:
+        self.client.force_authenticate(self.outsider)
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+        response = self.client.post(self.url, {"message": "hi"})
+        self.assertEqual(response.status_code, 403)
+
+    def test_membership_changes_invalidate_the_cache(self) -> None:
+        self.client.force_authenticate(self.outsider)
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+
+        self.room.users.add(self.outsider)
+        self.assertEqual(self.client.get(self.url).status_code, 200)
+
+        ChatMember.objects.get(user=self.outsider, chat_room=self.room).delete()
+        self.assertEqual(self.client.get(self.url).status_code, 403)
@@ -0,0 +1,96 @@
+from unittest import mock
+
+from django.test import RequestFactory, override_settings
+from rest_framework.test import APITestCase
+
+from df_chat.metrics import (
+    InMemoryMetricsSink,
+    NullMetricsSink,
+    PrometheusMetricsSink,
+    get_metrics_sink,
+    metrics,
+)
+from df_chat.settings import api_settings
+from df_chat.views import prometheus_metrics
+
+
+class MetricsSinkTestCase(APITestCase):
+    def setUp(self) -> None:
+        patcher = mock.patch.object(api_settings, "METRICS_BUCKETS", (0.1, 1))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_null_sink_records_nothing(self) -> None:
+        sink = NullMetricsSink()
+        sink.increment("chat.counter")
+        with sink.timer("chat.timer.seconds"):
+            pass
+        self.assertFalse(sink.enabled)
+        self.assertEqual(
+            sink.snapshot(), {"counters": {}, "gauges": {}, "summaries": {}}
+        )
+
+    def test_in_memory_sink(self) -> None:
+        sink = InMemoryMetricsSink()
+        sink.increment("chat.counter", 2)
+        sink.adjust_gauge("chat.connections", 3)
+        sink.adjust_gauge("chat.connections", -1)
+        for value in (0.05, 0.5, 5):
+            sink.observe("chat.timer.seconds", value)
+        sink.observe("chat.batch.size", 4)
+
+        snapshot = sink.snapshot()
+        self.assertEqual(snapshot["counters"], {"chat.counter": 2})
+        self.assertEqual(snapshot["gauges"], {"chat.connections": 2})
+        self.assertEqual(
+            snapshot["summaries"]["chat.timer.seconds"],
+            {"count": 3, "sum": 5.55, "min": 0.05, "max": 5, "buckets": [1, 1]},
+        )
+        self.assertNotIn("buckets", snapshot["summaries"]["chat.batch.size"])
+
+    def test_prometheus_rendering(self) -> None:
+        sink = PrometheusMetricsSink()
+        sink.increment("chat.outbound.dropped")
+        sink.set_gauge("chat.connections.active", 2)
+        sink.observe("chat.connect.seconds", 0.5)
+        sink.observe("chat.sync.messages", 7)
+
+        self.assertEqual(
+            sink.render(),
+            "# TYPE chat_outbound_dropped_total counter\n"
+            "chat_outbound_dropped_total 1.0\n"
+            "# TYPE chat_connections_active gauge\n"
+            "chat_connections_active 2.0\n"
+            "# TYPE chat_connect_seconds histogram\n"
+            'chat_connect_seconds_bucket{le="0.1"} 0\n'
+            'chat_connect_seconds_bucket{le="1"} 1\n'
+            'chat_connect_seconds_bucket{le="+Inf"} 1\n'
+            "chat_connect_seconds_sum 0.5\n"
+            "chat_connect_seconds_count 1\n"
+            "# TYPE chat_sync_messages summary\n"
+            "chat_sync_messages_sum 7.0\n"
+            "chat_sync_messages_count 1\n",
+        )
+
+    def test_sink_follows_setting_changes(self) -> None:
+        with override_settings(
+            DF_CHAT={"METRICS_SINK": "df_chat.metrics.NullMetricsSink"}
+        ):
+            self.assertIsInstance(get_metrics_sink(), NullMetricsSink)
+            self.assertFalse(metrics.enabled)
+
+        self.assertIs(type(get_metrics_sink()), InMemoryMetricsSink)
+        self.assertTrue(metrics.enabled)
+
+    def test_prometheus_view(self) -> None:
+        request = RequestFactory().get("/metrics/")
+        self.addCleanup(get_metrics_sink.cache_clear)
+        with mock.patch.object(api_settings, "METRICS_SINK", PrometheusMetricsSink):
+            get_metrics_sink.cache_clear()
+            metrics.increment("chat.reaper.channels")
+            response = prometheus_metrics(request)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response["Content-Type"].startswith("text/plain"))
+        self.assertIn(b"chat_reaper_channels_total 1.0", response.content)
+        self.assertIn(b"chat_outbound_connections 0", response.content)
@@ -0,0 +1,66 @@
+import time
+from typing import Any
+
+import pytest
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from rest_framework.test import APITransactionTestCase
+
+jwt = pytest.importorskip("jwt")
+
+from df_chat.middleware import (  # noqa: E402
+    JWTAuthMiddleware,
+    get_cache_stats,
+    get_token_cache,
+    get_user_cache,
+)
+
+User = get_user_model()
+
+
+class JWTAuthMiddlewareTestCase(APITransactionTestCase):
+    def setUp(self) -> None:
+        self.user = User.objects.create_user(username="user", password="pass")
+        for cache in (get_token_cache(), get_user_cache()):
+            if cache is not None:
+                cache.clear()
+        self.scopes: list[dict] = []
+
+        async def inner(scope: dict, receive: Any, send: Any) -> None:
+            self.scopes.append(dict(scope))
+
+        self.middleware = JWTAuthMiddleware(inner)
+
+    def connect(self, token: str) -> object:
+        scope = {"type": "websocket", "query_string": f"token={token}".encode()}
+        async_to_sync(self.middleware)(scope, None, None)
+        return self.scopes[-1]["user"]
+
+    def token(self, **payload: Any) -> str:
+        return jwt.encode(
+            {"user_id": self.user.id, **payload}, settings.SECRET_KEY, "HS256"
+        )
+
+    def test_reconnects_are_served_from_cache(self) -> None:
+        token = self.token(exp=int(time.time()) + 60)
+        self.assertEqual(self.connect(token), self.user)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(self.connect(token), self.user)
+
+        stats = get_cache_stats()
+        tokens, users = stats["tokens"], stats["users"]
+        assert tokens is not None and users is not None
+        self.assertEqual(tokens["hits"], 1)
+        self.assertEqual(users["hits"], 1)
+
+    def test_saving_the_user_drops_it_from_cache(self) -> None:
+        token = self.token()
+        self.connect(token)
+
+        self.user.first_name = "Changed"
+        self.user.save()
+
+        with self.assertNumQueries(1):
+            self.assertEqual(self.connect(token).first_name, "Changed")
@@ -0,0 +1,140 @@
+import asyncio
+from typing import Optional
+
+from asgiref.sync import async_to_sync
+from rest_framework.test import APITestCase
+
+from df_chat.metrics import metrics
+from df_chat.outbound import OutboundQueue, queue_stats
+
+
+class Clock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def event(event_type: str, event_id: Optional[int], text: str = "") -> dict:
+    return {"type": event_type, "id": event_id, "text": text}
+
+
+class OutboundQueueTestCase(APITestCase):
+    def setUp(self) -> None:
+        self.clock = Clock()
+        self.sent: list[dict] = []
+        metrics.reset()
+
+    async def send(self, event: dict) -> None:
+        self.sent.append(event)
+
+    def queue(self) -> OutboundQueue:
+        return OutboundQueue(
+            self.send, high_water=3, max_size=6, evict_after=5, clock=self.clock
+        )
+
+    def test_updates_are_coalesced_and_activity_dropped(self) -> None:
+        async def scenario() -> int:
+            queue = self.queue()
+            queue.put(event("chat.message.new", 1))
+            queue.put(event("chat.message.update", 1, "first edit"))
+            queue.put(event("chat.message.update", 1, "second edit"))
+            queue.put(event("chat.activity", None, "typing"))
+            queue.put(event("chat.activity", None, "viewing"))
+            depth = len(queue)
+            queue.start()
+            while len(queue):
+                await asyncio.sleep(0)
+            await asyncio.sleep(0)
+            queue.stop()
+            return depth
+
+        self.assertEqual(async_to_sync(scenario)(), 3)
+        self.assertEqual(
+            [(sent["type"], sent["text"]) for sent in self.sent],
+            [
+                ("chat.message.new", ""),
+                ("chat.message.update", "second edit"),
+                ("chat.activity", "viewing"),
+            ],
+        )
+        counters = metrics.snapshot()["counters"]
+        self.assertEqual(counters["chat.outbound.coalesced"], 1)
+        self.assertEqual(counters["chat.outbound.dropped"], 1)
+
+    def test_connections_staying_over_the_high_water_mark_are_evicted(self) -> None:
+        async def scenario() -> list[bool]:
+            queue = self.queue()
+            kept = [queue.put(event("chat.message.new", i)) for i in range(4)]
+            self.clock.now = 4
+            kept.append(queue.put(event("chat.message.new", 4)))
+            self.clock.now = 5
+            kept.append(queue.put(event("chat.message.new", 5)))
+            return kept
+
+        self.assertEqual(async_to_sync(scenario)(), [True] * 5 + [False])
+
+    def test_connections_reaching_the_max_size_are_evicted(self) -> None:
+        async def scenario() -> list[bool]:
+            queue = self.queue()
+            return [queue.put(event("chat.message.new", i)) for i in range(6)]
+
+        self.assertEqual(async_to_sync(scenario)(), [True] * 5 + [False])
+
+    def test_dropped_events_are_released_while_the_writer_is_stalled(self) -> None:
+        async def scenario() -> tuple[list[bool], int]:
+            queue = self.queue()
+            kept = [queue.put(event("chat.message.new", i)) for i in range(3)]
+            kept.extend(
+                queue.put(event("chat.activity", None, f"typing {i}"))
+                for i in range(1000)
+            )
+            held = len(queue._entries)
+            queue.start()
+            while len(queue):
+                await asyncio.sleep(0)
+            await asyncio.sleep(0)
+            queue.stop()
+            return kept, held
+
+        kept, held = async_to_sync(scenario)()
+        self.assertTrue(all(kept))
+        self.assertLessEqual(held, 7)
+        self.assertEqual(
+            [(sent["type"], sent["text"]) for sent in self.sent],
+            [("chat.message.new", "")] * 3,
+        )
+
+    def test_writers_wait_for_the_queue_to_drain(self) -> None:
+        async def scenario() -> tuple[bool, int]:
+            queue = self.queue()
+            for i in range(5):
+                queue.put(event("chat.message.new", i))
+            waiter = asyncio.ensure_future(queue.wait_writable())
+            await asyncio.sleep(0)
+            blocked = not waiter.done()
+            queue.start()
+            await waiter
+            depth = len(queue)
+            queue.stop()
+            return blocked, depth
+
+        blocked, depth = async_to_sync(scenario)()
+        self.assertTrue(blocked)
+        self.assertLessEqual(depth, 3)
+
+    def test_queue_stats(self) -> None:
+        async def scenario() -> tuple[dict, dict]:
+            first, second = self.queue(), self.queue()
+            first.put(event("chat.message.new", 1))
+            for i in range(3):
+                second.put(event("chat.message.new", i))
+            stats = queue_stats()
+            first.stop()
+            second.stop()
+            return stats, queue_stats()
+
+        stats, after_stop = async_to_sync(scenario)()
+        self.assertEqual(stats, {"connections": 2, "depth": 4, "max_depth": 3})
+        self.assertEqual(after_stop["connections"], 0)
@@ -0,0 +1,237 @@
+from abc import ABC, abstractmethod
+from collections import defaultdict
+from datetime import timedelta
+from typing import Any
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from django.contrib.auth import get_user_model
+from django.utils import timezone
+from rest_framework.test import APITestCase
+
+from df_chat.models import ChatRoom, MemberChannel
+from df_chat.presence import (
+    BasePresenceBackend,
+    DatabasePresenceBackend,
+    InMemoryPresenceBackend,
+    PresenceTracker,
+    RedisPresenceBackend,
+    online_users,
+)
+
+User = get_user_model()
+
+
+class PresenceBackendTestMixin(ABC):
+    @abstractmethod
+    def make_backend(self) -> BasePresenceBackend:
+        ...
+
+    @abstractmethod
+    def age(self, backend: Any, channel_name: str, seconds: float) -> None:
+        ...
+
+    def setUp(self) -> None:
+        self.users = [
+            User.objects.create_user(username=f"user{i}", password="pass")
+            for i in range(3)
+        ]
+        self.backend = self.make_backend()
+        self.backend.connect(self.users[0].id, "a.1")
+        self.backend.connect(self.users[0].id, "a.2")
+        self.backend.connect(self.users[1].id, "b.1")
+
+    def test_channels_and_online_users(self) -> None:
+        user_ids = [user.id for user in self.users]
+
+        self.assertEqual(
+            sorted(self.backend.channels_for_users(user_ids)), ["a.1", "a.2", "b.1"]
+        )
+        self.assertEqual(
+            self.backend.online_user_ids(user_ids), {self.users[0].id, self.users[1].id}
+        )
+
+        self.backend.disconnect(["b.1"])
+
+        self.assertEqual(self.backend.online_user_ids(user_ids), {self.users[0].id})
+
+    def test_heartbeat_keeps_channels_from_expiring(self) -> None:
+        for channel_name in ("a.1", "a.2", "b.1"):
+            self.age(self.backend, channel_name, 120)
+        self.backend.heartbeat(["a.1"])
+
+        expired = self.backend.expire_stale(60)
+
+        self.assertEqual(
+            sorted(expired),
+            sorted([(self.users[0].id, "a.2"), (self.users[1].id, "b.1")]),
+        )
+        self.assertEqual(
+            self.backend.channels_for_users([user.id for user in self.users]), ["a.1"]
+        )
+
+
+class DatabasePresenceBackendTestCase(PresenceBackendTestMixin, APITestCase):
+    def make_backend(self) -> DatabasePresenceBackend:
+        return DatabasePresenceBackend()
+
+    def age(self, backend: Any, channel_name: str, seconds: float) -> None:
+        MemberChannel.objects.filter(channel_name=channel_name).update(
+            last_alive_at=timezone.now() - timedelta(seconds=seconds)
+        )
+
+    def test_heartbeat_is_a_single_query(self) -> None:
+        with self.assertNumQueries(1):
+            self.backend.heartbeat(["a.1", "a.2", "b.1"])
+
+
+class InMemoryPresenceBackendTestCase(PresenceBackendTestMixin, APITestCase):
+    def make_backend(self) -> InMemoryPresenceBackend:
+        return InMemoryPresenceBackend()
+
+    def age(self, backend: Any, channel_name: str, seconds: float) -> None:
+        backend._alive[channel_name] -= seconds
+
+    def test_online_users_of_a_room(self) -> None:
+        room = ChatRoom.objects.create(title="room", chat_type="group")
+        room.users.add(self.users[0], self.users[2])
+
+        with mock.patch(
+            "df_chat.presence.get_presence_backend", return_value=self.backend
+        ):
+            self.assertEqual(online_users(room.id), {self.users[0].id})
+
+    def test_tracker_sends_one_heartbeat_for_all_channels(self) -> None:
+        backend = mock.Mock(wraps=self.backend)
+        tracker = PresenceTracker(backend=backend, interval=60)
+
+        async def scenario() -> None:
+            await tracker.connect(self.users[2].id, "c.1")
+            await tracker.connect(self.users[2].id, "c.2")
+            await tracker.beat()
+            await tracker.disconnect("c.1")
+            await tracker.disconnect("c.2")
+
+        async_to_sync(scenario)()
+
+        backend.heartbeat.assert_called_once()
+        self.assertEqual(sorted(backend.heartbeat.call_args.args[0]), ["c.1", "c.2"])
+        self.assertEqual(self.backend.channels_for_users([self.users[2].id]), [])
+
+
+class FakeRedis:
+    """
+    The Redis commands used by ``RedisPresenceBackend``, replying with bytes
+    like redis-py does.
+    """
+
+    def __init__(self) -> None:
+        self.zsets: dict[str, dict[bytes, float]] = defaultdict(dict)
+        self.hashes: dict[str, dict[bytes, bytes]] = defaultdict(dict)
+        self.sets: dict[str, set[bytes]] = defaultdict(set)
+
+    def pipeline(self, transaction: bool = True) -> "FakePipeline":
+        return FakePipeline(self)
+
+    def zadd(self, key: str, mapping: dict, xx: bool = False) -> int:
+        zset = self.zsets[key]
+        added = 0
+        for member, score in mapping.items():
+            member = member.encode()
+            if xx and member not in zset:
+                continue
+            added += member not in zset
+            zset[member] = score
+        return added
+
+    def zrem(self, key: str, *members: str) -> int:
+        zset = self.zsets[key]
+        return sum(zset.pop(member.encode(), None) is not None for member in members)
+
+    def zrangebyscore(self, key: str, low: str, high: float) -> list[bytes]:
+        return sorted(
+            (member for member, score in self.zsets[key].items() if score <= high),
+            key=self.zsets[key].__getitem__,
+        )
+
+    def hset(self, key: str, field: str, value: Any) -> int:
+        self.hashes[key][field.encode()] = str(value).encode()
+        return 1
+
+    def hdel(self, key: str, *fields: str) -> int:
+        hash_ = self.hashes[key]
+        return sum(hash_.pop(field.encode(), None) is not None for field in fields)
+
+    def hmget(self, key: str, fields: list[str]) -> list:
+        return [self.hashes[key].get(field.encode()) for field in fields]
+
+    def sadd(self, key: str, *members: str) -> int:
+        added = {member.encode() for member in members} - self.sets[key]
+        self.sets[key] |= added
+        return len(added)
+
+    def srem(self, key: str, *members: str) -> int:
+        removed = {member.encode() for member in members} & self.sets[key]
+        self.sets[key] -= removed
+        return len(removed)
+
+    def smembers(self, key: str) -> set[bytes]:
+        return set(self.sets[key])
+
+    def scard(self, key: str) -> int:
+        return len(self.sets[key])
+
+
+class FakePipeline:
+    def __init__(self, client: FakeRedis) -> None:
+        self.client = client
+        self.commands: list[tuple[str, tuple, dict]] = []
+
+    def __getattr__(self, name: str) -> Any:
+        def queue(*args: Any, **kwargs: Any) -> "FakePipeline":
+            self.commands.append((name, args, kwargs))
+            return self
+
+        return queue
+
+    def execute(self) -> list:
+        commands, self.commands = self.commands, []
+        return [
+            getattr(self.client, name)(*args, **kwargs)
+            for name, args, kwargs in commands
+        ]
+
+
+class RedisPresenceBackendTestCase(PresenceBackendTestMixin, APITestCase):
+    def make_backend(self) -> RedisPresenceBackend:
+        return RedisPresenceBackend(client=FakeRedis())
+
+    def age(self, backend: Any, channel_name: str, seconds: float) -> None:
+        backend.client.zsets[backend.alive_key][channel_name.encode()] -= seconds
+
+    def test_disconnect_forgets_the_channel(self) -> None:
+        self.backend.disconnect(["a.1", "unknown"])
+
+        client = self.backend.client
+        self.assertEqual(self.backend.channels_for_users([self.users[0].id]), ["a.2"])
+        self.assertEqual(set(client.zsets[self.backend.alive_key]), {b"a.2", b"b.1"})
+        self.assertEqual(set(client.hashes[self.backend.owners_key]), {b"a.2", b"b.1"})
+
+    def test_heartbeat_does_not_revive_disconnected_channels(self) -> None:
+        self.backend.disconnect(["b.1"])
+        self.backend.heartbeat(["a.1", "b.1"])
+
+        self.assertEqual(
+            set(self.backend.client.zsets[self.backend.alive_key]), {b"a.1", b"a.2"}
+        )
+        self.assertEqual(self.backend.expire_stale(60), [])
+
+    def test_expired_channels_are_removed_from_their_users(self) -> None:
+        self.age(self.backend, "b.1", 120)
+
+        self.assertEqual(self.backend.expire_stale(60), [(self.users[1].id, "b.1")])
+        self.assertEqual(
+            self.backend.online_user_ids([user.id for user in self.users]),
+            {self.users[0].id},
+        )
+        self.assertEqual(self.backend.expire_stale(60), [])
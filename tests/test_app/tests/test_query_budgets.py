@@ -0,0 +1,79 @@
+from typing import Any
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from rest_framework.test import APITestCase
+
+from df_chat.membership import get_local_cache
+from df_chat.models import ChatMessage, ChatRoom
+
+User = get_user_model()
+
+
+class QueryBudgetTestCase(APITestCase):
+    """
+    Every endpoint runs a fixed number of queries, whatever the page size or
+    the number of members. Membership caches are cleared before each request
+    so the budgets include the permission lookups.
+    """
+
+    def setUp(self) -> None:
+        self.user = User.objects.create_user(username="user", password="pass")
+        self.client.force_authenticate(self.user)
+
+    def create_room(self, members: int, messages: int) -> ChatRoom:
+        room = ChatRoom.objects.create(title="room", chat_type="group")
+        users = [self.user] + [
+            User.objects.create_user(username=f"member{room.id}.{i}")
+            for i in range(members - 1)
+        ]
+        room.users.add(*users)
+        ChatMessage.objects.bulk_create(
+            ChatMessage(chat_room=room, created_by=users[i % members], message="hi")
+            for i in range(messages)
+        )
+        ChatRoom.objects.filter(pk=room.pk).refresh_summary()
+        return room
+
+    def assert_budget(self, queries: int, method: str, url: str, **data: Any) -> None:
+        cache.clear()
+        get_local_cache().clear()
+        with self.assertNumQueries(queries):
+            response = getattr(self.client, method)(url, data)
+        self.assertLess(response.status_code, 300, response.data)
+
+    def test_rooms_list(self) -> None:
+        for rooms in (1, 10):
+            for _ in range(rooms):
+                self.create_room(members=3, messages=1)
+            self.assert_budget(2, "get", "/api/v1/chat/rooms/", limit=rooms)
+
+    def test_room_detail(self) -> None:
+        room = self.create_room(members=5, messages=5)
+        self.assert_budget(1, "get", f"/api/v1/chat/rooms/{room.id}/")
+
+    def test_members(self) -> None:
+        for members in (2, 20):
+            room = self.create_room(members=members, messages=0)
+            self.assert_budget(2, "get", f"/api/v1/chat/rooms/{room.id}/members/")
+
+    def test_messages_list(self) -> None:
+        for members, limit in ((1, 5), (10, 50)):
+            room = self.create_room(members=members, messages=limit)
+            # Membership, then the hot and archive tiers.
+            self.assert_budget(
+                3, "get", f"/api/v1/chat/rooms/{room.id}/messages/", limit=limit
+            )
+            # A full page from the hot tier doesn't touch the archive.
+            self.assert_budget(
+                2, "get", f"/api/v1/chat/rooms/{room.id}/messages/", limit=limit - 1
+            )
+
+    def test_message_create(self) -> None:
+        for members in (1, 20):
+            room = self.create_room(members=members, messages=1)
+            # Membership, then insert, room summary, unread counters and
+            # search index inside a savepoint.
+            self.assert_budget(
+                7, "post", f"/api/v1/chat/rooms/{room.id}/messages/", message="hi"
+            )
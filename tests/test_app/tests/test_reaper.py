@@ -0,0 +1,63 @@
+from datetime import timedelta
+from io import StringIO
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.utils import timezone
+from rest_framework.test import APITestCase
+
+from df_chat.constants import ROOM_CHAT_ALIAS, USER_CHAT_ALIAS
+from df_chat.models import ChatRoom, MemberChannel
+from df_chat.reaper import areap_stale_channels
+
+User = get_user_model()
+
+
+class ReaperTestCase(APITestCase):
+    def setUp(self) -> None:
+        self.channel_layer = get_channel_layer()
+        self.user = User.objects.create_user(username="user", password="pass")
+        self.room = ChatRoom.objects.create(title="room", chat_type="group")
+        self.room.users.add(self.user)
+        self.room_group = ROOM_CHAT_ALIAS.format(room_id=self.room.id)
+        self.user_group = USER_CHAT_ALIAS.format(user_id=self.user.id)
+        now = timezone.now()
+        for channel_name, last_alive_at in (
+            ("dead.1", now - timedelta(minutes=10)),
+            ("dead.2", now - timedelta(minutes=10)),
+            ("alive", now),
+        ):
+            MemberChannel.objects.create(
+                user=self.user, channel_name=channel_name, last_alive_at=last_alive_at
+            )
+            for group in (self.room_group, self.user_group):
+                async_to_sync(self.channel_layer.group_add)(group, channel_name)
+
+    def tearDown(self) -> None:
+        async_to_sync(self.channel_layer.flush)()
+
+    def group_channels(self, group: str) -> set[str]:
+        return set(self.channel_layer.groups.get(group, {}))
+
+    def test_reap_stale_channels(self) -> None:
+        result = async_to_sync(areap_stale_channels)(max_age=60, batch_size=3)
+
+        self.assertEqual(result.channels, 2)
+        # System, user and room group for each channel.
+        self.assertEqual(result.memberships, 6)
+        self.assertEqual(
+            list(MemberChannel.objects.values_list("channel_name", flat=True)),
+            ["alive"],
+        )
+        self.assertEqual(self.group_channels(self.room_group), {"alive"})
+        self.assertEqual(self.group_channels(self.user_group), {"alive"})
+
+    def test_command_reports_reclaimed_channels(self) -> None:
+        stdout = StringIO()
+
+        call_command("reap_chat_channels", "--max-age", "60", stdout=stdout)
+
+        self.assertIn("Reclaimed 2 channels (6 group memberships)", stdout.getvalue())
+        self.assertEqual(MemberChannel.objects.count(), 1)
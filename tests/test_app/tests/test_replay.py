@@ -0,0 +1,83 @@
+from datetime import timedelta
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APITestCase
+
+from df_chat.archive import archive_messages
+from df_chat.encoders import user_payload_from_row
+from df_chat.models import ChatMessage, ChatRoom
+from df_chat.replay import _room_rows, chunk_messages
+
+User = get_user_model()
+
+
+class ChunkMessagesTestCase(APITestCase):
+    def setUp(self) -> None:
+        self.user = User.objects.create_user(username="user", password="pass")
+        self.rooms = [
+            ChatRoom.objects.create(title=f"room{i}", chat_type="group")
+            for i in range(3)
+        ]
+        self.messages = {
+            room.id: [
+                ChatMessage.objects.create(
+                    chat_room=room, created_by=self.user, message=f"{i}"
+                ).id
+                for i in range(count)
+            ]
+            for room, count in zip(self.rooms, (5, 2, 0))
+        }
+
+    def test_newest_messages_after_last_seen_per_room(self) -> None:
+        first, second, empty = (room.id for room in self.rooms)
+        last_seen = {first: 0, second: self.messages[second][0], empty: 0}
+
+        with CaptureQueriesContext(connection) as queries, mock.patch(
+            "df_chat.replay.user_payload_from_row", wraps=user_payload_from_row
+        ) as render_user:
+            missed = chunk_messages(last_seen, limit=3)
+
+        self.assertEqual(
+            [message["id"] for message in missed.messages],
+            self.messages[first][-3:] + self.messages[second][1:],
+        )
+        self.assertEqual(missed.truncated, [first])
+        # The author is rendered once for all of their messages.
+        render_user.assert_called_once()
+        # Every room is read with its own LIMIT, not a window over its history.
+        for query in queries:
+            self.assertIn("LIMIT 4", query["sql"])
+            self.assertNotIn("ROW_NUMBER", query["sql"])
+
+    def test_archived_messages_are_replayed(self) -> None:
+        first, second, _ = (room.id for room in self.rooms)
+        # The oldest three messages of the first room are archived.
+        ChatMessage.objects.filter(pk__in=self.messages[first][:3]).update(
+            created=timezone.now() - timedelta(days=730)
+        )
+        self.assertEqual(archive_messages(), 3)
+
+        missed = chunk_messages({first: self.messages[first][0]}, limit=10)
+        self.assertEqual(
+            [message["id"] for message in missed.messages], self.messages[first][1:]
+        )
+        self.assertEqual(missed.truncated, [])
+
+        missed = chunk_messages({first: 0, second: 0}, limit=4)
+        self.assertEqual(
+            [message["id"] for message in missed.messages],
+            self.messages[first][1:] + self.messages[second],
+        )
+        self.assertEqual(missed.truncated, [first])
+
+    def test_rooms_are_combined_where_compound_limits_are_supported(self) -> None:
+        with mock.patch.object(
+            connection.features, "supports_slicing_ordering_in_compound", True
+        ):
+            sql = str(_room_rows(1, 0, 3).union(_room_rows(2, 5, 3), all=True).query)
+        self.assertEqual(sql.count("LIMIT 4"), 2)
+        self.assertIn("UNION ALL", sql)
@@ -0,0 +1,215 @@
+import importlib
+from io import StringIO
+from typing import Any, Optional
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.db import OperationalError, connection
+from rest_framework.test import APITestCase
+
+from df_chat.archive import archive_messages
+from df_chat.models import ChatMessage, ChatRoom
+from df_chat.search import (
+    BasicSearchBackend,
+    PostgresSearchBackend,
+    get_search_backend,
+)
+
+User = get_user_model()
+
+search_index_migration = importlib.import_module(
+    "df_chat.migrations.0006_message_search_index"
+)
+
+
+class SearchTestCase(APITestCase):
+    url = "/api/v1/chat/search/"
+
+    def setUp(self) -> None:
+        self.user = User.objects.create_user(username="user", password="pass")
+        self.room = ChatRoom.objects.create(title="room", chat_type="group")
+        self.room.users.add(self.user)
+        self.foreign_room = ChatRoom.objects.create(title="foreign", chat_type="group")
+        self.client.force_authenticate(self.user)
+
+    def post(self, message: str, room: Optional[ChatRoom] = None) -> int:
+        response = self.client.post(
+            f"/api/v1/chat/rooms/{(room or self.room).id}/messages/",
+            {"message": message},
+        )
+        self.assertEqual(response.status_code, 201)
+        return response.data["id"]
+
+    def search(self, **params: Any) -> dict:
+        response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, 200, response.data)
+        return response.data
+
+    def ids(self, data: dict) -> list[int]:
+        return [message["id"] for message in data["results"]]
+
+    def test_search_is_ranked_and_scoped_to_member_rooms(self) -> None:
+        weak = self.post("deploy finished, lunch later")
+        strong = self.post("deploy deploy deploy")
+        self.post("nothing to see")
+        ChatMessage.objects.create(
+            chat_room=self.foreign_room, created_by=self.user, message="deploy"
+        )
+
+        data = self.search(q="deploy")
+
+        self.assertEqual(self.ids(data), [strong, weak])
+        self.assertGreater(data["results"][0]["score"], data["results"][1]["score"])
+
+    def test_index_follows_edit_and_delete(self) -> None:
+        message_id = self.post("draft release notes")
+        url = f"/api/v1/chat/rooms/{self.room.id}/messages/{message_id}/"
+
+        self.client.patch(url, {"message": "final release notes"})
+        self.assertEqual(self.ids(self.search(q="draft")), [])
+        self.assertEqual(self.ids(self.search(q="final")), [message_id])
+
+        self.client.delete(url)
+        self.assertEqual(self.ids(self.search(q="final")), [])
+
+    def test_keyset_pages(self) -> None:
+        message_ids = [self.post(f"standup note {i}") for i in range(5)]
+
+        first = self.search(q="standup", limit=2)
+        second = self.client.get(first["next"]).data
+        third = self.client.get(second["next"]).data
+
+        self.assertEqual(
+            self.ids(first) + self.ids(second) + self.ids(third), message_ids[::-1]
+        )
+        self.assertIsNone(third["next"])
+
+    def test_archived_messages_are_found(self) -> None:
+        message_id = self.post("quarterly report")
+        ChatMessage.objects.update(created="2000-01-01T00:00:00Z")
+        archive_messages()
+
+        self.assertEqual(self.ids(self.search(q="quarterly")), [message_id])
+
+    def test_reindex_command(self) -> None:
+        message = ChatMessage.objects.create(
+            chat_room=self.room, created_by=self.user, message="imported history"
+        )
+        self.assertEqual(self.ids(self.search(q="imported")), [])
+
+        call_command("reindex_chat_search", stdout=StringIO())
+
+        self.assertEqual(self.ids(self.search(q="imported")), [message.id])
+
+    def test_user_input_is_not_query_syntax(self) -> None:
+        self.post('say "hi" OR NOT bye*')
+
+        self.assertEqual(len(self.search(q='"hi" OR')["results"]), 1)
+        self.assertEqual(self.client.get(self.url).status_code, 400)
+
+    def indexed_ids(self) -> set[int]:
+        table, column = {
+            "sqlite": ("df_chat_message_fts", "rowid"),
+            "postgresql": ("df_chat_message_search", "message_id"),
+        }[connection.vendor]
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT {column} FROM {table}")  # noqa: S608
+            return {message_id for message_id, in cursor.fetchall()}
+
+    def test_index_table_exists(self) -> None:
+        self.assertIn(
+            {"sqlite": "df_chat_message_fts", "postgresql": "df_chat_message_search"}[
+                connection.vendor
+            ],
+            connection.introspection.table_names(),
+        )
+
+    def test_cascade_deletes_leave_the_index(self) -> None:
+        other = User.objects.create_user(username="other", password="pass")
+        self.room.users.add(other)
+        self.foreign_room.users.add(self.user)
+        kept = self.post("kept")
+        self.post("room gone", self.foreign_room)
+        self.client.force_authenticate(other)
+        self.post("author gone")
+        ChatMessage.objects.filter(created_by=other).update(
+            created="2000-01-01T00:00:00Z"
+        )
+        archive_messages()
+
+        self.foreign_room.delete()
+        other.delete()
+
+        self.assertEqual(self.indexed_ids(), {kept})
+
+
+class SearchBackendTestCase(APITestCase):
+    def tearDown(self) -> None:
+        get_search_backend.cache_clear()
+
+    def test_sqlite_without_fts5_falls_back_to_basic_search(self) -> None:
+        schema_editor = mock.Mock()
+        schema_editor.connection = mock.Mock(vendor="sqlite", alias="default")
+        schema_editor.execute.side_effect = OperationalError("no such module: fts5")
+
+        search_index_migration.create_search_index(None, schema_editor)
+
+        get_search_backend.cache_clear()
+        with mock.patch.object(connection, "vendor", "sqlite"), mock.patch.object(
+            connection.introspection, "table_names", return_value=[]
+        ):
+            self.assertIsInstance(get_search_backend(), BasicSearchBackend)
+
+    def test_postgres_index_tables(self) -> None:
+        schema_editor = mock.Mock()
+        schema_editor.connection.vendor = "postgresql"
+
+        search_index_migration.create_search_index(None, schema_editor)
+
+        statements = [call.args[0] for call in schema_editor.execute.call_args_list]
+        self.assertIn("document tsvector NOT NULL", statements[0])
+        self.assertIn("USING GIN (document)", statements[1])
+
+
+class PostgresSearchBackendTestCase(APITestCase):
+    """
+    The SQL sent by the ``tsvector`` backend, checked without PostgreSQL.
+    """
+
+    def setUp(self) -> None:
+        patcher = mock.patch("df_chat.search.connection")
+        self.cursor = patcher.start().cursor.return_value.__enter__.return_value
+        self.addCleanup(patcher.stop)
+        self.backend = PostgresSearchBackend()
+
+    def test_index_upserts_documents(self) -> None:
+        self.backend.index([ChatMessage(id=1, chat_room_id=2, message="hello")])
+
+        sql, params = self.cursor.executemany.call_args.args
+        self.assertIn("to_tsvector(%s::regconfig, %s)", sql)
+        self.assertIn("ON CONFLICT (message_id) DO UPDATE", sql)
+        self.assertEqual(params, [(1, 2, "simple", "hello")])
+
+    def test_search_is_ranked_and_paged_with_a_keyset(self) -> None:
+        self.cursor.fetchall.return_value = [(0.5, 3)]
+
+        hits = self.backend.search("deploy now", [1, 2], 10, after=(0.7, 9))
+
+        sql, params = self.cursor.execute.call_args.args
+        self.assertIn("ts_rank_cd(document, query)", sql)
+        self.assertIn("websearch_to_tsquery(%s::regconfig, %s)", sql)
+        self.assertIn("chat_room_id = ANY(%s)", sql)
+        self.assertIn("score < %s::real OR (score = %s::real AND id < %s)", sql)
+        self.assertEqual(params, ["simple", "deploy now", [1, 2], 0.7, 0.7, 9, 10])
+        self.assertEqual(hits, [(0.5, 3)])
+
+    def test_remove_messages_and_rooms(self) -> None:
+        self.backend.remove([1, 2])
+        self.backend.remove_rooms([3])
+
+        (remove, remove_rooms) = self.cursor.execute.call_args_list
+        self.assertIn("WHERE message_id = ANY(%s)", remove.args[0])
+        self.assertEqual(remove.args[1], [[1, 2]])
+        self.assertIn("WHERE chat_room_id = ANY(%s)", remove_rooms.args[0])
+        self.assertEqual(remove_rooms.args[1], [[3]])
@@ -0,0 +1,255 @@
+import json
+import threading
+from collections import Counter
+from io import StringIO
+from typing import Any
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from rest_framework.test import APITestCase, APITransactionTestCase
+
+from df_chat import membership
+from df_chat.asgi.consumers import ChatConsumer
+from df_chat.constants import ROOM_CHAT_ALIAS, ROOM_SHARD_CHAT_ALIAS
+from df_chat.drf.serializers import ChatMessageSerializer
+from df_chat.fanout import room_group, room_groups, shard_groups
+from df_chat.members import set_fanout_shards
+from df_chat.models import ChatMember, ChatRoom, MemberChannel
+from df_chat.settings import api_settings
+from df_chat.utils import DynamicUserGroupSubscriptionHandler
+
+User = get_user_model()
+
+
+class ShardGroupsTestCase(APITestCase):
+    def test_unsharded_rooms_use_the_room_group(self) -> None:
+        self.assertEqual(room_group(1, 1, "channel"), "room_1")
+        self.assertEqual(shard_groups(1, 1), ["room_1"])
+
+    def test_channels_spread_over_the_shards(self) -> None:
+        groups = shard_groups(1, 4)
+        self.assertEqual(
+            groups, [ROOM_SHARD_CHAT_ALIAS.format(room_id=1, shard=k) for k in range(4)]
+        )
+        picked = Counter(room_group(1, 4, f"channel.{i}") for i in range(400))
+        self.assertEqual(set(picked), set(groups))
+        self.assertGreater(min(picked.values()), 50)
+        # A channel always lands on the same shard.
+        self.assertEqual(room_group(1, 4, "channel.1"), room_group(1, 4, "channel.1"))
+
+    def test_room_groups_follow_the_room_shards(self) -> None:
+        user = User.objects.create_user(username="user", password="pass")
+        room = ChatRoom.objects.create(title="room", chat_type="group")
+        room.users.add(user)
+        self.assertEqual(
+            room_groups(room.id), [ROOM_CHAT_ALIAS.format(room_id=room.id)]
+        )
+
+        room.fanout_shards = 8
+        room.save()
+        self.assertEqual(room_groups(room.id), shard_groups(room.id, 8))
+
+    def test_subscriptions_join_the_shard_of_the_channel(self) -> None:
+        channel_layer = get_channel_layer()
+        user = User.objects.create_user(username="user", password="pass")
+        MemberChannel.objects.create(user=user, channel_name="channel.1")
+        room = ChatRoom.objects.create(title="room", chat_type="group", fanout_shards=4)
+        room.users.add(user)
+
+        group = room_group(room.id, 4, "channel.1")
+        self.assertEqual(set(channel_layer.groups.get(group, {})), {"channel.1"})
+        DynamicUserGroupSubscriptionHandler().unsubscribe_many([user.id], [room.id])
+        self.assertFalse(channel_layer.groups.get(group))
+        async_to_sync(channel_layer.flush)()
+
+    def test_changing_the_shards_moves_online_connections(self) -> None:
+        channel_layer = get_channel_layer()
+        users = [
+            User.objects.create_user(username=f"user{i}", password="pass")
+            for i in range(10)
+        ]
+        for user in users:
+            MemberChannel.objects.create(user=user, channel_name=f"channel.{user.id}")
+        room = ChatRoom.objects.create(title="room", chat_type="group")
+        room.users.add(*users)
+
+        previous_group = ROOM_CHAT_ALIAS.format(room_id=room.id)
+        channel_names = {f"channel.{user.id}" for user in users}
+
+        with mock.patch.object(threading, "Timer") as timer:
+            call_command("set_chat_room_shards", room.id, 4, stdout=StringIO())
+        room.refresh_from_db()
+        self.assertEqual(room.fanout_shards, 4)
+        self.assertEqual(room_groups(room.id), shard_groups(room.id, 4))
+        for channel_name in channel_names:
+            group = room_group(room.id, 4, channel_name)
+            self.assertIn(channel_name, channel_layer.groups.get(group, {}))
+
+        # Processes with a stale room policy still reach the previous group
+        # until their local cache expired.
+        self.assertEqual(set(channel_layer.groups[previous_group]), channel_names)
+        delay, leave_previous = timer.call_args.args
+        self.assertEqual(delay, api_settings.MEMBERSHIP_LOCAL_CACHE_TTL)
+        leave_previous()
+        self.assertFalse(channel_layer.groups.get(previous_group))
+        async_to_sync(channel_layer.flush)()
+
+
+class AdminsOnlyPostingTestCase(APITestCase):
+    def setUp(self) -> None:
+        self.owner = User.objects.create_user(username="owner", password="pass")
+        self.admin = User.objects.create_user(username="admin", password="pass")
+        self.member = User.objects.create_user(username="member", password="pass")
+        self.room = ChatRoom.objects.create(
+            title="announcements", chat_type="group", admins_only_posting=True
+        )
+        ChatMember.objects.create(chat_room=self.room, user=self.owner, is_owner=True)
+        ChatMember.objects.create(chat_room=self.room, user=self.admin, is_admin=True)
+        ChatMember.objects.create(chat_room=self.room, user=self.member)
+        self.url = f"/api/v1/chat/rooms/{self.room.id}/messages/"
+
+    def post(self, user: Any) -> Any:
+        self.client.force_authenticate(user)
+        return self.client.post(self.url, {"message": "hi"})
+
+    def test_only_owners_and_admins_can_post(self) -> None:
+        self.assertEqual(self.post(self.owner).status_code, 201)
+        self.assertEqual(self.post(self.admin).status_code, 201)
+
+        response = self.post(self.member)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(
+            response.data["errors"][0]["message"], "Only admins can post in this room"
+        )
+
+        # Members still read the room.
+        self.client.force_authenticate(self.member)
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data["results"]), 2)
+
+    def test_turning_the_policy_off_lets_members_post(self) -> None:
+        self.assertTrue(membership.is_member(self.member.id, self.room.id))
+        self.assertFalse(membership.can_post(self.member.id, self.room.id))
+
+        self.room.admins_only_posting = False
+        self.room.save()
+        self.assertEqual(self.post(self.member).status_code, 201)
+
+
+class ShardedRoomConsumerTestCase(APITransactionTestCase):
+    def setUp(self) -> None:
+        self.channel_layer = get_channel_layer()
+        self.user = User.objects.create_user(username="user", password="pass")
+        self.room = ChatRoom.objects.create(
+            title="room", chat_type="group", fanout_shards=4
+        )
+        self.room.users.add(self.user)
+
+    def tearDown(self) -> None:
+        async_to_sync(self.channel_layer.flush)()
+
+    def communicator(self) -> WebsocketCommunicator:
+        communicator = WebsocketCommunicator(ChatConsumer.as_asgi(), "/ws/chat/")
+        communicator.scope["user"] = self.user
+        return communicator
+
+    def test_messages_reach_connections_of_every_shard(self) -> None:
+        def post_message() -> None:
+            serializer = ChatMessageSerializer(data={"message": "hello"})
+            serializer.is_valid(raise_exception=True)
+            serializer.save(created_by=self.user, chat_room_id=self.room.id)
+
+        async def scenario() -> tuple[set[str], set[str], list[dict]]:
+            communicators = [self.communicator() for _ in range(8)]
+            for communicator in communicators:
+                await communicator.connect()
+            occupied = {
+                group
+                for group in shard_groups(self.room.id, 4)
+                if self.channel_layer.groups.get(group)
+            }
+            channel_names = set(
+                await database_sync_to_async(
+                    lambda: list(
+                        MemberChannel.objects.values_list("channel_name", flat=True)
+                    )
+                )()
+            )
+            await database_sync_to_async(post_message)()
+            frames = [
+                json.loads(await communicator.receive_from())
+                for communicator in communicators
+            ]
+            for communicator in communicators:
+                await communicator.disconnect()
+            return occupied, channel_names, frames
+
+        occupied, channel_names, frames = async_to_sync(scenario)()
+
+        self.assertGreater(len(occupied), 1)
+        self.assertEqual(
+            {frame["type"] for frame in frames}, {"chat.message.new"}, frames
+        )
+        # Channels left their shard on disconnect.
+        for channel_name in channel_names:
+            group = room_group(self.room.id, 4, channel_name)
+            self.assertNotIn(channel_name, self.channel_layer.groups.get(group, {}))
+        self.assertFalse(
+            self.channel_layer.groups.get(ROOM_CHAT_ALIAS.format(room_id=self.room.id))
+        )
+
+    def test_shard_groups_are_left_on_disconnect_after_a_shard_change(self) -> None:
+        room = ChatRoom.objects.create(title="growing", chat_type="group")
+        room.users.add(self.user)
+        groups = [ROOM_CHAT_ALIAS.format(room_id=room.id), *shard_groups(room.id, 4)]
+
+        def subscribed() -> set[str]:
+            return {
+                channel
+                for group in groups
+                for channel in self.channel_layer.groups.get(group, {})
+            }
+
+        async def scenario() -> tuple[set[str], set[str]]:
+            communicator = self.communicator()
+            await communicator.connect()
+            await database_sync_to_async(set_fanout_shards)(room, 4)
+            before = subscribed()
+            await communicator.disconnect()
+            return before, subscribed()
+
+        # The previous group is still joined when the connection goes away.
+        with mock.patch.object(threading, "Timer"):
+            before, after = async_to_sync(scenario)()
+
+        self.assertEqual(len(before), 1)
+        self.assertEqual(after, set())
+
+    def test_members_cannot_post_over_websocket_in_admin_only_rooms(self) -> None:
+        self.room.admins_only_posting = True
+        self.room.save()
+
+        async def scenario() -> dict:
+            communicator = self.communicator()
+            await communicator.connect()
+            await communicator.send_json_to(
+                {
+                    "type": "chat.message.new",
+                    "chat_room": self.room.id,
+                    "message": "hi",
+                    "client_id": "c1",
+                }
+            )
+            frame = await communicator.receive_json_from()
+            await communicator.disconnect()
+            return frame
+
+        self.assertEqual(
+            async_to_sync(scenario)(), {"type": "chat.message.error", "client_id": "c1"}
+        )
@@ -0,0 +1,76 @@
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.contrib.auth import get_user_model
+from rest_framework.test import APITestCase
+
+from df_chat.constants import ROOM_CHAT_ALIAS
+from df_chat.models import ChatRoom, MemberChannel
+from df_chat.utils import DynamicUserGroupSubscriptionHandler
+
+User = get_user_model()
+
+
+class SubscriptionHandlerTestCase(APITestCase):
+    def setUp(self) -> None:
+        self.channel_layer = get_channel_layer()
+        self.users = [
+            User.objects.create_user(username=f"user{i}", password="pass")
+            for i in range(3)
+        ]
+        self.channels = {
+            user.id: [f"channel.{user.id}.{i}" for i in range(2)] for user in self.users
+        }
+        for user in self.users:
+            for channel_name in self.channels[user.id]:
+                MemberChannel.objects.create(user=user, channel_name=channel_name)
+        self.rooms = [
+            ChatRoom.objects.create(title=f"room{i}", chat_type="group")
+            for i in range(2)
+        ]
+
+    def tearDown(self) -> None:
+        async_to_sync(self.channel_layer.flush)()
+
+    def group_channels(self, room: ChatRoom) -> set[str]:
+        group = ROOM_CHAT_ALIAS.format(room_id=room.id)
+        return set(self.channel_layer.groups.get(group, {}))
+
+    def test_subscribe_many_runs_a_fixed_number_of_queries(self) -> None:
+        handler = DynamicUserGroupSubscriptionHandler()
+        user_ids = [user.id for user in self.users]
+
+        # Online channels, then the rooms' fan-out shards, cached afterwards.
+        with self.assertNumQueries(2):
+            handler.subscribe_many(user_ids, [room.id for room in self.rooms])
+
+        expected = {
+            channel for user in self.users for channel in self.channels[user.id]
+        }
+        for room in self.rooms:
+            self.assertEqual(self.group_channels(room), expected)
+
+        with self.assertNumQueries(1):
+            handler.unsubscribe_many(user_ids[:1], [self.rooms[0].id])
+        self.assertEqual(
+            self.group_channels(self.rooms[0]),
+            expected - set(self.channels[user_ids[0]]),
+        )
+
+    def test_m2m_changes_update_subscriptions(self) -> None:
+        room = self.rooms[0]
+        room.users.add(*self.users[:2])
+        self.assertEqual(
+            self.group_channels(room),
+            set(self.channels[self.users[0].id] + self.channels[self.users[1].id]),
+        )
+
+        room.users.remove(self.users[0])
+        self.assertEqual(
+            self.group_channels(room), set(self.channels[self.users[1].id])
+        )
+
+    def test_reverse_m2m_changes_update_subscriptions(self) -> None:
+        user = self.users[2]
+        user.chatroom_set.add(*self.rooms)
+        for room in self.rooms:
+            self.assertEqual(self.group_channels(room), set(self.channels[user.id]))
@@ -0,0 +1,159 @@
+import asyncio
+from typing import Any
+from unittest import mock
+
+from django.contrib import admin
+from django.contrib.auth import get_user_model
+from django.test import RequestFactory
+from rest_framework.test import APITestCase
+
+from df_chat.ingest import MessageWriteBuffer, PendingMessage
+from df_chat.models import ChatMember, ChatMessage, ChatRoom
+
+User = get_user_model()
+
+
+class UnreadCountTestCase(APITestCase):
+    def setUp(self) -> None:
+        self.user = User.objects.create_user(username="user", password="pass")
+        self.other = User.objects.create_user(username="other", password="pass")
+        self.room = ChatRoom.objects.create(title="room", chat_type="group")
+        self.room.users.add(self.user, self.other)
+        self.client.force_authenticate(self.user)
+
+    def unread(self) -> dict[int, int]:
+        return dict(
+            ChatMember.objects.filter(chat_room=self.room).values_list(
+                "user_id", "unread_count"
+            )
+        )
+
+    def post(self, user: Any, message: str = "hi") -> int:
+        self.client.force_authenticate(user)
+        response = self.client.post(
+            f"/api/v1/chat/rooms/{self.room.id}/messages/", {"message": message}
+        )
+        self.assertEqual(response.status_code, 201)
+        return response.data["id"]
+
+    def test_new_messages_are_unread_for_other_members(self) -> None:
+        self.post(self.other)
+        self.post(self.other)
+        self.post(self.user)
+        self.assertEqual(self.unread(), {self.user.id: 2, self.other.id: 1})
+
+    def test_batches_from_several_authors(self) -> None:
+        buffer = MessageWriteBuffer()
+        # write() doesn't resolve the futures, that is left to the flush.
+        future = mock.Mock(spec=asyncio.Future)
+        buffer.write(
+            [
+                PendingMessage(self.user, self.room.id, "a", future),
+                PendingMessage(self.other, self.room.id, "b", future),
+                PendingMessage(self.other, self.room.id, "c", future),
+            ]
+        )
+        self.assertEqual(self.unread(), {self.user.id: 2, self.other.id: 1})
+
+    def test_mark_read(self) -> None:
+        first = self.post(self.other)
+        self.post(self.other)
+        url = f"/api/v1/chat/rooms/{self.room.id}/read/"
+        self.client.force_authenticate(self.user)
+
+        response = self.client.post(url, {"message_id": first})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            response.data, {"last_read_message_id": first, "unread_count": 1}
+        )
+
+        response = self.client.post(url)
+        self.room.refresh_from_db()
+        self.assertEqual(
+            response.data,
+            {"last_read_message_id": self.room.last_message_id, "unread_count": 0},
+        )
+
+        # The read marker doesn't move backwards.
+        response = self.client.post(url, {"message_id": first})
+        self.assertEqual(response.data["unread_count"], 0)
+        self.assertEqual(
+            response.data["last_read_message_id"], self.room.last_message_id
+        )
+
+    def test_read_marker_is_clamped_to_the_last_message(self) -> None:
+        last = self.post(self.other)
+        url = f"/api/v1/chat/rooms/{self.room.id}/read/"
+        self.client.force_authenticate(self.user)
+
+        for message_id in (10**9, 10**20):
+            response = self.client.post(url, {"message_id": message_id})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(
+                response.data, {"last_read_message_id": last, "unread_count": 0}
+            )
+
+        # Later messages can still be marked as read.
+        newer = [self.post(self.other) for _ in range(3)]
+        self.client.force_authenticate(self.user)
+        self.assertEqual(self.unread()[self.user.id], 3)
+        response = self.client.post(url)
+        self.assertEqual(
+            response.data, {"last_read_message_id": newer[-1], "unread_count": 0}
+        )
+
+    def test_empty_rooms_keep_no_read_marker(self) -> None:
+        empty = ChatRoom.objects.create(title="empty", chat_type="group")
+        empty.users.add(self.user)
+        self.assertEqual(ChatMember.objects.mark_read(self.user.id, empty.id, 5), 0)
+
+    def test_room_list_includes_unread_count(self) -> None:
+        self.post(self.other)
+        self.client.force_authenticate(self.user)
+        response = self.client.get(f"/api/v1/chat/rooms/{self.room.id}/")
+        self.assertEqual(response.data["unread_count"], 1)
+        self.assertIsNone(response.data["last_read_message_id"])
+
+    def test_deleting_an_unread_message(self) -> None:
+        self.post(self.other)
+        message_id = self.post(self.other)
+        ChatMember.objects.mark_read(self.user.id, self.room.id, message_id - 1)
+        self.client.force_authenticate(self.other)
+        response = self.client.delete(
+            f"/api/v1/chat/rooms/{self.room.id}/messages/{message_id}/"
+        )
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.unread(), {self.user.id: 0, self.other.id: 0})
+        self.assertFalse(ChatMessage.objects.filter(pk=message_id).exists())
+
+    def test_bulk_admin_deletes(self) -> None:
+        third = User.objects.create_user(username="third", password="pass")
+        self.room.users.add(third)
+        first = self.post(self.other)
+        self.post(self.other)
+        self.post(self.user)
+        ChatMember.objects.mark_read(third.id, self.room.id, first)
+        self.assertEqual(
+            self.unread(), {self.user.id: 2, self.other.id: 1, third.id: 2}
+        )
+
+        request = RequestFactory().post("/admin/")
+        request.user = self.user
+        admin.site._registry[ChatMessage].delete_queryset(
+            request, ChatMessage.objects.filter(chat_room=self.room)
+        )
+
+        self.assertEqual(
+            self.unread(), {self.user.id: 0, self.other.id: 0, third.id: 0}
+        )
+
+    def test_deleting_an_author(self) -> None:
+        third = User.objects.create_user(username="third", password="pass")
+        self.room.users.add(third)
+        self.post(self.other)
+        self.post(self.user)
+        self.post(self.other)
+
+        self.other.delete()
+
+        self.assertEqual(self.unread(), {self.user.id: 0, third.id: 1})